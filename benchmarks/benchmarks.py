@@ -0,0 +1,134 @@
+"""
+Benchmarks of the generation, fitting, windowing and prediction hot paths,
+in asv style: classes with params, setup and time_* methods. Run them with
+asv or with benchmarks/run.py.
+"""
+import numpy as np
+import tinkerbell.domain.point as tbdpt
+import tinkerbell.domain.make as tbdmk
+import tinkerbell.app.make as tbamk
+
+
+WELLS = [1, 10, 100]
+SAMPLES = [75, 750, 7500]
+
+
+def make_wells(num_wells, num_samples, xmax=90.0, xdisc=40.0):
+    np.random.seed(42)
+    return [tbamk.points_exponential_discontinuous_declinelinear_noisy(50.0, 0.05, xmax, xdisc,
+      num=num_samples) for _ in range(num_wells)]
+
+
+class Generators:
+    params = (WELLS, SAMPLES)
+    param_names = ['num_wells', 'num_samples']
+
+    def time_points_exponential_declinelinear(self, num_wells, num_samples):
+        for _ in range(num_wells):
+            tbamk.points_exponential_discontinuous_declinelinear_noisy(50.0, 0.05, 90.0, 40.0, num=num_samples)
+
+    def time_points_exponential_declinebase2(self, num_wells, num_samples):
+        for _ in range(num_wells):
+            tbamk.points_exponential_discontinuous_declinebase2_noisy(50.0, 0.05, 6.5, 40.0, num=num_samples)
+
+
+class Points:
+    params = (WELLS, SAMPLES)
+    param_names = ['num_wells', 'num_samples']
+
+    def setup(self, num_wells, num_samples):
+        self.wells = make_wells(num_wells, num_samples)
+        self.coordinates = [tbdpt.point_coordinates(pts) for pts, _ in self.wells]
+
+    def time_point_coordinates(self, num_wells, num_samples):
+        for pts, _ in self.wells:
+            tbdpt.point_coordinates(pts)
+
+    def time_detect_stages(self, num_wells, num_samples):
+        for x, y in self.coordinates:
+            tbamk.detect_stages(x, y, num_samples_window=10)
+
+
+class Curves:
+    params = (WELLS, SAMPLES)
+    param_names = ['num_wells', 'num_samples']
+
+    def setup(self, num_wells, num_samples):
+        self.wells = make_wells(num_wells, num_samples)
+        self.k = 2
+        self.t = tbamk.knots_internal_four_heavy_right(40.0, 90.0, 1.0)
+        self.curves = [tbdmk.curve_lsq_fixed_knots(pts, self.t, self.k) for pts, _ in self.wells]
+
+    def time_curve_lsq_fixed_knots(self, num_wells, num_samples):
+        for pts, _ in self.wells:
+            tbdmk.curve_lsq_fixed_knots(pts, self.t, self.k)
+
+    def time_xycoordinates(self, num_wells, num_samples):
+        for curve in self.curves:
+            curve.xycoordinates(num_samples)
+
+
+class Windows:
+    params = (WELLS, SAMPLES, [3, 10])
+    param_names = ['num_wells', 'num_samples', 'num_timesteps']
+
+    def setup(self, num_wells, num_samples, num_timesteps):
+        import tinkerbell.app.model as tbamd
+        self.tbamd = tbamd
+        self.series = []
+        for pts, ixdisc in make_wells(num_wells, num_samples):
+            time, production = tbdpt.point_coordinates(pts)
+            stage = np.zeros_like(time)
+            stage[ixdisc:] = 1.0
+            self.series += [(time, production, stage)]
+
+    def time_windows_seqwin(self, num_wells, num_samples, num_timesteps):
+        for time, production, stage in self.series:
+            self.tbamd.windows_seqwin(production.reshape(-1, 1), stage.reshape(-1, 1), num_timesteps, 1)
+
+    def time_windows_seqwingrad(self, num_wells, num_samples, num_timesteps):
+        for time, production, stage in self.series:
+            dp_dt = (np.diff(production) / np.diff(time)).reshape(-1, 1)
+            stage_delta = np.diff(stage).reshape(-1, 1)
+            self.tbamd.windows_seqwingrad(dp_dt, dp_dt, stage_delta, num_timesteps, 1)
+
+
+class Predict:
+    """
+    Per step prediction with tiny models trained for a single epoch.
+    """
+    params = ([1, 4], [25, 100])
+    param_names = ['num_wells', 'num_samples']
+    timeout = 600
+
+    def setup(self, num_wells, num_samples):
+        try:
+            import keras # tinkerbell.app.model imports it lazily, so check here
+        except ImportError:
+            raise NotImplementedError('keras not available')
+        import tinkerbell.app.model as tbamd
+        self.tbamd = tbamd
+        self.series = []
+        for pts, ixdisc in make_wells(num_wells, num_samples):
+            time, production = tbdpt.point_coordinates(pts)
+            stage = np.zeros_like(time)
+            stage[ixdisc:] = 1.0
+            self.series += [(time, production, stage)]
+        time, production, stage = self.series[0]
+        self.bundles = {kind: tbamd.fit_bundle(kind, time, production, stage, num_epochs=1, num_timesteps=3)
+          for kind in ('lstm', 'lstmseqwin', 'lstmseqwingrad')}
+
+    def time_predict(self, num_wells, num_samples):
+        bundle = self.bundles['lstm']
+        for time, production, stage in self.series:
+            self.tbamd.predict(production[0], stage, bundle.normalizer, bundle.model, time)
+
+    def time_predictseqwin(self, num_wells, num_samples):
+        bundle = self.bundles['lstmseqwin']
+        for time, production, stage in self.series:
+            self.tbamd.predictseqwin(production[:3], stage, bundle.normalizer, bundle.model, 1)
+
+    def time_predictseqwingrad(self, num_wells, num_samples):
+        bundle = self.bundles['lstmseqwingrad']
+        for time, production, stage in self.series:
+            self.tbamd.predictseqwingrad(production[:4], time, stage, bundle.normalizer, bundle.model, 1)
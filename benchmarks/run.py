@@ -0,0 +1,95 @@
+"""
+Runs the asv style benchmarks without asv and writes the timings to json,
+or compares two such files.
+
+python -m benchmarks.run [--filter Windows] [--out bench.json]
+python -m benchmarks.run --compare bench_old.json bench_new.json
+"""
+import json
+import time as tm
+import inspect
+import platform
+import argparse
+import itertools as it
+import subprocess
+import timeit
+import numpy as np
+import benchmarks.benchmarks as bm
+
+
+def version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+          stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def suites(pattern=''):
+    for name, cls in inspect.getmembers(bm, inspect.isclass):
+        if cls.__module__ == bm.__name__ and hasattr(cls, 'params'):
+            for method in sorted(m for m in dir(cls) if m.startswith('time_')):
+                if pattern in '{0}.{1}'.format(name, method):
+                    yield name, cls, method
+
+
+def time_case(cls, method, params, repeat, time_min):
+    instance = cls()
+    if hasattr(instance, 'setup'):
+        instance.setup(*params)
+    fct = getattr(instance, method)
+    timer = timeit.Timer(lambda: fct(*params))
+    number, _ = timer.autorange() if time_min > 0.0 else (1, None)
+    times = np.array(timer.repeat(repeat, number)) / number
+    return {'min': float(np.min(times)), 'median': float(np.median(times)), 'number': number,
+      'repeat': repeat}
+
+
+def run(pattern='', repeat=5, time_min=0.2):
+    results = []
+    for name, cls, method in suites(pattern):
+        for params in it.product(*cls.params):
+            case = {'name': '{0}.{1}'.format(name, method), 'params': dict(zip(cls.param_names, params))}
+            try:
+                case.update(time_case(cls, method, params, repeat, time_min))
+            except NotImplementedError as e:
+                case['skipped'] = str(e)
+            results += [case]
+            print(case['name'], case['params'], case.get('min', case.get('skipped')), flush=True)
+    return {'version': version(), 'date': tm.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+      'numpy': np.__version__, 'machine': platform.machine(), 'results': results}
+
+
+def compare(fname_old, fname_new, threshold=1.2):
+    """
+    Prints the ratio new/old of every case in both files, flags ratios above threshold.
+    """
+    with open(fname_old) as f:
+        old = {(r['name'], json.dumps(r['params'], sort_keys=True)): r for r in json.load(f)['results']}
+    with open(fname_new) as f:
+        new = json.load(f)['results']
+    for r in new:
+        key = (r['name'], json.dumps(r['params'], sort_keys=True))
+        if key in old and 'min' in r and 'min' in old[key]:
+            ratio = r['min'] / old[key]['min']
+            flag = ' <<' if ratio > threshold else ''
+            print('{0:50s} {1:40s} {2:6.2f}{3}'.format(key[0], key[1], ratio, flag))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='benchmarks.run')
+    parser.add_argument('--filter', default='')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--out', default='bench.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+    results = run(args.filter, args.repeat)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
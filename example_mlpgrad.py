@@ -7,7 +7,9 @@ import tinkerbell.domain.make as tbdmk
 import tinkerbell.domain.point as tbdpt
 import tinkerbell.app.make as tbamk
 import tinkerbell.app.model as tbamd
+import tinkerbell.app.features as tbafe
 import tinkerbell.app.rcparams as tbarc
+import tinkerbell.app.telemetry as tbatm
 import pandas as pd
 import numpy as np
 import sklearn.preprocessing as preproc
@@ -80,25 +82,14 @@ def do_the_thing():
     assert len(allpts) == len(allstages)
 
     offset_pred = 1
-    num_sequences = len(allpts)
-    features = []
-    targets = []
-
-    for isequence in range(num_sequences):
-        time, production = tbdpt.point_coordinates(allpts[isequence])
-        dp_dt = np.diff(production) / np.diff(time)
-        stage_delta = np.diff(allstages[isequence])
-        for idiff in range(len(dp_dt)-offset_pred-size_window):
-            features_diff = []
-            targets_diff = []
-            for iwindow in range(size_window):
-                features_diff += [dp_dt[idiff+iwindow], stage_delta[idiff+iwindow]]
-            targets_diff += [dp_dt[idiff+size_window]]
-            features += [features_diff]
-            targets += [targets_diff]
-
-    features = np.array(features)
-    targets = np.array(targets)
+    engine = tbafe.FeatureEngine(tbafe.SPEC_GRAD) # dp_dt, stage delta
+    times = [tbdpt.point_coordinates(pts)[0] for pts in allpts]
+    productions = [tbdpt.point_coordinates(pts)[1] for pts in allpts]
+    matrix, offsets = engine(times, production=productions, stage=allstages)
+    windows, last = tbafe.windows(matrix, offsets, size_window, offset_forecast=offset_pred,
+      num_history=engine.num_history)
+    features = windows.reshape(len(windows), -1) # dp_dt and stage delta interleaved per step
+    targets = matrix[last+offset_pred, :1]
 
     print(features.shape, targets.shape)  
 
@@ -118,20 +109,9 @@ def do_the_thing():
 
         num_epochs = 500
 
-        History = collections.namedtuple("History", "history")
-        
-        with tbamd.ProgressBar(num_epochs) as progress_bar:
-            progress_bar.iepoch = 0
-
-            def advance_progress_bar(logs):
-                history = History(logs)                
-                progress_bar.update(progress_bar.iepoch, history)
-                progress_bar.iepoch += 1
-            
-            after_epoch = kec.LambdaCallback(on_epoch_end=lambda batch, logs : advance_progress_bar(logs))
-
-            model.fit(features_normalized, targets_normalized, epochs=num_epochs, batch_size=1,
-              callbacks=[after_epoch], verbose=0)
+        telemetry = tbatm.Telemetry('data_demo/telemetry_mlpgrad.jsonl', num_samples=len(features_normalized))
+        model.fit(features_normalized, targets_normalized, epochs=num_epochs, batch_size=1,
+          callbacks=[telemetry], verbose=0)
 
         model.save(FNAME_MODEL)
     else:
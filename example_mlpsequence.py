@@ -8,6 +8,7 @@ import tinkerbell.domain.point as tbdpt
 import tinkerbell.app.make as tbamk
 import tinkerbell.app.model as tbamd
 import tinkerbell.app.rcparams as tbarc
+import tinkerbell.app.telemetry as tbatm
 import pandas as pd
 import numpy as np
 import sklearn.preprocessing as preproc
@@ -96,20 +97,9 @@ def do_the_thing():
 
         num_epochs = 200
 
-        History = collections.namedtuple("History", "history")
-        
-        with tbamd.ProgressBar(num_epochs) as progress_bar:
-            progress_bar.iepoch = 0
-
-            def advance_progress_bar(logs):
-                history = History(logs)                
-                progress_bar.update(progress_bar.iepoch, history)
-                progress_bar.iepoch += 1
-            
-            after_epoch = kec.LambdaCallback(on_epoch_end=lambda batch, logs : advance_progress_bar(logs))
-
-            model.fit(features_normalized, targets_normalized, epochs=num_epochs, batch_size=2,
-              callbacks=[after_epoch], verbose=0)
+        telemetry = tbatm.Telemetry('data_demo/telemetry_mlpgradseq.jsonl', num_samples=len(features_normalized))
+        model.fit(features_normalized, targets_normalized, epochs=num_epochs, batch_size=2,
+          callbacks=[telemetry], verbose=0)
 
         model.save(FNAME_MODEL)
     else:
@@ -0,0 +1,24 @@
+"""
+Two stage time series regression as cached pipeline, rerunning only recomputes
+the steps whose parameters (or upstream steps) changed.
+"""
+import logging as log
+import numpy as np
+import tinkerbell.app.pipeline as tbapp
+import tinkerbell.app.plot as tbapl
+import tinkerbell.app.rcparams as tbarc
+
+
+if __name__ == '__main__':
+    log.basicConfig(level=log.INFO)
+    pipeline = tbapp.Pipeline()
+
+    data = pipeline.step(tbapp.generate_time_stage, y0=tbarc.rcparams['shale.lstm.y0_mean'],
+      d=tbarc.rcparams['shale.lstm_stage.d'], xmax=tbarc.rcparams['shale.lstm_stage.xmax'],
+      xdisc=tbarc.rcparams['shale.lstm_stage.xdisc_mean'], num_points=tbarc.rcparams['shale.lstm_stage.num_points'])
+    normalizer = pipeline.step(tbapp.fit_normalizer, data)
+    model = pipeline.step(tbapp.train_lstm, data, normalizer, serializer='model', num_epochs=500, num_neurons=3)
+    yhat = pipeline.step(tbapp.predict_lstm, data, normalizer, model)
+
+    time, production, _ = data.value
+    tbapl.plot([(time[:-1], production[:-1]), (time[:-1], yhat.value)], styles=['p', 'l'], labels=['ytrain', 'yhat'])
@@ -0,0 +1,21 @@
+"""
+Sweep over window length and units of the windowed LSTM on the two stage training set.
+"""
+import pandas as pd
+import logging as log
+import tinkerbell.app.sweep as tbasw
+import tinkerbell.app.rcparams as tbarc
+
+
+if __name__ == '__main__':
+    log.basicConfig(level=log.INFO)
+    series = pd.read_csv(tbarc.rcparams['shale.lstm_stage.fnamecsv'])
+    production = series['y'].values
+    time = series['x'].values
+    stage = series['stage'].values
+
+    param_grid = {'num_epochs': [100], 'num_timesteps': [2, 3, 5], 'num_units': [3, 6]}
+    metrics = tbasw.sweep('lstmseqwin', param_grid, time, production, stage, 'data_demo/sweep',
+      num_workers=4, num_epochs_prune=10, fraction_keep=0.5)
+    for m in metrics:
+        print(m['rmse'], m['pruned'], m['params'])
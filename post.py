@@ -3,8 +3,8 @@ Whole sequence lstm trained on multiple sequences, incl NA val
 """
 
 import tinkerbell.app.plot as tbapl
+import tinkerbell.app.prefix as tbapx
 import numpy as np
-import sklearn.preprocessing as preproc
 import pickle, sys, collections
 
 import keras.models as kem
@@ -69,53 +69,42 @@ def do_the_thing(p0, exp_stage_zero, exp_stage_one, time_max):
     
 
     num_production_profiles = num_realizations_per_stage_change * num_discrete_stage_changes    
-    # for each training sequence we provide it from first datapoint only to the next to last one
-    num_sequences_per_profile = num_timesteps - 1
-    num_sequences = num_production_profiles * num_sequences_per_profile
 
     ifeature_production = 0
     ifeature_stage = 1
-    itarget_production = 0
 
     NA = -p0
 
-    features = np.full((num_sequences, num_timesteps, num_features), NA)
-    targets = np.full((num_sequences, num_timesteps, num_targets), NA)
+    # each profile is stored once, for each training sequence the batches provide it from the 
+    # first datapoint only to the next to last one (NA beyond)
+    productions = np.empty((num_production_profiles, num_timesteps))
+    stages = np.empty_like(productions)
 
     np.random.seed(42)
-    isample = 0
-    production = np.empty((num_timesteps, 1))
-    stage = np.empty_like(production)
+    iprofile = 0
     for time_stage_change in np.linspace(*bounds_stage_change_time, num_discrete_stage_changes):
         for _ in range(num_realizations_per_stage_change):
             t, q, s = calc_two_stage_decline(p0, exp_stage_zero, exp_stage_one, time_max, time_stage_change, 
               num=num_timesteps) 
-            for num_sample_points in range(1, num_timesteps):
-                features[isample, :, ifeature_stage] = s[:] 
-                features[isample, :num_sample_points, ifeature_production] = q[:num_sample_points]
-                targets[isample, 1:, itarget_production] = q[1:] 
-                isample += 1
-
-    features = features.reshape(num_sequences*num_timesteps, num_features)
-    normalizer_features = preproc.MinMaxScaler(feature_range=(0, 1), copy=False)
-    normalizer_features.fit_transform(features)
-    features = features.reshape(num_sequences, num_timesteps, num_features)
-
-    targets = targets.reshape(num_sequences*num_timesteps, num_targets)
-    normalizer_targets = preproc.MinMaxScaler(feature_range=(0, 1), copy=False)
-    normalizer_targets.fit_transform(targets)
-    targets = targets.reshape(num_sequences, num_timesteps, num_targets)
+            productions[iprofile, :] = q
+            stages[iprofile, :] = s
+            iprofile += 1
+
+    # batch_size should be whole denominator of num sequences per curve
+    batches = tbapx.PrefixBatches(productions, stages, NA, batch_size=5)
+    normalizer_features = batches.normalizer_features
+    normalizer_targets = batches.normalizer_targets
     
     if 0:
-        print(features)
-        print(targets)
+        print(batches.tensors())
         l()
 
     if 1:
         model = make_rnn(num_features, num_targets, num_timesteps, num_units)
 
-        # batch_size should be whole denominator of num sequences per curve
-        model.fit(features, targets, epochs=2, batch_size=5, validation_split=0.2)
+        batches_train, batches_validation = batches.split(0.2)
+        model.fit(batches_train.generator(), steps_per_epoch=len(batches_train), epochs=2,
+          validation_data=batches_validation.generator(shuffle=False), validation_steps=len(batches_validation))
 
         model.save(FNAME_MODEL)
     else:
@@ -135,12 +124,12 @@ def do_the_thing(p0, exp_stage_zero, exp_stage_one, time_max):
     features[0, :, ifeature_production] = production_in[:, 0]
     features[0, :, ifeature_stage] = stage_in[:, 0]
     features = features.reshape(num_timesteps, num_features)
-    normalizer_features.transform(features)
+    features = normalizer_features.transform(features)
     features = features.reshape(1, num_timesteps, num_features)    
     targets = model.predict(features) 
 
     targets = targets.reshape(num_timesteps, num_targets)
-    normalizer_targets.inverse_transform(targets)
+    targets = normalizer_targets.inverse_transform(targets)
 
     tbapl.plot([(time[1:], targets[1:, 0]), (time, production)], ['l', 'p'])
     sys.exit()
@@ -1,3 +1,3 @@
-from . import domain
-from . import app
-from . import persistance
\ No newline at end of file
+import tinkerbell.lazy as tblz
+
+__getattr__ = tblz.submodules(__name__, ('domain', 'app', 'persistance', 'profiling', 'lazy'))
@@ -0,0 +1,140 @@
+import argparse
+import logging as log
+
+
+def forecast(args):
+    import tinkerbell.app.forecast as tbafc
+    num_wells, num_failed = tbafc.run(args.wells, args.bundle, args.out, num_workers=args.workers,
+      num_threads=args.threads, num_forecast=args.num_forecast, num_stages_max=args.num_stages_max,
+      num_samples_window=args.num_samples_window, shared=args.shared)
+    print('Forecast {0:d} wells to \'{1}\', {2:d} failed.'.format(num_wells, args.out, num_failed))
+
+
+def ensemble(args):
+    import tinkerbell.app.ensemble as tbaen
+    num_wells, num_failed = tbaen.run(args.wells, args.bundle, args.out, num_workers=args.workers,
+      num_threads=args.threads, num_forecast=args.num_forecast, num_stages_max=args.num_stages_max,
+      num_samples_window=args.num_samples_window, num_members=args.members, num_members_batch=args.members_batch,
+      noise_init=args.noise_init, noise=args.noise, sigma_stage_shift=args.sigma_stage_shift, seed=args.seed)
+    print('Ensemble forecast {0:d} wells to \'{1}\', {2:d} failed.'.format(num_wells, args.out, num_failed))
+
+
+def backtest(args):
+    import tinkerbell.app.backtest as tbabt
+    import tinkerbell.domain.well as tbdwl
+    params = {kind: {'num_epochs': args.num_epochs} for kind in args.kinds}
+    runs = tbabt.backtest(list(tbdwl.read_wells(args.wells)), kinds=args.kinds, cutoffs=args.cutoffs, params=params,
+      fname_bundle=args.bundle, dirname_cache=args.cache, num_workers=args.workers, num_threads=args.threads,
+      num_stages_max=args.num_stages_max, num_samples_window=args.num_samples_window)
+    rows = tbabt.summary(runs, horizons=args.horizons)
+    print(tbabt.format_summary(rows))
+    if args.out:
+        tbabt.write_summary(rows, args.out)
+
+
+def fleet(args):
+    import tinkerbell.app.fleet as tbafl
+    params = {'num_epochs': args.num_epochs, 'num_units': args.num_units, 'num_timesteps': args.num_timesteps}
+    records = tbafl.train_fleet(args.wells, args.out, kind=args.kind, params=params, version=args.version,
+      num_workers=args.workers, num_threads=args.threads, num_stages_max=args.num_stages_max,
+      num_samples_window=args.num_samples_window)
+    statuses = [record['status'] for record in records]
+    print('Fleet in \'{0}\': {1:d} trained, {2:d} current, {3:d} failed.'.format(args.out,
+      statuses.count('trained'), statuses.count('current'), statuses.count('failed')))
+
+
+def ingest(args):
+    import tinkerbell.app.ingest as tbain
+    _, counters = tbain.ingest(args.files, args.out, num_workers=args.workers, num_threads=args.threads,
+      max_queue=args.queue, batch_size=args.batch_size, num_min=args.num_min, time_step=args.time_step, num_stages_max=args.num_stages_max,
+      num_samples_window=args.num_samples_window)
+    print(tbain.format_counters(counters))
+
+
+def parser():
+    parser = argparse.ArgumentParser(prog='tinkerbell')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    parser_wells = argparse.ArgumentParser(add_help=False) # arguments shared by forecast and ensemble
+    parser_wells.add_argument('wells', help='multi-well json or raw series csv')
+    parser_wells.add_argument('bundle', help='model bundle, without .h5/.bundle extension')
+    parser_wells.add_argument('out', help='output csv')
+    parser_wells.add_argument('--workers', type=int, default=None)
+    parser_wells.add_argument('--threads', type=int, default=1, help='TensorFlow threads per worker')
+    parser_wells.add_argument('--num-forecast', type=int, default=0, help='samples beyond the history')
+    parser_wells.add_argument('--num-stages-max', type=int, default=None)
+    parser_wells.add_argument('--num-samples-window', type=int, default=10)
+
+    parser_forecast = commands.add_parser('forecast', parents=[parser_wells],
+      help='forecast every well of a multi-well source')
+    parser_forecast.add_argument('--shared', action='store_true',
+      help='share the model weights between the workers, forecasting in numpy')
+    parser_forecast.set_defaults(fct=forecast)
+
+    parser_ensemble = commands.add_parser('ensemble', parents=[parser_wells],
+      help='P90/P50/P10 Monte Carlo forecast of every well of a multi-well source')
+    parser_ensemble.add_argument('--members', type=int, default=1000)
+    parser_ensemble.add_argument('--members-batch', type=int, default=100, help='members rolled out at once')
+    parser_ensemble.add_argument('--noise-init', type=float, default=0.05, help='std of the initial window factor')
+    parser_ensemble.add_argument('--noise', type=float, default=0.05, help='std of the per step factor')
+    parser_ensemble.add_argument('--sigma-stage-shift', type=float, default=1.0, help='std of the stage shift, samples')
+    parser_ensemble.add_argument('--seed', type=int, default=None)
+    parser_ensemble.set_defaults(fct=ensemble)
+
+    parser_backtest = commands.add_parser('backtest', help='rolling origin backtest of models on a multi-well source')
+    parser_backtest.add_argument('wells', help='multi-well json or raw series csv')
+    parser_backtest.add_argument('--kinds', nargs='+', default=['lstmseqwin', 'decline'],
+      choices=['lstm', 'lstmseqwin', 'lstmseqwingrad', 'decline'])
+    parser_backtest.add_argument('--cutoffs', nargs='+', type=float, default=[0.6, 0.7, 0.8],
+      help='fractions of the samples (< 1) or sample indices')
+    parser_backtest.add_argument('--horizons', nargs='+', type=int, default=[1, 3, 6, 12])
+    parser_backtest.add_argument('--bundle', default=None, help='apply this bundle to its kind instead of training')
+    parser_backtest.add_argument('--num-epochs', type=int, default=1000)
+    parser_backtest.add_argument('--cache', default=None, help='directory caching the bundles trained per cutoff')
+    parser_backtest.add_argument('--out', default=None, help='summary csv')
+    parser_backtest.add_argument('--workers', type=int, default=None)
+    parser_backtest.add_argument('--threads', type=int, default=1, help='TensorFlow threads per worker')
+    parser_backtest.add_argument('--num-stages-max', type=int, default=None)
+    parser_backtest.add_argument('--num-samples-window', type=int, default=10)
+    parser_backtest.set_defaults(fct=backtest)
+
+    parser_fleet = commands.add_parser('fleet', help='train a model per well of a multi-well source')
+    parser_fleet.add_argument('wells', help='multi-well json or raw series csv')
+    parser_fleet.add_argument('out', help='directory of the bundles and progress.jsonl')
+    parser_fleet.add_argument('--kind', default='lstm', choices=['lstm', 'lstmseqwin', 'lstmseqwingrad'])
+    parser_fleet.add_argument('--num-epochs', type=int, default=1000)
+    parser_fleet.add_argument('--num-units', type=int, default=3)
+    parser_fleet.add_argument('--num-timesteps', type=int, default=3)
+    parser_fleet.add_argument('--version', type=int, default=1, help='model version in the bundle names')
+    parser_fleet.add_argument('--workers', type=int, default=None)
+    parser_fleet.add_argument('--threads', type=int, default=1, help='TensorFlow threads per worker')
+    parser_fleet.add_argument('--num-stages-max', type=int, default=None)
+    parser_fleet.add_argument('--num-samples-window', type=int, default=10)
+    parser_fleet.set_defaults(fct=fleet)
+
+    parser_ingest = commands.add_parser('ingest', help='ingest multi-well sources into per well features')
+    parser_ingest.add_argument('files', nargs='+', help='multi-well jsons or raw series csvs')
+    parser_ingest.add_argument('--out', required=True, help='directory of the per well .npz and the normalizer')
+    parser_ingest.add_argument('--workers', type=int, default=None, help='processes of the CPU stages')
+    parser_ingest.add_argument('--threads', type=int, default=4, help='threads reading and writing files')
+    parser_ingest.add_argument('--queue', type=int, default=64, help='items queued at most between stages')
+    parser_ingest.add_argument('--batch-size', type=int, default=16, help='items per round trip to a pool')
+    parser_ingest.add_argument('--num-min', type=int, default=10, help='samples a well needs to be kept')
+    parser_ingest.add_argument('--time-step', type=float, default=None, help='resample to this step')
+    parser_ingest.add_argument('--num-stages-max', type=int, default=None)
+    parser_ingest.add_argument('--num-samples-window', type=int, default=10)
+    parser_ingest.set_defaults(fct=ingest)
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if args.verbose:
+        log.basicConfig(level=log.INFO)
+    args.fct(args)
+
+
+if __name__ == '__main__':
+    main()
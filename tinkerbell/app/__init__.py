@@ -1,4 +1,5 @@
-from . import make
-from . import model
-from . import plot
-from . import rcparams
\ No newline at end of file
+import tinkerbell.lazy as tblz
+
+__getattr__ = tblz.submodules(__name__, ('make', 'model', 'plot', 'rcparams', 'parallel', 'forecast', 'sweep',
+  'telemetry', 'pipeline', 'decline', 'ensemble', 'features', 'prefix', 'scaler',
+  'backtest', 'online', 'fleet', 'ingest', 'kpi', 'shared'))
@@ -0,0 +1,208 @@
+"""
+Rolling origin backtests of the forecast models.
+
+Every well is cut at several points, the model is trained on (or, given a
+bundle, applied to) the history before the cutoff and its rollout from the
+cutoff is scored against the held out tail, per forecast horizon. Stages are
+detected on the history only and held beyond the cutoff, as when forecasting.
+Wells x cutoffs run in parallel processes and trained bundles are cached by
+the hash of their kind, parameters and history.
+"""
+import os
+import csv
+import warnings
+import collections as coll
+import numpy as np
+import logging as log
+import tinkerbell.app.make as tbamk
+import tinkerbell.app.model as tbamd
+import tinkerbell.app.decline as tbadc
+import tinkerbell.app.forecast as tbafc
+import tinkerbell.app.parallel as tbapa
+import tinkerbell.persistance.cache as tbpc
+
+
+KINDS = ('lstm', 'lstmseqwin', 'lstmseqwingrad', 'decline')
+FNAME_BUNDLE = 'bundle'
+COLUMNS = ('kind', 'horizon', 'num_runs', 'mae', 'rmse', 'mape', 'bias')
+
+Run = coll.namedtuple("Run", "well cutoff kind forecast actual")
+
+
+def cutoff_indices(num_samples, cutoffs, num_min=10):
+    """
+    Returns the sample indices of cutoffs, given as fractions of num_samples (< 1)
+    or indices, that leave at least num_min samples of history and one to score.
+    """
+    indices = [int(round(c*num_samples)) if c < 1 else int(c) for c in cutoffs]
+    return sorted(set(i for i in indices if num_min <= i < num_samples))
+
+
+def stage_history(time, production, cutoff, num_stages_max=None, num_samples_window=10):
+    stage = tbamk.detect_stages(time[:cutoff], production[:cutoff], num_stages_max=num_stages_max,
+      num_samples_window=num_samples_window)
+    return np.r_[stage, np.full(len(time)-cutoff, stage[-1], dtype=stage.dtype)]
+
+
+def rollout(bundle, time, production, stage, cutoff):
+    """
+    Returns the forecast of samples cutoff: of the bundle rolled out from the observations
+    just before the cutoff, nan where the rollout ends early.
+    """
+    start = cutoff - tbafc.num_init(bundle)
+    if start < 0:
+        raise ValueError('Cutoff {0:d} leaves too little history for the bundle.'.format(cutoff))
+    yhat = tbafc.FORECASTERS[bundle.kind](bundle, time[start:], production[start:], stage[start:])
+    forecast = np.full(len(time)-cutoff, np.nan)
+    forecast[:len(yhat)-(cutoff-start)] = yhat[cutoff-start:][:len(forecast)]
+    return forecast
+
+
+def forecast_decline(time, production, stage, cutoff):
+    """
+    Returns the hyperbolic decline forecast of samples cutoff: fitted per stage on the history.
+    """
+    history = [a[np.newaxis, :cutoff] for a in (time, production, stage)]
+    params = tbadc.fit_hyperbolic(*history)
+    return tbadc.rate(params, time[np.newaxis, cutoff:], stage[np.newaxis, cutoff:])[0]
+
+
+def bundle_cutoff(kind, params, time, production, stage, cutoff, cache):
+    """
+    Returns the bundle trained on the history before cutoff, from the cache (if any) when trained before.
+    """
+    key = tbpc.key('backtest', kind, params, time[:cutoff], production[:cutoff], stage[:cutoff])
+    dirname = cache.get(key) if cache is not None else None
+    if dirname is not None:
+        return tbamd.load_bundle(os.path.join(dirname, FNAME_BUNDLE))
+    bundle = tbamd.fit_bundle(kind, time[:cutoff], production[:cutoff], stage[:cutoff], **params)
+    if cache is not None:
+        cache.put(key, lambda d: tbamd.save_bundle(bundle, os.path.join(d, FNAME_BUNDLE)))
+    return bundle
+
+
+def run_cutoff(kind, well, cutoff, params=None, cache=None, bundle=None, num_stages_max=None,
+               num_samples_window=10):
+    """
+    Returns the Run of one well, cutoff and model kind, a given bundle is applied instead of trained.
+    """
+    time, production = well.time, well.production
+    stage = stage_history(time, production, cutoff, num_stages_max, num_samples_window)
+    if kind == 'decline':
+        forecast = forecast_decline(time, production, stage, cutoff)
+    else:
+        if bundle is None:
+            bundle = bundle_cutoff(kind, params or {}, time, production, stage, cutoff, cache)
+        forecast = rollout(bundle, time, production, stage, cutoff)
+    return Run(well.name, cutoff, kind, forecast, production[cutoff:])
+
+
+_cache = None
+_bundle = None
+
+
+def _init_worker(dirname_cache, fname_bundle, num_threads):
+    global _cache, _bundle
+    tbapa.limit_threads(num_threads, num_threads)
+    _cache = tbpc.Cache(dirname_cache) if dirname_cache else None
+    _bundle = tbamd.load_bundle(fname_bundle) if fname_bundle else None
+
+
+def _run_cutoff_worker(args):
+    kind, well, cutoff, params, options = args
+    try:
+        bundle = _bundle if kind != 'decline' and _bundle is not None and _bundle.kind == kind else None
+        return run_cutoff(kind, well, cutoff, params, _cache, bundle, **options)
+    except Exception as e:
+        log.error('Backtest {0} of well \'{1}\' at {2:d} failed: {3}'.format(kind, well.name, cutoff, e))
+        return None
+
+
+def backtest(wells, kinds=('lstmseqwin', 'decline'), cutoffs=(0.6, 0.7, 0.8), params=None, fname_bundle=None,
+             dirname_cache=None, num_workers=None, num_threads=1, num_min=10, num_stages_max=None,
+             num_samples_window=10):
+    """
+    Returns the Runs of all wells x cutoffs x kinds, ordered by well, cutoff and kind.
+    params maps kinds to their fit_bundle keyword arguments. With fname_bundle its kind is
+    applied rather than trained, trained bundles are cached in dirname_cache if given.
+    """
+    params = params or {}
+    options = {'num_stages_max': num_stages_max, 'num_samples_window': num_samples_window}
+    jobs = [(kind, well, cutoff, params.get(kind, {}), options) for well in wells
+      for cutoff in cutoff_indices(len(well.time), cutoffs, num_min) for kind in kinds]
+    runs = []
+    with tbapa.pool(num_workers, _init_worker, (dirname_cache, fname_bundle, num_threads)) as workers:
+        for run in workers.imap_unordered(_run_cutoff_worker, jobs):
+            if run is not None:
+                runs += [run]
+                log.info('Backtested {0:d} of {1:d}.'.format(len(runs), len(jobs)))
+    order = {(job[1].name, job[2], job[0]): i for i, job in enumerate(jobs)}
+    return sorted(runs, key=lambda run: order[(run.well, run.cutoff, run.kind)])
+
+
+def errors(runs):
+    """
+    Returns the forecast and actual (num_runs, max horizon) matrices of runs, padded with nan.
+    """
+    return tbadc.pad([run.forecast for run in runs]), tbadc.pad([run.actual for run in runs])
+
+
+def metrics(runs):
+    """
+    Returns the per horizon (column h is h+1 samples ahead) count, mae, rmse, mape and bias
+    of the runs, over the runs that forecast that horizon.
+    """
+    forecast, actual = errors(runs)
+    error = forecast - actual
+    valid = np.isfinite(error)
+    count = valid.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # horizons no run reaches
+        error_relative = np.where(actual > 0.0, np.abs(error) / actual, np.nan)
+        return {'num_runs': count,
+          'mae': np.nanmean(np.where(valid, np.abs(error), np.nan), axis=0),
+          'rmse': np.sqrt(np.nanmean(np.where(valid, error**2, np.nan), axis=0)),
+          'mape': np.nanmean(error_relative, axis=0),
+          'bias': np.nanmean(np.where(valid, error, np.nan), axis=0)}
+
+
+def summary(runs, horizons=(1, 3, 6, 12)):
+    """
+    Returns the rows (see COLUMNS) of the metrics per kind at horizons (samples ahead).
+    """
+    rows = []
+    for kind in sorted(set(run.kind for run in runs)):
+        metrics_kind = metrics([run for run in runs if run.kind == kind])
+        num_horizons = len(metrics_kind['num_runs'])
+        for horizon in horizons:
+            if horizon <= num_horizons:
+                rows += [(kind, horizon) + tuple(metrics_kind[c][horizon-1] for c in COLUMNS[2:])]
+    return rows
+
+
+def format_summary(rows):
+    lines = ['{0:16s}{1:>8s}{2:>10s}{3:>12s}{4:>12s}{5:>8s}{6:>12s}'.format(*COLUMNS)]
+    for row in rows:
+        lines += ['{0:16s}{1:8d}{2:10d}{3:12.4g}{4:12.4g}{5:8.3f}{6:12.4g}'.format(*row)]
+    return '\n'.join(lines)
+
+
+def write_summary(rows, fname):
+    with open(fname, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+
+
+def test_metrics():
+    runs = [Run('a', 5, 'decline', np.array([1.0, 2.0, 3.0]), np.array([1.0, 1.0, 1.0])),
+      Run('b', 5, 'decline', np.array([2.0, np.nan]), np.array([1.0, 1.0])),
+      Run('a', 5, 'lstm', np.array([1.0]), np.array([2.0]))]
+    m = metrics(runs[:2])
+    assert np.array_equal(m['num_runs'], [2, 1, 1])
+    assert np.allclose(m['mae'], [0.5, 1.0, 2.0]) and np.allclose(m['mape'], [0.5, 1.0, 2.0])
+    assert np.allclose(m['rmse'], [np.sqrt(0.5), 1.0, 2.0]) and np.allclose(m['bias'], [0.5, 1.0, 2.0])
+    rows = summary(runs, horizons=(1, 3))
+    assert [row[:3] for row in rows] == [('decline', 1, 2), ('decline', 3, 1), ('lstm', 1, 1)]
+    assert np.isclose(rows[2][6], -1.0)
+    assert cutoff_indices(50, (0.1, 0.5, 25, 60)) == [25]
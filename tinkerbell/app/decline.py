@@ -0,0 +1,136 @@
+"""
+Batch Arps decline fitting per well and stage, a cheap physics baseline.
+
+Wells are passed as (num_wells, num_samples) matrices padded with nan
+(time, production) and -1 (stage, as returned by detect_stages), every
+stage of every well is fitted at once with time relative to the stage start.
+"""
+import collections as coll
+import numpy as np
+import tinkerbell.app.make as tbamk
+
+
+DeclineParams = coll.namedtuple("DeclineParams", "q_i d b time_start")
+
+
+def pad(arrays, fill=np.nan, dtype=float):
+    """
+    Returns the ragged arrays as (len(arrays), max length) matrix padded with fill.
+    """
+    matrix = np.full((len(arrays), max(len(a) for a in arrays)), fill, dtype=dtype)
+    for i, a in enumerate(arrays):
+        matrix[i, :len(a)] = a
+    return matrix
+
+
+def _groups(time, production, stage):
+    """
+    Returns the flat group index (well*num_stages + stage), relative time and
+    log production of all valid samples, and the stage start times.
+    """
+    num_wells = time.shape[0]
+    num_stages = int(np.max(stage)) + 1
+    valid = (stage >= 0) & np.isfinite(time) & np.isfinite(production) & (production > 0.0)
+    iwell = np.broadcast_to(np.arange(num_wells)[:, None], time.shape)[valid]
+    group = iwell*num_stages + stage[valid]
+    time_start = np.full(num_wells*num_stages, np.inf)
+    np.minimum.at(time_start, group, time[valid])
+    t = time[valid] - time_start[group]
+    return group, t, np.log(production[valid]), time_start.reshape(num_wells, num_stages)
+
+
+def _sums(group, num_groups, *values):
+    return [np.bincount(group, weights=v, minlength=num_groups) for v in values]
+
+
+def fit_exponential(time, production, stage):
+    """
+    Returns DeclineParams (num_wells, num_stages) of q = q_i exp(-d t) by least squares on
+    log production, nan for stages with fewer than two samples. b is zero.
+    """
+    group, t, logq, time_start = _groups(time, production, stage)
+    num_groups = time_start.size
+    n, st, stt, sy, sty = _sums(group, num_groups, np.ones_like(t), t, t*t, logq, t*logq)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d = -(n*sty - st*sy) / (n*stt - st*st)
+        logq_i = (sy + d*st) / n
+    d[n < 2] = np.nan
+    shape = time_start.shape
+    time_start[~np.isfinite(time_start)] = np.nan
+    return DeclineParams(np.exp(logq_i).reshape(shape), d.reshape(shape), np.zeros(shape), time_start)
+
+
+def fit_hyperbolic(time, production, stage, num_iterations=30, b_init=0.5, b_max=2.0, damping=1e-3):
+    """
+    Returns DeclineParams (num_wells, num_stages) of q = q_i (1 + b d t)^(-1/b) by a
+    damped Gauss-Newton on log production over all stages at once, starting from
+    the exponential fit.
+    """
+    group, t, logq, time_start = _groups(time, production, stage)
+    num_groups = time_start.size
+    exponential = fit_exponential(time, production, stage)
+    params = np.stack([np.log(exponential.q_i.ravel()), np.log(np.maximum(exponential.d.ravel(), 1e-6)),
+      np.full(num_groups, b_init)], axis=1)
+    fitted = np.isfinite(params).all(axis=1)
+    params[~fitted] = [0.0, np.log(1e-6), b_init]
+    for _ in range(num_iterations):
+        logq_i, logd, b = params[group, 0], params[group, 1], params[group, 2]
+        d = np.exp(logd)
+        u = 1.0 + b*d*t
+        logu = np.log(u)
+        r = logq - (logq_i - logu/b)
+        jacobian = [np.ones_like(t), -d*t/u, logu/b**2 - d*t/(b*u)]
+        jtj = np.empty((num_groups, 3, 3))
+        jtr = np.empty((num_groups, 3))
+        for i in range(3):
+            jtr[:, i] = np.bincount(group, weights=jacobian[i]*r, minlength=num_groups)
+            for j in range(i, 3):
+                jtj[:, i, j] = jtj[:, j, i] = np.bincount(group, weights=jacobian[i]*jacobian[j],
+                  minlength=num_groups)
+        jtj += damping*np.eye(3)*(1.0 + np.trace(jtj, axis1=1, axis2=2))[:, None, None]
+        delta = np.linalg.solve(jtj, jtr[:, :, None])[:, :, 0]
+        params[fitted] += delta[fitted]
+        params[:, 2] = np.clip(params[:, 2], 1e-3, b_max)
+    shape = time_start.shape
+    params[~fitted] = np.nan
+    time_start[~np.isfinite(time_start)] = np.nan
+    return DeclineParams(np.exp(params[:, 0]).reshape(shape), np.exp(params[:, 1]).reshape(shape),
+      params[:, 2].reshape(shape), time_start)
+
+
+def rate(params, time, stage):
+    """
+    Returns the production rates of the wells (rows) at time in stage, both
+    (num_wells, num_samples) matrices, nan where stage is -1 or not fitted.
+    """
+    iwell = np.broadcast_to(np.arange(time.shape[0])[:, None], time.shape)
+    valid = stage >= 0
+    istage = np.where(valid, stage, 0)
+    q_i, d, b = params.q_i[iwell, istage], params.d[iwell, istage], params.b[iwell, istage]
+    t = time - params.time_start[iwell, istage]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        q = np.where(b > 0.0, tbamk.hyperbolic_decline(q_i, d, np.where(b > 0.0, b, 1.0), t),
+          tbamk.exponential_decline(q_i, d, t))
+    q[~valid] = np.nan
+    return q
+
+
+def test_fit():
+    time = np.linspace(0.0, 60.0, 61)
+    stage = (time >= 30.0).astype(int)
+    wells_exp = [(100.0, 0.1, 40.0, 0.05), (50.0, 0.02, 80.0, 0.2)]
+    production = [np.where(stage == 0, tbamk.exponential_decline(qa, da, time),
+      tbamk.exponential_decline(qb, db, time - 30.0)) for qa, da, qb, db in wells_exp]
+    params = fit_exponential(np.array([time, time]), np.array(production), np.array([stage, stage]))
+    assert np.allclose(params.q_i, [[100.0, 40.0], [50.0, 80.0]])
+    assert np.allclose(params.d, [[0.1, 0.05], [0.02, 0.2]])
+
+    times = [time, time[:45]]
+    production = [tbamk.hyperbolic_decline(100.0, 0.2, 0.8, time), tbamk.hyperbolic_decline(30.0, 0.05, 0.3, time[:45])]
+    stages = [np.zeros(61, dtype=int), np.zeros(45, dtype=int)]
+    time_padded, production_padded, stage_padded = pad(times), pad(production), pad(stages, -1, int)
+    params = fit_hyperbolic(time_padded, production_padded, stage_padded)
+    assert np.allclose(params.b[:, 0], [0.8, 0.3], atol=1e-3)
+    assert np.allclose(params.d[:, 0], [0.2, 0.05], rtol=1e-3)
+    q = rate(params, time_padded, stage_padded)
+    assert np.allclose(q[1, :45], production[1], rtol=1e-3) and np.all(np.isnan(q[1, 45:]))
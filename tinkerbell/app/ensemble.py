@@ -0,0 +1,226 @@
+"""
+Monte Carlo ensemble forecasts reduced to P90/P50/P10 bands.
+
+Members perturb the initial window, the stage timing and the process noise
+and are rolled out together as one batch through the predict*_batch functions.
+The bands are streaming P-square quantile estimates, so memory does not grow
+with the number of members.
+"""
+import csv
+import numpy as np
+import logging as log
+import tinkerbell.app.make as tbamk
+import tinkerbell.app.model as tbamd
+import tinkerbell.app.forecast as tbafc
+import tinkerbell.app.parallel as tbapa
+import tinkerbell.domain.well as tbdwl
+
+
+# reserves convention, P90 is exceeded with 90% probability
+PROBABILITIES = (0.1, 0.5, 0.9)
+LABELS = ('p90', 'p50', 'p10')
+COLUMNS = ('well', 'time', 'stage', 'production') + LABELS
+
+
+class StreamingQuantiles:
+    """
+    P-square estimates (Jain and Chlamtac, 1985) of several quantiles of num_values
+    independent streams at once, five markers per quantile and stream.
+    """
+    def __init__(self, probabilities, num_values):
+        self.probabilities = np.asarray(probabilities, dtype=float)
+        self.num_values = num_values
+        self.count = 0
+        self.buffer = np.empty((5, num_values))
+        p = self.probabilities.reshape(-1, 1, 1)
+        self.increments = np.concatenate([np.zeros_like(p), p/2, p, (1+p)/2, np.ones_like(p)], axis=1)
+        shape = (len(self.probabilities), 5, num_values)
+        self.heights = np.empty(shape)
+        self.positions = np.broadcast_to(np.arange(1.0, 6.0).reshape(1, 5, 1), shape).copy()
+        self.desired = np.broadcast_to(1.0 + 4.0*self.increments, shape).copy()
+
+    def update(self, x):
+        x = np.asarray(x, dtype=float)
+        if self.count < 5:
+            self.buffer[self.count] = x
+            self.count += 1
+            if self.count == 5:
+                self.heights[:] = np.sort(self.buffer, axis=0)
+            return
+        self.count += 1
+        q, n = self.heights, self.positions
+        q[:, 0] = np.minimum(q[:, 0], x)
+        q[:, 4] = np.maximum(q[:, 4], x)
+        k = (x >= q[:, 1]).astype(int) + (x >= q[:, 2]) + (x >= q[:, 3])
+        n += np.arange(5).reshape(1, 5, 1) > k[:, np.newaxis, :]
+        self.desired += self.increments
+        for i in range(1, 4):
+            d = self.desired[:, i] - n[:, i]
+            move = ((d >= 1) & (n[:, i+1] - n[:, i] > 1)) | ((d <= -1) & (n[:, i-1] - n[:, i] < -1))
+            if not move.any():
+                continue
+            d = np.where(d >= 0, 1.0, -1.0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                parabolic = q[:, i] + d/(n[:, i+1] - n[:, i-1]) * (
+                  (n[:, i] - n[:, i-1] + d)*(q[:, i+1] - q[:, i])/(n[:, i+1] - n[:, i]) +
+                  (n[:, i+1] - n[:, i] - d)*(q[:, i] - q[:, i-1])/(n[:, i] - n[:, i-1]))
+                q_neighbour = np.where(d > 0, q[:, i+1], q[:, i-1])
+                n_neighbour = np.where(d > 0, n[:, i+1], n[:, i-1])
+                linear = q[:, i] + d*(q_neighbour - q[:, i])/(n_neighbour - n[:, i])
+            inside = (q[:, i-1] < parabolic) & (parabolic < q[:, i+1])
+            q[:, i] = np.where(move, np.where(inside, parabolic, linear), q[:, i])
+            n[:, i] = np.where(move, n[:, i] + d, n[:, i])
+
+    def update_batch(self, X):
+        """
+        Feeds the rows of X (num_samples, num_values) one by one.
+        """
+        for x in X:
+            self.update(x)
+
+    def quantiles(self):
+        """
+        Returns (len(probabilities), num_values), exact while fewer than five samples were seen.
+        """
+        if self.count < 5:
+            return np.percentile(self.buffer[:self.count], 100.0*self.probabilities, axis=0)
+        return self.heights[:, 2].copy()
+
+
+def shift_stages(stage, shift):
+    """
+    Returns the stage vector delayed by shift (num_members,) samples per member,
+    negative shifts bring the stages forward.
+    """
+    index = np.arange(len(stage)) - np.asarray(shift).reshape(-1, 1)
+    return np.asarray(stage)[np.clip(index, 0, len(stage)-1)]
+
+
+def _rollout_lstm(bundle, model, time, y_init, stage, noise):
+    return tbamd.predict_batch(y_init[:, 0], stage, bundle.normalizer, model, time, noise=noise)
+
+
+def _rollout_lstmseqwin(bundle, model, time, y_init, stage, noise):
+    return tbamd.predictseqwin_batch(y_init, stage, bundle.normalizer, model,
+      bundle.params.get('offset_forecast', 1), noise=noise)
+
+
+def _rollout_lstmseqwingrad(bundle, model, time, y_init, stage, noise):
+    return tbamd.predictseqwingrad_batch(y_init, time, stage, bundle.normalizer, model,
+      bundle.params.get('offset_forecast', 1), noise=noise)
+
+
+ROLLOUTS = {'lstm': _rollout_lstm, 'lstmseqwin': _rollout_lstmseqwin,
+  'lstmseqwingrad': _rollout_lstmseqwingrad}
+
+
+_models = {}
+
+
+def _model(bundle, batch_size):
+    # rebuilding a keras model is slow, workers keep one per batch size
+    key = (id(bundle.model), batch_size)
+    if key not in _models:
+        _models[key] = tbamd.rebatch(bundle.model, batch_size)
+    return _models[key]
+
+
+def ensemble(bundle, time, production, stage, num_members=1000, num_members_batch=100, noise_init=0.05,
+             noise=0.05, sigma_stage_shift=1.0, probabilities=PROBABILITIES, seed=None):
+    """
+    Returns the quantiles (len(probabilities), num_samples) of num_members rollouts of the
+    bundle. Each member scales the initial window by normal noise of std noise_init, shifts the
+    stages by a rounded normal number of samples of std sigma_stage_shift and scales every predicted
+    step by normal noise of std noise. Members run in batches of num_members_batch (None for all at
+    once) folded into the quantile estimate one after the other, so memory is bounded by the batch.
+    """
+    if seed is not None:
+        np.random.seed(seed)
+    rollout = ROLLOUTS[bundle.kind]
+    num_samples_init = tbafc.num_init(bundle)
+    num_members_batch = num_members if num_members_batch is None else min(num_members_batch, num_members)
+    num_batches = -(-num_members // num_members_batch)
+    num_members_batch = -(-num_members // num_batches) # equal batches, the last one padded
+    model = _model(bundle, num_members_batch)
+    estimator = None
+    num_remaining = num_members
+    for _ in range(num_batches):
+        y_init = production[:num_samples_init] * np.random.normal(1.0, noise_init, (num_members_batch, num_samples_init))
+        shift = np.rint(np.random.normal(0.0, sigma_stage_shift, num_members_batch)).astype(int)
+        yhat = rollout(bundle, model, time, y_init, shift_stages(stage, shift), noise)
+        if estimator is None:
+            estimator = StreamingQuantiles(probabilities, yhat.shape[1])
+        estimator.update_batch(yhat[:min(num_remaining, num_members_batch)])
+        num_remaining -= num_members_batch
+    return estimator.quantiles()
+
+
+def ensemble_well(bundle, well, num_forecast=0, num_stages_max=None, num_samples_window=10, **kwargs):
+    """
+    Returns the rows (see COLUMNS) of the ensemble forecast of a single well, kwargs go to ensemble().
+    """
+    stage = tbamk.detect_stages(well.time, well.production, num_stages_max=num_stages_max,
+      num_samples_window=num_samples_window)
+    time, stage = tbafc.extend(well.time, stage, num_forecast)
+    bands = ensemble(bundle, time, well.production, stage, **kwargs)
+    production = np.full(bands.shape[1], np.nan)
+    num_observed = min(bands.shape[1], len(well.production))
+    production[:num_observed] = well.production[:num_observed]
+    return [(well.name, t, s, p) + tuple(b) for t, s, p, b in zip(time, stage, production, bands.T)]
+
+
+_bundle = None
+_options = None
+
+
+def _init_worker(fname_bundle, options, num_threads):
+    global _bundle, _options
+    tbapa.limit_threads(num_threads, num_threads)
+    _bundle = tbamd.load_bundle(fname_bundle)
+    _options = options
+
+
+def _ensemble_worker(well):
+    try:
+        return ensemble_well(_bundle, well, **_options)
+    except Exception as e:
+        log.error('Ensemble of well \'{0}\' failed: {1}'.format(well.name, e))
+        return []
+
+
+def run(fname_wells, fname_bundle, fname_out, num_workers=None, num_threads=1, **options):
+    """
+    As forecast.run() with the P90/P50/P10 bands of ensemble_well() instead of a single rollout.
+    """
+    num_wells, num_failed = 0, 0
+    with open(fname_out, 'w', newline='') as f, \
+      tbapa.pool(num_workers, _init_worker, (fname_bundle, options, num_threads)) as workers:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for rows in workers.imap_unordered(_ensemble_worker, tbdwl.read_wells(fname_wells)):
+            if not rows:
+                num_failed += 1
+                continue
+            writer.writerows(rows)
+            f.flush()
+            num_wells += 1
+            log.info('Ensemble forecast {0:d} wells.'.format(num_wells))
+    return num_wells, num_failed
+
+
+def test_streaming_quantiles():
+    np.random.seed(42)
+    X = np.random.lognormal(0.0, 0.5, (5000, 3))
+    estimator = StreamingQuantiles(PROBABILITIES, 3)
+    estimator.update_batch(X)
+    exact = np.percentile(X, 100.0*np.array(PROBABILITIES), axis=0)
+    assert np.allclose(estimator.quantiles(), exact, rtol=0.05)
+    estimator = StreamingQuantiles(PROBABILITIES, 3)
+    estimator.update_batch(X[:3])
+    assert np.allclose(estimator.quantiles(), np.percentile(X[:3], 100.0*np.array(PROBABILITIES), axis=0))
+
+
+def test_shift_stages():
+    stage = np.array([0, 0, 1, 1, 2])
+    shifted = shift_stages(stage, [0, 1, -1])
+    assert np.array_equal(shifted, [[0, 0, 1, 1, 2], [0, 0, 0, 1, 1], [0, 1, 1, 2, 2]])
@@ -0,0 +1,148 @@
+"""
+Declarative features (lags, differences, gradients, moving average gradients)
+for batches of wells, computed in one vectorized pass over the concatenated
+samples of all wells.
+
+A spec is a sequence of (op, series, n), e.g.
+
+    SPEC_GRAD = (('gradient', 'production', 1), ('diff', 'stage', 1))
+
+with op one of
+    'value'          series[t]
+    'lag'            series[t-n]
+    'diff'           series[t] - series[t-n]
+    'gradient'       (series[t] - series[t-n]) / (time[t] - time[t-n])
+    'mean_gradient'  mean of the last n one step gradients
+Intermediates (shifts, differences, one step gradients and their cumulative
+sums) are shared between the entries of the spec. Rows without enough history
+within their well are nan.
+"""
+import numpy as np
+import collections as coll
+import tinkerbell.profiling as tbpf
+
+
+Feature = coll.namedtuple("Feature", "op series n")
+
+OPS = ('value', 'lag', 'diff', 'gradient', 'mean_gradient')
+
+SPEC_GRAD = (('gradient', 'production', 1), ('diff', 'stage', 1))
+
+
+def _flat(arrays):
+    """
+    Returns the concatenation of a sequence of arrays and the offsets of each into it.
+    """
+    arrays = [np.asarray(array, dtype=float) for array in arrays]
+    offsets = np.r_[0, np.cumsum([len(array) for array in arrays])]
+    return np.concatenate(arrays), offsets
+
+
+class FeatureEngine:
+    def __init__(self, spec):
+        self.spec = [Feature(*entry) for entry in spec]
+        for feature in self.spec:
+            if feature.op not in OPS:
+                raise ValueError('Unknown feature op \'{0}\', expected one of {1}.'.format(feature.op, OPS))
+            if feature.op != 'value' and feature.n < 1:
+                raise ValueError('Feature \'{0}\' needs n >= 1.'.format(feature.op))
+
+    @property
+    def num_history(self):
+        """
+        Number of leading samples of every well without a complete feature row.
+        """
+        return max([0 if feature.op == 'value' else feature.n for feature in self.spec])
+
+    def header(self):
+        return ['{0}_{1}'.format(feature.op, feature.series) if feature.op == 'value' else
+          '{0}_{1}_{2:d}'.format(feature.op, feature.series, feature.n) for feature in self.spec]
+
+    @tbpf.profiled
+    def __call__(self, time, **series):
+        """
+        Returns the contiguous (num_samples, len(spec)) feature matrix of all wells and the offsets
+        of the wells into its rows. time and every series are sequences with one array per well.
+        """
+        time, offsets = _flat(time)
+        flat = {name: _flat(arrays)[0] for name, arrays in series.items()}
+        flat['time'] = time
+        position = np.arange(len(time)) - np.repeat(offsets[:-1], np.diff(offsets))
+        cache = {}
+
+        def shifted(name, n):
+            key = ('lag', name, n)
+            if key not in cache:
+                values = np.full(len(time), np.nan)
+                values[n:] = flat[name][:-n]
+                values[position < n] = np.nan
+                cache[key] = values
+            return cache[key]
+
+        def diff(name, n):
+            key = ('diff', name, n)
+            if key not in cache:
+                cache[key] = flat[name] - shifted(name, n)
+            return cache[key]
+
+        def gradient(name, n):
+            key = ('gradient', name, n)
+            if key not in cache:
+                cache[key] = diff(name, n) / diff('time', n)
+            return cache[key]
+
+        def mean_gradient(name, n):
+            key = ('cumsum_gradient', name)
+            if key not in cache:
+                cache[key] = np.cumsum(np.nan_to_num(gradient(name, 1)))
+            cumulative = cache[key]
+            values = np.full(len(time), np.nan)
+            values[n:] = (cumulative[n:] - cumulative[:-n]) / n
+            values[position < n] = np.nan
+            return values
+
+        ops = {'value': lambda name, n: flat[name], 'lag': shifted, 'diff': diff, 'gradient': gradient,
+          'mean_gradient': mean_gradient}
+        matrix = np.empty((len(time), len(self.spec)))
+        for ifeature, feature in enumerate(self.spec):
+            matrix[:, ifeature] = ops[feature.op](feature.series, feature.n)
+        return matrix, offsets
+
+
+@tbpf.profiled
+def windows(matrix, offsets, num_timesteps, offset_forecast=0, num_history=0):
+    """
+    Returns the contiguous windows (num_windows, num_timesteps, num_features) of num_timesteps
+    consecutive rows that stay within a well, skip its first num_history rows and leave
+    offset_forecast rows after the window, together with the row index of the last row of every
+    window (targets are rows last + offset_forecast).
+    """
+    first = offsets[:-1] + num_history
+    num_windows = np.maximum(offsets[1:] - first - num_timesteps - offset_forecast + 1, 0)
+    start = np.repeat(first - np.r_[0, np.cumsum(num_windows)[:-1]], num_windows) + np.arange(num_windows.sum())
+    index = start[:, np.newaxis] + np.arange(num_timesteps)
+    return matrix[index], index[:, -1]
+
+
+def test_features():
+    np.random.seed(42)
+    times = [np.cumsum(np.random.uniform(0.5, 1.5, num)) for num in (12, 7)]
+    productions = [np.random.uniform(1.0, 2.0, len(time)) for time in times]
+    stages = [(time > time[len(time)//2]).astype(float) for time in times]
+    engine = FeatureEngine((('value', 'stage', 0), ('lag', 'production', 2), ('diff', 'stage', 1),
+      ('gradient', 'production', 2), ('mean_gradient', 'production', 3)))
+    assert engine.num_history == 3
+    matrix, offsets = engine(times, production=productions, stage=stages)
+    assert matrix.shape == (19, 5) and matrix.flags['C_CONTIGUOUS']
+    for iwell, (time, production, stage) in enumerate(zip(times, productions, stages)):
+        rows = matrix[offsets[iwell]:offsets[iwell+1]]
+        dp_dt = np.diff(production) / np.diff(time)
+        assert np.allclose(rows[:, 0], stage)
+        assert np.allclose(rows[2:, 1], production[:-2]) and np.all(np.isnan(rows[:2, 1]))
+        assert np.allclose(rows[1:, 2], np.diff(stage))
+        assert np.allclose(rows[2:, 3], (production[2:] - production[:-2]) / (time[2:] - time[:-2]))
+        assert np.allclose(rows[3:, 4], np.convolve(dp_dt, np.ones(3)/3, mode='valid'))
+        assert np.all(np.isnan(rows[:3, 4]))
+    X, last = windows(matrix, offsets, 3, offset_forecast=1, num_history=engine.num_history)
+    assert X.shape == (7, 3, 5)
+    assert np.array_equal(X[5], matrix[8:11]) and last[5] == 10 and last[6] == 17
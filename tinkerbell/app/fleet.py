@@ -0,0 +1,127 @@
+"""
+Training of one model per well of a multi-well source in a pool of worker
+processes, each with its own TensorFlow thread caps.
+
+Bundles are written to model_<well>_<hash>_v<version>(.h5/.bundle) next to a
+.json holding the hash of kind, parameters and data they were trained with,
+written last. The short hash of the raw well name keeps apart wells whose safe
+names coincide. A rerun skips wells whose bundle is current, so an interrupted
+job resumes where it stopped. Every well finished (trained, current or failed) is
+appended to progress.jsonl as it completes.
+"""
+import os
+import json
+import hashlib
+import time as tm
+import logging as log
+import tinkerbell.app.make as tbamk
+import tinkerbell.app.model as tbamd
+import tinkerbell.app.sweep as tbasw
+import tinkerbell.app.parallel as tbapa
+import tinkerbell.domain.well as tbdwl
+
+
+FNAME_PROGRESS = 'progress.jsonl'
+
+
+def fname_bundle(dirname, name_well, version=1):
+    """
+    Returns the bundle file name (without extension) of a well.
+    """
+    digest = hashlib.sha1(name_well.encode()).hexdigest()[:8]
+    return os.path.join(dirname, 'model_{0}_{1}_v{2}'.format(tbdwl.safe_name(name_well), digest, version))
+
+
+def well_key(kind, params, options, well):
+    return tbasw.trial_key(kind, dict(params, **options), tbasw.hash_data(well.time, well.production))
+
+
+def is_current(fname, key):
+    """
+    Whether the bundle fname was trained with key.
+    """
+    try:
+        with open(fname + '.json') as f:
+            return json.load(f)['key'] == key
+    except (FileNotFoundError, ValueError, KeyError):
+        return False
+
+
+def train_well(well, kind, params, options, fname, key):
+    """
+    Detects the stages of a well, trains its bundle and writes it to fname, returns the progress record.
+    """
+    if os.path.exists(fname + '.json'):
+        os.remove(fname + '.json') # stale until the new bundle is complete
+    time_start = tm.time()
+    stage = tbamk.detect_stages(well.time, well.production, **options)
+    bundle = tbamd.fit_bundle(kind, well.time, well.production, stage, **params)
+    tbamd.save_bundle(bundle, fname)
+    record = {'well': well.name, 'status': 'trained', 'fname': fname, 'num_samples': len(well.time),
+      'epoch_stopped': bundle.params['epoch_stopped'], 'time_train': tm.time() - time_start}
+    with open(fname + '.json', 'w') as f:
+        json.dump({'key': key, 'kind': kind, 'params': params, 'options': options, 'well': well.name}, f,
+          indent=4, sort_keys=True)
+    return record
+
+
+def _init_worker(num_threads):
+    tbapa.limit_threads(num_threads, num_threads)
+
+
+def _train_well_worker(args):
+    try:
+        return train_well(*args)
+    except Exception as e:
+        log.error('Training well \'{0}\' failed: {1}'.format(args[0].name, e))
+        return {'well': args[0].name, 'status': 'failed', 'fname': args[4], 'error': str(e)}
+
+
+def train_fleet(fname_wells, dirname_out, kind='lstm', params=None, version=1, num_workers=None, num_threads=1,
+                num_stages_max=None, num_samples_window=10, maxtasksperchild=20):
+    """
+    Trains a bundle of the given kind per well of fname_wells into dirname_out, skipping wells
+    whose bundle is current, and returns the progress records. params are passed to fit_bundle.
+    Workers are replaced after maxtasksperchild wells to bound the memory keras accumulates.
+    """
+    params = params or {}
+    options = {'num_stages_max': num_stages_max, 'num_samples_window': num_samples_window}
+    os.makedirs(dirname_out, exist_ok=True)
+    records, jobs = [], []
+    with open(os.path.join(dirname_out, FNAME_PROGRESS), 'a') as f:
+        def write(record):
+            record['date'] = tm.strftime('%Y-%m-%dT%H:%M:%S')
+            records.append(record)
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+            f.flush()
+
+        for well in tbdwl.read_wells(fname_wells):
+            fname, key = fname_bundle(dirname_out, well.name, version), well_key(kind, params, options, well)
+            if is_current(fname, key):
+                write({'well': well.name, 'status': 'current', 'fname': fname})
+            else:
+                jobs += [(well, kind, params, options, fname, key)]
+        log.info('Fleet: {0:d} of {1:d} bundles current.'.format(len(records), len(records)+len(jobs)))
+        if jobs:
+            with tbapa.pool(num_workers, _init_worker, (num_threads,), maxtasksperchild) as workers:
+                for ijob, record in enumerate(workers.imap_unordered(_train_well_worker, jobs)):
+                    write(record)
+                    log.info('Fleet: well \'{0}\' {1}, {2:d} of {3:d}.'.format(record['well'], record['status'],
+                      ijob+1, len(jobs)))
+    return records
+
+
+def test_fleet_names():
+    import tempfile
+    import numpy as np
+    with tempfile.TemporaryDirectory() as dirname:
+        fname = fname_bundle(str(dirname), 'Big Well/3', version=2)
+        assert os.path.basename(fname).startswith('model_big_well_3_') and fname.endswith('_v2')
+        assert fname != fname_bundle(str(dirname), 'big well 3', version=2)
+        well = tbdwl.Well('a', np.arange(5.0), np.ones(5))
+        key = well_key('lstm', {'num_epochs': 3}, {'num_stages_max': None}, well)
+        assert key != well_key('lstm', {'num_epochs': 4}, {'num_stages_max': None}, well)
+        assert not is_current(fname, key)
+        with open(fname + '.json', 'w') as f:
+            json.dump({'key': key}, f)
+        assert is_current(fname, key)
@@ -0,0 +1,151 @@
+"""
+Batch forecasting of multi-well sources with a model bundle.
+"""
+import csv
+import contextlib
+import numpy as np
+import logging as log
+import tinkerbell.app.make as tbamk
+import tinkerbell.app.model as tbamd
+import tinkerbell.app.parallel as tbapa
+import tinkerbell.domain.well as tbdwl
+from tinkerbell.lazy import lazy_import
+
+tbaon = lazy_import('tinkerbell.app.online')
+tbash = lazy_import('tinkerbell.app.shared')
+
+
+COLUMNS = ('well', 'time', 'stage', 'production', 'forecast')
+
+
+def _forecast_lstm(bundle, time, production, stage):
+    return tbamd.predict(production[0], stage, bundle.normalizer, bundle.model, time)
+
+
+def _forecast_lstmseqwin(bundle, time, production, stage):
+    num_timesteps = bundle.params['num_timesteps']
+    return tbamd.predictseqwin(production[:num_timesteps], stage, bundle.normalizer, bundle.model,
+      bundle.params.get('offset_forecast', 1))
+
+
+def _forecast_lstmseqwingrad(bundle, time, production, stage):
+    num_timesteps = bundle.params['num_timesteps']
+    return tbamd.predictseqwingrad(production[:num_timesteps+1], time, stage, bundle.normalizer, bundle.model,
+      bundle.params.get('offset_forecast', 1))
+
+
+FORECASTERS = {'lstm': _forecast_lstm, 'lstmseqwin': _forecast_lstmseqwin,
+  'lstmseqwingrad': _forecast_lstmseqwingrad}
+
+
+def num_init(bundle):
+    """
+    Number of observed samples a rollout of the bundle starts from.
+    """
+    if bundle.kind == 'lstm':
+        return 1
+    return bundle.params['num_timesteps'] + (bundle.kind == 'lstmseqwingrad')
+
+
+def extend(time, stage, num_forecast):
+    """
+    Appends num_forecast samples at the median time step, holding the last stage.
+    """
+    if num_forecast <= 0:
+        return time, stage
+    time_delta = np.median(np.diff(time))
+    time_forecast = time[-1] + time_delta*np.arange(1, num_forecast+1)
+    stage_forecast = np.full(num_forecast, stage[-1], dtype=stage.dtype)
+    return np.r_[time, time_forecast], np.r_[stage, stage_forecast]
+
+
+def forecast_well(bundle, well, num_forecast=0, num_stages_max=None, num_samples_window=10, forecaster=None):
+    """
+    Returns the rows (see COLUMNS) of the forecast of a single well, observed
+    production is nan beyond the history. With an online.Forecaster the rollout
+    is computed by it in numpy and bundle is not used.
+    """
+    stage = tbamk.detect_stages(well.time, well.production, num_stages_max=num_stages_max,
+      num_samples_window=num_samples_window)
+    time, stage = extend(well.time, stage, num_forecast)
+    if forecaster is None:
+        yhat = FORECASTERS[bundle.kind](bundle, time, well.production, stage)
+    else:
+        yhat = tbaon.rollout(forecaster, time, well.production, stage)
+    production = np.full(len(yhat), np.nan)
+    num_observed = min(len(yhat), len(well.production))
+    production[:num_observed] = well.production[:num_observed]
+    return [(well.name, t, s, p, y) for t, s, p, y in zip(time, stage, production, yhat)]
+
+
+_bundle = None
+_options = None
+_forecaster = None
+_block = None
+
+
+def _init_worker(fname_bundle, options, num_threads):
+    global _bundle, _options
+    tbapa.limit_threads(num_threads, num_threads)
+    _bundle = tbamd.load_bundle(fname_bundle)
+    _options = options
+
+
+def _init_worker_shared(shared, options):
+    global _forecaster, _block, _options
+    _forecaster, _block = tbash.attach(shared)
+    _options = options
+
+
+def _forecast_worker(well):
+    try:
+        return forecast_well(_bundle, well, forecaster=_forecaster, **_options)
+    except Exception as e:
+        log.error('Forecast of well \'{0}\' failed: {1}'.format(well.name, e))
+        return []
+
+
+def run(fname_wells, fname_bundle, fname_out, num_workers=None, num_threads=1, num_forecast=0,
+        num_stages_max=None, num_samples_window=10, shared=False):
+    """
+    Forecasts every well of fname_wells in a pool of workers that each load the
+    bundle once, rows are appended to the csv fname_out as wells complete.
+    With shared the bundle is loaded once here and its weights published into
+    shared memory, the workers forecast in numpy from them (see shared) without
+    loading the bundle or TensorFlow. Returns the numbers of wells written and
+    of wells whose forecast failed (logged, no rows written).
+    """
+    options = {'num_forecast': num_forecast, 'num_stages_max': num_stages_max,
+      'num_samples_window': num_samples_window}
+    num_wells, num_failed = 0, 0
+    with contextlib.ExitStack() as stack:
+        if shared:
+            initializer = _init_worker_shared
+            initargs = (stack.enter_context(tbash.published(tbamd.load_bundle(fname_bundle))), options)
+        else:
+            initializer, initargs = _init_worker, (fname_bundle, options, num_threads)
+        f = stack.enter_context(open(fname_out, 'w', newline=''))
+        workers = stack.enter_context(tbapa.pool(num_workers, initializer, initargs))
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for rows in workers.imap_unordered(_forecast_worker, tbdwl.read_wells(fname_wells)):
+            if not rows:
+                num_failed += 1
+                continue
+            writer.writerows(rows)
+            f.flush()
+            num_wells += 1
+            log.info('Forecast {0:d} wells.'.format(num_wells))
+    return num_wells, num_failed
+
+
+def test_forecast_well_repeatable():
+    time = np.arange(30.0)
+    production = 100.0*np.exp(-0.05*time)
+    stage = (time > 15).astype(int)
+    bundle = tbamd.fit_bundle('lstm', time, production, stage, num_epochs=2)
+    well = tbdwl.Well('a', time, production)
+    # a worker keeps its bundle, every well starts from the zero state of the stateful model
+    first, second = [np.array([row[4] for row in forecast_well(bundle, well, num_forecast=5)]) for _ in range(2)]
+    assert np.array_equal(first, second)
+
@@ -0,0 +1,271 @@
+"""
+Asyncio ingestion of multi-well source files into model ready features.
+
+Items flow through the stages read -> parse -> validate -> stages -> features
+-> persist, connected by bounded queues. A stage that falls behind fills its
+input queue and the stages upstream wait on it (backpressure), so memory stays
+bounded however many files there are. File reads and writes run on threads,
+parsing, validation, stage detection and feature building on a process pool,
+so I/O and CPU overlap. Every stage counts the items in, out and failed and its
+busy time. The normalizer is fitted incrementally as wells are persisted.
+"""
+import os
+import asyncio
+import functools as ft
+import time as tm
+import collections as coll
+import concurrent.futures as cf
+import multiprocessing as mp
+import numpy as np
+import logging as log
+import tinkerbell.app.make as tbamk
+import tinkerbell.app.model as tbamd
+import tinkerbell.domain.well as tbdwl
+import tinkerbell.domain.resample as tbdrs
+
+
+EXECUTORS = ('process', 'thread', None)
+FNAME_NORMALIZER = 'normalizer'
+
+Record = coll.namedtuple("Record", "well stage features targets")
+
+
+def read(fname):
+    with open(fname) as f:
+        return fname, f.read()
+
+
+def parse(item):
+    fname, text = item
+    return tbdwl.parse_wells(text, fname)
+
+
+def validate(well, num_min=10, time_step=None, method='linear'):
+    """
+    Returns the well with non finite samples dropped, sorted by time with repeated times
+    dropped and, with time_step, resampled; None if fewer than num_min samples remain.
+    """
+    time, production = np.asarray(well.time, dtype=float), np.asarray(well.production, dtype=float)
+    valid = np.isfinite(time) & np.isfinite(production)
+    order = np.argsort(time[valid], kind='stable')
+    time, production = time[valid][order], production[valid][order]
+    unique = np.r_[True, np.diff(time) > 0.0]
+    if unique.sum() < num_min:
+        return None
+    well = tbdwl.Well(well.name, time[unique], production[unique])
+    if time_step is not None:
+        well = tbdrs.resample_wells([well], time_step, method)[0]
+    return well
+
+
+def stages(well, num_stages_max=None, num_samples_window=10):
+    stage = tbamk.detect_stages(well.time, well.production, num_stages_max=num_stages_max,
+      num_samples_window=num_samples_window)
+    return Record(well, stage, None, None)
+
+
+def features(record):
+    """
+    Adds the feature and target matrices of the lstm trainer to the record.
+    """
+    well = record.well
+    return record._replace(features=tbamd.Features(well.production, record.stage).matrix(),
+      targets=tbamd.Targets(well.production, well.time).matrix())
+
+
+def persist(record, dirname):
+    np.savez(os.path.join(dirname, tbdwl.safe_name(record.well.name) + '.npz'), time=record.well.time,
+      production=record.well.production, stage=record.stage, features=record.features, targets=record.targets)
+    return record
+
+
+class Stage:
+    def __init__(self, name, fct, executor='process', num_tasks=1, many=False, batch_size=1):
+        """
+        A pipeline stage applying fct to every item, on the process or thread pool or,
+        if executor is None, in the event loop. num_tasks batches are processed at once, a
+        batch being the up to batch_size items queued, so small items share a round trip
+        to the pool. With many, fct returns a sequence of items. Items for which fct
+        returns None are dropped.
+        """
+        if executor not in EXECUTORS:
+            raise ValueError('Unknown executor \'{0}\', expected one of {1}.'.format(executor, EXECUTORS))
+        self.name = name
+        self.fct = fct
+        self.executor = executor
+        self.num_tasks = num_tasks
+        self.many = many
+        self.batch_size = batch_size
+
+
+class Counter:
+    def __init__(self, name):
+        self.name = name
+        self.num_in = 0
+        self.num_out = 0
+        self.num_failed = 0
+        self.time_busy = 0.0
+        self.time_start = None
+        self.time_end = None
+
+    @property
+    def rate(self):
+        """
+        Items out per second of wall time the stage was running.
+        """
+        time_wall = (self.time_end or tm.time()) - (self.time_start or tm.time())
+        return self.num_out / time_wall if time_wall > 0.0 else 0.0
+
+
+def format_counters(counters):
+    lines = ['{0:12s}{1:>8s}{2:>8s}{3:>8s}{4:>10s}{5:>10s}'.format('stage', 'in', 'out', 'failed', 'busy s',
+      'out/s')]
+    for c in counters:
+        lines += ['{0:12s}{1:8d}{2:8d}{3:8d}{4:10.2f}{5:10.1f}'.format(c.name, c.num_in, c.num_out, c.num_failed,
+          c.time_busy, c.rate)]
+    return '\n'.join(lines)
+
+
+_DONE = object()
+
+
+def _apply(fct, items):
+    """
+    Returns (result, None) or, if fct raised, (None, error) per item.
+    """
+    results = []
+    for item in items:
+        try:
+            results += [(fct(item), None)]
+        except Exception as e:
+            results += [(None, '{0}: {1}'.format(type(e).__name__, e))]
+    return results
+
+
+class Pipeline:
+    def __init__(self, stages, max_queue=16, num_workers=None, num_threads=4):
+        """
+        Stages connected by queues of at most max_queue items, process stages share a
+        pool of num_workers spawned processes, thread stages a pool of num_threads.
+        """
+        self.stages = stages
+        self.max_queue = max_queue
+        self.num_workers = num_workers or os.cpu_count()
+        self.num_threads = num_threads
+        self.counters = [Counter(stage.name) for stage in stages]
+
+    async def _work(self, stage, counter, queue_in, queue_out, executors):
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            batch = [await queue_in.get()]
+            while len(batch) < stage.batch_size and not queue_in.empty():
+                batch += [queue_in.get_nowait()]
+            done = _DONE in batch
+            batch = [item for item in batch if item is not _DONE]
+            counter.num_in += len(batch)
+            time_start = tm.time()
+            if stage.executor is None:
+                results = _apply(stage.fct, batch)
+            else:
+                results = await loop.run_in_executor(executors[stage.executor], _apply, stage.fct, batch)
+            counter.time_busy += tm.time() - time_start
+            for result, error in results:
+                if error is not None:
+                    counter.num_failed += 1
+                    log.error('Stage \'{0}\' failed: {1}'.format(stage.name, error))
+                    continue
+                for out in (result if stage.many else [result]):
+                    if out is not None:
+                        counter.num_out += 1
+                        await queue_out.put(out)
+        await queue_in.put(_DONE) # for the other tasks of the stage
+
+    async def _stage(self, stage, counter, queue_in, queue_out, executors):
+        counter.time_start = tm.time()
+        await asyncio.gather(*[self._work(stage, counter, queue_in, queue_out, executors)
+          for _ in range(stage.num_tasks)])
+        counter.time_end = tm.time()
+        await queue_out.put(_DONE)
+
+    async def run(self, items, sink=None):
+        """
+        Feeds items through the stages and calls sink (in the event loop) with every item out of
+        the last stage, returns the number of items out.
+        """
+        queues = [asyncio.Queue(self.max_queue) for _ in range(len(self.stages)+1)]
+        num_out = 0
+
+        async def produce():
+            for item in items:
+                await queues[0].put(item)
+            await queues[0].put(_DONE)
+
+        async def consume():
+            nonlocal num_out
+            while True:
+                item = await queues[-1].get()
+                if item is _DONE:
+                    return
+                if sink is not None:
+                    sink(item)
+                num_out += 1
+
+        with cf.ProcessPoolExecutor(self.num_workers, mp_context=mp.get_context('spawn')) as processes, \
+          cf.ThreadPoolExecutor(self.num_threads) as threads:
+            executors = {'process': processes, 'thread': threads}
+            await asyncio.gather(produce(), consume(), *[self._stage(stage, counter, queues[i], queues[i+1], executors)
+              for i, (stage, counter) in enumerate(zip(self.stages, self.counters))])
+        return num_out
+
+
+def ingest(fnames, dirname_out, num_workers=None, num_threads=4, max_queue=64, batch_size=16, num_min=10,
+           time_step=None, method='linear', num_stages_max=None, num_samples_window=10):
+    """
+    Ingests the wells of the multi-well sources fnames into one .npz per well in dirname_out
+    (wells of the same name overwrite each other) and fits the normalizer of the lstm trainer on
+    all of them, saved as dirname_out/normalizer.
+    Returns the normalizer and the stage counters.
+    """
+    os.makedirs(dirname_out, exist_ok=True)
+    num_workers = num_workers or os.cpu_count()
+    pipeline = Pipeline([
+      Stage('read', read, 'thread', num_threads),
+      Stage('parse', parse, 'process', num_workers, many=True),
+      Stage('validate', ft.partial(validate, num_min=num_min, time_step=time_step, method=method), 'process',
+        num_workers, batch_size=batch_size),
+      Stage('stages', ft.partial(stages, num_stages_max=num_stages_max, num_samples_window=num_samples_window),
+        'process', num_workers, batch_size=batch_size),
+      Stage('features', features, 'process', num_workers, batch_size=batch_size),
+      Stage('persist', ft.partial(persist, dirname=dirname_out), 'thread', num_threads, batch_size=batch_size)],
+      max_queue, num_workers, num_threads)
+    normalizer = tbamd.Normalizer()
+
+    def fit(record):
+        normalizer.features.partial_fit(record.features)
+        normalizer.targets.partial_fit(record.targets)
+
+    num_wells = asyncio.run(pipeline.run(fnames, fit))
+    log.info('Ingested {0:d} wells.\n{1}'.format(num_wells, format_counters(pipeline.counters)))
+    if num_wells:
+        tbamd.save_normalizer(normalizer, os.path.join(dirname_out, FNAME_NORMALIZER))
+    return normalizer, pipeline.counters
+
+
+def test_pipeline_backpressure():
+    seen = []
+
+    def square(x):
+        if abs(x) == 3:
+            raise ValueError('three')
+        return x*x
+
+    pipeline = Pipeline([Stage('split', lambda x: [x, -x], None, many=True),
+      Stage('square', square, 'thread', 3, batch_size=2), Stage('drop', lambda x: x if x % 2 else None, None, 2)],
+      max_queue=1, num_workers=1, num_threads=3)
+    assert asyncio.run(pipeline.run(range(6), seen.append)) == 4
+    assert sorted(seen) == [1, 1, 25, 25]
+    assert [(c.num_in, c.num_out, c.num_failed) for c in pipeline.counters] == [(6, 12, 0), (12, 10, 2), (10, 4, 0)]
+    well = validate(tbdwl.Well('a', np.array([3.0, 1.0, np.nan, 2.0, 2.0]), np.arange(5.0)), num_min=3)
+    assert np.array_equal(well.time, [1.0, 2.0, 3.0]) and np.array_equal(well.production, [1.0, 3.0, 0.0])
+    assert validate(well, num_min=4) is None
@@ -0,0 +1,229 @@
+"""
+Cumulative production (EUR), economic limit and refrac uplift KPIs of batches
+of wells, computed for all wells at once.
+
+Wells are (num_wells, num_samples) rate matrices padded with nan, on a shared
+time grid (num_samples,) or a ragged one padded alike, with stages padded
+with -1 as in decline. Fitted splines are passed as matrices of Curve.to_flat()
+rows and integrated analytically, grouped by their knots. summary() returns a
+dictionary of columns, one row per well.
+"""
+import csv
+import numpy as np
+import scipy.interpolate as spint
+import tinkerbell.app.decline as tbadc
+
+
+def _rows(time, values):
+    """
+    Returns time and values as float (num_wells, num_samples) matrices, a shared time broadcast.
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    return np.broadcast_to(np.asarray(time, dtype=float), values.shape), values
+
+
+def _row_values(values, num_rows):
+    values = np.asarray(values, dtype=float)
+    return np.broadcast_to(values.reshape(-1) if values.ndim else values, (num_rows,))
+
+
+def areas(time, production):
+    """
+    Returns the trapezoid areas (num_wells, num_samples-1) between consecutive samples, zero
+    where either sample is missing.
+    """
+    time, production = _rows(time, production)
+    area = 0.5*(production[:, 1:] + production[:, :-1])*np.diff(time, axis=1)
+    return np.where(np.isfinite(area), area, 0.0)
+
+
+def cumulative(time, production):
+    """
+    Returns the cumulative production from the first sample by the trapezoid rule, nan where
+    the sample is missing.
+    """
+    time, production = _rows(time, production)
+    total = np.zeros(production.shape)
+    total[:, 1:] = np.cumsum(areas(time, production), axis=1)
+    total[~(np.isfinite(time) & np.isfinite(production))] = np.nan
+    return total
+
+
+def crossing(time, values, threshold, downward=True, last=False):
+    """
+    Returns the time every row first (last) crosses threshold (scalar or per row) downward
+    (upward), linearly interpolated, and the index of the sample before; nan and -1
+    for rows that do not cross.
+    """
+    time, values = _rows(time, values)
+    threshold = _row_values(threshold, len(values))[:, np.newaxis]
+    before, after = values[:, :-1], values[:, 1:]
+    with np.errstate(invalid='ignore'):
+        crossed = (before >= threshold) & (after < threshold) if downward else \
+          (before < threshold) & (after >= threshold)
+    index = crossed.shape[1] - 1 - np.argmax(crossed[:, ::-1], axis=1) if last else np.argmax(crossed, axis=1)
+    index = np.where(crossed.any(axis=1), index, -1)
+    rows = np.arange(len(values))
+    i = np.maximum(index, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = (before[rows, i] - threshold[:, 0]) / (before[rows, i] - after[rows, i])
+    time_crossing = time[rows, i] + fraction*(time[rows, i+1] - time[rows, i])
+    time_crossing[index < 0] = np.nan
+    return time_crossing, index
+
+
+def cumulative_at(time, production, total, time_at, index):
+    """
+    Returns the cumulative total of every row at time_at within the interval after sample index.
+    """
+    time, production = _rows(time, production)
+    rows, i = np.arange(len(production)), np.maximum(index, 0)
+    fraction = (time_at - time[rows, i]) / (time[rows, i+1] - time[rows, i])
+    rate_at = production[rows, i] + fraction*(production[rows, i+1] - production[rows, i])
+    return np.where(index >= 0, total[rows, i] + 0.5*(production[rows, i] + rate_at)*(time_at - time[rows, i]),
+      np.nan)
+
+
+def stage_volumes(time, production, stage, decline='hyperbolic'):
+    """
+    Returns the production (num_wells, num_stages) of every stage and its uplift, the
+    production above the decline of the previous stage (fitted by decline.fit_<decline>)
+    continued over the stage; the uplift of stage 0 is nan. An interval counts to the
+    stage of its end sample.
+    """
+    time, production = _rows(time, production)
+    stage = np.atleast_2d(stage)
+    num_wells, num_stages = production.shape[0], int(np.max(stage)) + 1
+    params = getattr(tbadc, 'fit_' + decline)(time, production, stage)
+    stage_previous = np.where(stage[:, 1:] > 0, stage[:, 1:] - 1, -1)
+    baseline_before, baseline_after = [tbadc.rate(params, t, stage_previous) for t in (time[:, :-1], time[:, 1:])]
+    valid = (stage[:, 1:] >= 0) & (stage[:, :-1] >= 0) & np.isfinite(areas(time, production)) & \
+      np.isfinite(production[:, 1:]) & np.isfinite(production[:, :-1])
+    group = (np.arange(num_wells)[:, np.newaxis]*num_stages + stage[:, 1:])[valid]
+    volume = np.bincount(group, weights=areas(time, production)[valid], minlength=num_wells*num_stages)
+    excess = 0.5*(production[:, 1:] - baseline_after + production[:, :-1] - baseline_before)*np.diff(time, axis=1)
+    uplift = np.bincount(group, weights=excess[valid], minlength=num_wells*num_stages).reshape(num_wells, num_stages)
+    present = np.bincount(group, minlength=num_wells*num_stages).reshape(num_wells, num_stages) > 0
+    uplift[:, 0] = np.nan
+    uplift[~present] = np.nan
+    return volume.reshape(num_wells, num_stages), uplift
+
+
+def _curves(flat):
+    flat = np.atleast_2d(np.asarray(flat, dtype=float))
+    if len(set(flat[:, 0])) != 1 or len(set(flat[:, 1])) != 1:
+        raise ValueError('Curves must share their degree and number of knots.')
+    num_knots = int(flat[0, 1])
+    return int(flat[0, 0]), flat[:, 2:2+num_knots], flat[:, 2+num_knots:]
+
+
+def _evaluate_curves(flat, time, antiderivative):
+    degree, knots, coefficients = _curves(flat)
+    time = np.asarray(time, dtype=float)
+    values = np.empty((len(knots), len(time)))
+    unique, inverse = np.unique(knots, axis=0, return_inverse=True)
+    for iknots, t in enumerate(unique):
+        rows = np.flatnonzero(inverse.ravel() == iknots)
+        spline = spint.BSpline(t, coefficients[rows].T, degree, extrapolate=False)
+        if antiderivative:
+            spline = spline.antiderivative()
+        values[rows] = spline(time).T
+    return values
+
+
+def rate_curves(flat, time):
+    """
+    Returns the rates (num_curves, num_samples) of the spline curves (rows of Curve.to_flat())
+    on the shared time grid, nan outside their knots.
+    """
+    return _evaluate_curves(flat, time, False)
+
+
+def cumulative_curves(flat, time):
+    """
+    Returns the exact integrals (num_curves, num_samples) of the spline curves from time[0].
+    """
+    antiderivative = _evaluate_curves(flat, time, True)
+    return antiderivative - antiderivative[:, :1]
+
+
+def summary(time, production, stage=None, economic_limit=None, names=None, total=None, decline='hyperbolic'):
+    """
+    Returns the columns (dictionary of arrays, one row per well) first and last time, initial and
+    peak rate, cumulative production, the time the rate falls below economic_limit (scalar or per
+    well) for good and the EUR up to then (the cumulative production if it does not), and with stage the
+    number of stages and per stage volume_<s> and uplift_<s> (see stage_volumes). total defaults to
+    the trapezoid cumulative of production.
+    """
+    time, production = _rows(time, production)
+    total = cumulative(time, production) if total is None else total
+    num_wells = len(production)
+    valid = np.isfinite(time) & np.isfinite(production)
+    rows = np.arange(num_wells)
+    first = np.argmax(valid, axis=1)
+    last = production.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    with np.errstate(invalid='ignore'):
+        columns = {'well': np.asarray(names) if names is not None else rows,
+          'time_first': time[rows, first], 'time_last': time[rows, last],
+          'rate_initial': production[rows, first], 'rate_peak': np.nanmax(np.where(valid, production, np.nan), axis=1),
+          'cumulative': total[rows, last]}
+    if economic_limit is not None:
+        time_limit, index = crossing(time, production, economic_limit, last=True)
+        index[production[rows, last] >= _row_values(economic_limit, num_wells)] = -1
+        time_limit[index < 0] = np.nan
+        columns['time_economic_limit'] = time_limit
+        columns['eur'] = np.where(index >= 0, cumulative_at(time, production, total, time_limit, index),
+          columns['cumulative'])
+    if stage is not None:
+        stage = np.atleast_2d(stage)
+        volume, uplift = stage_volumes(time, production, stage, decline)
+        columns['num_stages'] = np.max(stage, axis=1) + 1
+        for istage in range(volume.shape[1]):
+            columns['volume_{0:d}'.format(istage)] = volume[:, istage]
+            columns['uplift_{0:d}'.format(istage)] = uplift[:, istage]
+    return columns
+
+
+def summary_curves(flat, time, stage=None, economic_limit=None, names=None, decline='hyperbolic'):
+    """
+    summary() of spline curves evaluated on the shared time grid, with their exact cumulatives.
+    """
+    return summary(time, rate_curves(flat, time), stage, economic_limit, names, cumulative_curves(flat, time),
+      decline)
+
+
+def write_summary(columns, fname):
+    names = list(columns)
+    with open(fname, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        writer.writerows(zip(*[columns[name] for name in names]))
+
+
+def test_kpi():
+    import tinkerbell.app.make as tbamk
+    import tinkerbell.domain.make as tbdmk
+    import tinkerbell.domain.point as tbdpt
+    time = np.linspace(0.0, 60.0, 601)
+    stage = (time >= 30.0).astype(int)
+    production = np.array([np.where(stage == 0, tbamk.exponential_decline(100.0, 0.1, time),
+      tbamk.exponential_decline(40.0, 0.05, time - 30.0)), tbamk.exponential_decline(50.0, 0.02, time)])
+    production[1, 400:] = np.nan # ragged
+    columns = summary(time, production, np.array([stage, np.where(np.isnan(production[1]), -1, 0)]),
+      economic_limit=[20.0, 10.0])
+    exact = 1000.0*(1.0 - np.exp(-3.0)) + 800.0*(1.0 - np.exp(-1.5))
+    assert np.allclose(columns['cumulative'], [exact, 2500.0*(1.0 - np.exp(-0.02*time[399]))], rtol=2e-3)
+    assert np.isclose(columns['time_economic_limit'][0], 30.0 + np.log(2.0)/0.05, rtol=1e-3)
+    assert np.isnan(columns['time_economic_limit'][1]) and columns['eur'][1] == columns['cumulative'][1]
+    assert np.isclose(columns['eur'][0], 1000.0*(1.0 - np.exp(-3.0)) + 400.0, rtol=2e-3)
+    assert np.allclose(columns['volume_0'] + columns['volume_1'], columns['cumulative'])
+    # the stage 0 decline continued would have produced 1000 (exp(-3) - exp(-6)) over stage 1
+    assert np.isclose(columns['uplift_1'][0], 800.0*(1.0 - np.exp(-1.5)) - 1000.0*(np.exp(-3.0) - np.exp(-6.0)),
+      rtol=5e-3)
+    assert np.isnan(columns['uplift_0'][0]) and np.isnan(columns['uplift_1'][1])
+    flat = np.array([tbdmk.curve_lsq_fixed_knots(tbdpt.from_coordinates(time, production[0]*scale), [20.0, 40.0],
+      3).to_flat()
+      for scale in (1.0, 2.0)])
+    total = cumulative_curves(flat, time)
+    assert np.allclose(total[1], 2.0*total[0]) and np.isclose(total[0, -1], exact, rtol=1e-2)
+    assert np.allclose(summary_curves(flat, time)['cumulative'], total[:, -1])
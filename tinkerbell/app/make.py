@@ -1,6 +1,7 @@
 import numpy as np
 import tinkerbell.domain.point as tbdpt
 import tinkerbell.domain.make as tbdmk
+import tinkerbell.profiling as tbpf
 
 
 def exponential_decline(y_i, d, x):
@@ -17,6 +18,25 @@ def exponential_decline(y_i, d, x):
     return y_i*np.exp(-d*x)
 
 
+def hyperbolic_decline(y_i, d, b, x):
+    """
+    Arps hyperbolic decline, b -> 0 is exponential and b = 1 harmonic decline.
+
+    Parameters
+    ----------
+    y_i: float
+         Start value.
+    d: float
+       Initial decline rate (positive).
+    b: float
+       Hyperbolic exponent (positive).
+    x: float
+       Independent variable.
+    """
+    return y_i*(1.0 + b*d*x)**(-1.0/b)
+
+
+@tbpf.profiled
 def points_exponential_discontinuous_declinelinear_noisy(yi, d, xmax, xdisc, y_jumpfactor=5.0, num=50, noise=0.1, noise_mean=1.0):
     xmin = 0.0
     xdata = np.linspace(xmin, xmax, num)
@@ -35,6 +55,7 @@ def points_exponential_discontinuous_declinelinear_noisy(yi, d, xmax, xdisc, y_j
     return [tbdpt.Point(x, y) for x, y in zip(xdata, ydata_noise)], ixdisc
 
 
+@tbpf.profiled
 def points_exponential_discontinuous_declinebase2_noisy(yi, d, pmax, xdisc, y_jumpfactor=5.0, num=50, noise=0.1, noise_mean=1.0):
     pmin = 0.1
     xdata = np.logspace(pmin, pmax, num, base=2.0)
@@ -56,6 +77,7 @@ def knots_internal_four_heavy_right(xcenter, xmax, dx):
     return [xcenter-dx, xcenter, xcenter+dx, xmax-(xmax-xcenter+dx)/2]
 
 
+@tbpf.profiled
 def detect_stages(x, y, stage_zero=0, num_stages_max=None, num_samples_window=2):
     """
     Returns stage vector.
@@ -1,12 +1,26 @@
+import os
+import json
 import numpy as np
 import pickle
+import shutil
 import sys
+import time as tm
 import logging as log
-import keras.models as kem
-import keras.layers as kel
-import keras.callbacks as kec
-import sklearn.preprocessing as skprep
 import collections as coll
+import tinkerbell.profiling as tbpf
+import tinkerbell.app.scaler as tbasc
+from tinkerbell.lazy import lazy_import
+
+kem = lazy_import('keras.models')
+kel = lazy_import('keras.layers')
+kec = lazy_import('keras.callbacks')
+tbatm = lazy_import('tinkerbell.app.telemetry')
+
+
+def __getattr__(name):
+    if name == 'ProgressBar':
+        return tbatm.ProgressBar
+    raise AttributeError('module \'{0}\' has no attribute \'{1}\''.format(__name__, name))
 
 
 def makes_deep_copy(fct):
@@ -58,18 +72,22 @@ class Targets:
 
 class Normalizer:
     def __init__(self):
-        self.features = skprep.MinMaxScaler(feature_range=(-1, 1))
-        self.targets = skprep.MinMaxScaler(feature_range=(-1, 1))
+        self.features = tbasc.Scaler(feature_range=(-1, 1))
+        self.targets = tbasc.Scaler(feature_range=(-1, 1))
 
+    @tbpf.profiled
     def normalize_features(self, features):
         return self.features.transform(features.matrix())
 
+    @tbpf.profiled
     def denormalize_features(self, feature_matrix):
         return self.features.inverse_transform(feature_matrix)
 
+    @tbpf.profiled
     def normalize_targets(self, targets):
         return self.targets.transform(targets.matrix())
 
+    @tbpf.profiled
     def denormalize_targets(self, target_matrix):
         return self.targets.inverse_transform(target_matrix)
 
@@ -81,52 +99,128 @@ class Normalizer:
         normalizer.targets.fit(targets.matrix())
         return normalizer
 
-    def save(self, fname):
-        pickle.dump(self, open(fname, "wb"))
-
-    @staticmethod
-    def load(fname):
-        return pickle.load(open(fname, "rb"))
-
-
-class ProgressBar:
-    def __init__(self, num_iterations):
-        self.fill = '█'
-        self.length = 50
-        self.decimals = 1
-        self.num_iterations = num_iterations
-
-    def __enter__(self):
-        self.update()
+    def partial_fit(self, features, targets):
+        """
+        Updates the scalers with another chunk of features and targets.
+        """
+        self.features.partial_fit(features.matrix())
+        self.targets.partial_fit(targets.matrix())
         return self
 
-    def __exit__(self, *args):
-        print()
+    def merge(self, other):
+        """
+        Combines a normalizer fitted on other wells, e.g. in another worker, into this one.
+        """
+        self.features.merge(other.features)
+        self.targets.merge(other.targets)
+        return self
 
-    def update(self, iteration=0, history=None):
-        iteration = iteration + 1
-        fraction = ("{0:." + str(self.decimals) + "f}").format(100.0*iteration/self.num_iterations)
-        num_filled = int(self.length * iteration // self.num_iterations)
-        bar = self.fill * num_filled + '-' * (self.length - num_filled)
-        loss = 0.0
-        if history:
-            try:
-                loss = history.history['loss'][-1]
-            except:
-                loss = history.history['loss']
-        print('\rTraining |%s| %s%% complete, loss = %f.' % (bar, fraction, loss), end='\r')
+    def save(self, fname):
+        save_normalizer(self, fname)
 
+    @staticmethod
+    def load(fname):
+        return load_normalizer(fname)
+
+
+TrainingReport = coll.namedtuple("TrainingReport", "time_wall epoch_stopped stopped_early history")
+
+
+def checkpoint(model, fname, period):
+    """
+    Returns a callback saving the model to fname, and the number of completed
+    epochs to fname.json, every period epochs.
+    """
+    def save_checkpoint(epoch, logs):
+        if (epoch+1) % period == 0:
+            save(model, fname)
+            with open(fname + '.json', 'w') as f:
+                json.dump({'epoch': epoch+1}, f)
+    return kec.LambdaCallback(on_epoch_end=save_checkpoint)
+
+
+def restore_checkpoint(model, fname):
+    """
+    Restores the weights and the optimizer state saved by checkpoint() into the compiled
+    model, so training continues where it stopped. Returns the number of completed epochs.
+    """
+    with open(fname + '.json') as f:
+        epoch = json.load(f)['epoch']
+    checkpointed = load(fname)
+    model.set_weights(checkpointed.get_weights())
+    model.optimizer.build(model.trainable_variables)
+    for variable, value in zip(model.optimizer.variables, checkpointed.optimizer.variables):
+        variable.assign(value)
+    return epoch
+
+
+def remove_checkpoint(fname):
+    if os.path.isdir(fname):
+        shutil.rmtree(fname)
+    for fname_remove in (fname, fname + '.json'):
+        if os.path.isfile(fname_remove):
+            os.remove(fname_remove)
+
+
+def train(model, X, y, num_epochs, batch_size, validation_split=0.0, patience=None,
+          fname_checkpoint=None, period_checkpoint=10, fname_telemetry=None, callbacks=None, sample_weight=None):
+    """
+    Fits the model in a single call, resetting its states after every epoch.
+
+    Parameters
+    ----------
+    validation_split: float
+        Fraction of trailing samples held out for validation.
+    patience: int
+        Stop after this many epochs without improvement of the validation loss,
+        or of the training loss if there is no validation split.
+    fname_checkpoint: str
+        Saves the model and optimizer state there every period_checkpoint epochs,
+        an interrupted run resumes from the last checkpoint. The checkpoint is
+        removed once the fit completes.
+    fname_telemetry: str
+        Per epoch telemetry records are written there, see telemetry.Telemetry.
+    sample_weight: array
+        Per sample loss weights, zero for padding.
+
+    Returns a TrainingReport, which is also attached to the model as model.report
+    (as keras attaches model.history).
+    """
+    epoch_initial = 0
+    if fname_checkpoint and os.path.exists(fname_checkpoint + '.json'):
+        epoch_initial = restore_checkpoint(model, fname_checkpoint)
+        log.info('Resuming training from \'{0}\' at epoch {1:d}.'.format(fname_checkpoint, epoch_initial))
 
-def train(model, X, y, num_epochs, batch_size):
-    with ProgressBar(num_epochs) as progress_bar:
-        for i in range(num_epochs):
-            history = model.fit(X, y, epochs=1, batch_size=batch_size, shuffle=False, verbose=0)
-            model.reset_states()
-            progress_bar.update(i, history)
+    reset_state = kec.LambdaCallback(on_epoch_end=lambda *_ : model.reset_states())
+    callbacks = [reset_state] + list(callbacks or [])
+    if patience is not None:
+        monitor = 'val_loss' if validation_split > 0.0 else 'loss'
+        callbacks += [kec.EarlyStopping(monitor=monitor, patience=patience)]
+    if fname_checkpoint:
+        callbacks += [checkpoint(model, fname_checkpoint, period_checkpoint)]
+
+    callbacks += [tbatm.Telemetry(fname_telemetry, num_samples=int(len(X)*(1.0-validation_split)),
+      initial_epoch=epoch_initial)]
+
+    time_start = tm.time()
+    history = model.fit(X, y, epochs=num_epochs, initial_epoch=epoch_initial, batch_size=batch_size,
+      shuffle=False, verbose=0, validation_split=validation_split, callbacks=callbacks, sample_weight=sample_weight)
+    time_wall = tm.time() - time_start
+    if fname_checkpoint:
+        remove_checkpoint(fname_checkpoint)
+
+    epoch_stopped = history.epoch[-1]+1 if history.epoch else epoch_initial
+    report = TrainingReport(time_wall, epoch_stopped, epoch_stopped < num_epochs, history.history)
+    log.info('Trained {0:d} epochs in {1:.1f} s.'.format(epoch_stopped-epoch_initial, time_wall))
+    model.report = report
+    return report
 
 
 @makes_deep_copy
-def lstm(feature_matrix, target_matrix, batch_size, num_epochs, num_neurons):
+def lstm(feature_matrix, target_matrix, batch_size, num_epochs, num_neurons, **kwargs):
+    """
+    Keyword arguments are passed to train().
+    """
     log.info('LSTM model with {0:d} neurons'.format(num_neurons))
     X, y = feature_matrix, target_matrix[:, 0]
     X = X.reshape(X.shape[0], 1, X.shape[1])
@@ -134,12 +228,122 @@ def lstm(feature_matrix, target_matrix, batch_size, num_epochs, num_neurons):
     model.add(kel.LSTM(num_neurons, batch_input_shape=(batch_size, X.shape[1], X.shape[2]), stateful=True))
     model.add(kel.Dense(1))
     model.compile(loss='mean_squared_error', optimizer='adam')
-    train(model, X, y, num_epochs, batch_size)
+    train(model, X, y, num_epochs, batch_size, **kwargs)
     return model
 
 
+Streams = coll.namedtuple("Streams", "X y sample_weight resets")
+
+
+@tbpf.profiled
+def streams(feature_matrices, target_matrices, num_streams):
+    """
+    Lays out the rows of several wells as num_streams parallel streams of a stateful
+    model, time major: row t*num_streams + i of a round is timestep t of the i-th well
+    of the round. Wells are assigned to rounds of num_streams by decreasing length,
+    shorter wells and empty streams are padded with zero weight. resets are the batch
+    indices at which a new round of wells starts.
+    """
+    lengths = np.array([len(matrix) for matrix in feature_matrices])
+    num_features = feature_matrices[0].shape[1]
+    order = np.argsort(-lengths, kind='stable')
+    X, y, sample_weight, resets = [], [], [], []
+    num_batches = 0
+    for start in range(0, len(order), num_streams):
+        wells = order[start:start+num_streams]
+        num_timesteps = lengths[wells].max()
+        X_round = np.zeros((num_timesteps, num_streams, num_features))
+        y_round = np.zeros((num_timesteps, num_streams))
+        weight_round = np.zeros((num_timesteps, num_streams))
+        for istream, iwell in enumerate(wells):
+            X_round[:lengths[iwell], istream] = feature_matrices[iwell]
+            y_round[:lengths[iwell], istream] = target_matrices[iwell][:, 0]
+            weight_round[:lengths[iwell], istream] = 1.0
+        X += [X_round.reshape(-1, 1, num_features)]
+        y += [y_round.ravel()]
+        sample_weight += [weight_round.ravel()]
+        resets += [num_batches]
+        num_batches += num_timesteps
+    return Streams(np.concatenate(X), np.concatenate(y), np.concatenate(sample_weight), resets[1:])
+
+
+@makes_deep_copy
+def lstm_streams(feature_matrices, target_matrices, num_streams, num_epochs, num_neurons, **kwargs):
+    """
+    lstm() trained on several wells at once, as num_streams parallel stateful streams
+    whose states are reset at the start of every round of wells (see streams()).
+    Returns the model rebuilt for a batch of one, as lstm() with batch_size=1.
+    Keyword arguments are passed to train(), validation_split is not supported.
+    """
+    log.info('LSTM model with {0:d} neurons on {1:d} wells in {2:d} streams'.format(num_neurons,
+      len(feature_matrices), num_streams))
+    layout = streams(feature_matrices, target_matrices, num_streams)
+    model = kem.Sequential()
+    model.add(kel.LSTM(num_neurons, batch_input_shape=(num_streams, 1, layout.X.shape[2]), stateful=True))
+    model.add(kel.Dense(1))
+    model.compile(loss='mean_squared_error', optimizer='adam')
+    resets = set(layout.resets)
+    reset_round = kec.LambdaCallback(on_batch_begin=lambda batch, logs: model.reset_states() if batch in resets else None)
+    callbacks = [reset_round] + list(kwargs.pop('callbacks', None) or [])
+    train(model, layout.X, layout.y, num_epochs, num_streams, callbacks=callbacks, sample_weight=layout.sample_weight,
+      **kwargs)
+    model_single = rebatch(model, 1)
+    model_single.report = model.report
+    return model_single
+
+
 NormalizerSeq = coll.namedtuple("NormalizerSeq", "time stage production")
 NormalizerGrad = coll.namedtuple("NormalizerGrad", "dp_dt_src dp_dt_trg stage_delta")
+NORMALIZERS = (Normalizer, NormalizerSeq, NormalizerGrad)
+
+
+def _scaler_copy(scaler):
+    if isinstance(scaler, tbasc.Scaler):
+        return scaler.copy()
+    return tbasc.Scaler.from_minmax(scaler) # pickled by earlier versions
+
+
+def normalizer_to_flat(normalizer):
+    """
+    Returns the flat array of any of NORMALIZERS, its kind followed by its scalers (-1 if None).
+    """
+    scalers = [normalizer.features, normalizer.targets] if isinstance(normalizer, Normalizer) else list(normalizer)
+    return np.concatenate([[NORMALIZERS.index(type(normalizer))]] + [[-1.0] if scaler is None else
+      _scaler_copy(scaler).to_flat() for scaler in scalers])
+
+
+def normalizer_from_flat(flatdata):
+    kind = NORMALIZERS[int(flatdata[0])]
+    scalers, start = [], 1
+    while start < len(flatdata):
+        scaler, num_values = (None, 1) if flatdata[start] < 0 else tbasc.Scaler.from_flat(flatdata[start:])
+        scalers += [scaler]
+        start += num_values
+    if kind is Normalizer:
+        normalizer = Normalizer()
+        normalizer.features, normalizer.targets = scalers
+        return normalizer
+    return kind(*scalers)
+
+
+def save_normalizer(normalizer, fname):
+    """
+    Writes the normalizer as a .npy array to fname (as is, no extension added).
+    """
+    with open(fname, 'wb') as f:
+        np.save(f, normalizer_to_flat(normalizer))
+
+
+def load_normalizer(fname):
+    """
+    Reads a normalizer written by save_normalizer, or pickled by earlier versions.
+    """
+    with open(fname, 'rb') as f:
+        if f.read(len(np.lib.format.MAGIC_PREFIX)) != np.lib.format.MAGIC_PREFIX:
+            f.seek(0)
+            return pickle.load(f)
+        f.seek(0)
+        return normalizer_from_flat(np.load(f))
 
 
 @makes_deep_copy
@@ -158,9 +362,9 @@ def lstmseq(time, production, stage, num_epochs=1000):
     stage_delta = np.zeros_like(stage)
     stage_delta[1:] = np.diff(stage)
 
-    normalizer_stage_delta = skprep.MinMaxScaler(feature_range=(-1, 1))
-    normalizer_production = skprep.MinMaxScaler(feature_range=(-1, 1))
-    normalizer_time = skprep.MinMaxScaler(feature_range=(-1, 1))
+    normalizer_stage_delta = tbasc.Scaler(feature_range=(-1, 1))
+    normalizer_production = tbasc.Scaler(feature_range=(-1, 1))
+    normalizer_time = tbasc.Scaler(feature_range=(-1, 1))
 
     stage_delta_normalized = normalizer_stage_delta.fit_transform(stage_delta.reshape(-1, 1))
     production_normalized = normalizer_production.fit_transform(production.reshape(-1, 1))
@@ -187,6 +391,7 @@ def lstmseq(time, production, stage, num_epochs=1000):
     return model, NormalizerSeq(normalizer_time, normalizer_stage_delta, normalizer_production)
 
 
+@tbpf.profiled
 def predictseq(x, stage, normlizerseq, model):
     assert len(x) == len(stage)
     
@@ -203,12 +408,15 @@ def predictseq(x, stage, normlizerseq, model):
     X[0, :, 0] = time_normalized[:, 0] # first feature is time
     X[0, :, 1] = stage_delta_normalized[:, 0] # second feature is state change
 
-    yhat_normalized = model.predict(X)
+    with tbpf.section('keras.Model.predict'):
+        yhat_normalized = model.predict(X)
     yhat = normlizerseq.production.inverse_transform(yhat_normalized[0])
     return x, yhat[:, 0]
 
 
+@tbpf.profiled
 def predict(y_0, stage, normalizer, model, time=None):
+    model.reset_states()
     yhat = [y_0]
     for i in range(1, len(stage)-1): 
         # input is first value, last discarded internally due to grad calc
@@ -219,7 +427,8 @@ def predict(y_0, stage, normalizer, model, time=None):
         features_normalized = normalizer.normalize_features(features)
         features_normalized_timeframe = features_normalized.reshape(features_normalized.shape[0], 
           1, features_normalized.shape[1])
-        targets_normalized = model.predict(features_normalized_timeframe, batch_size=1)
+        with tbpf.section('keras.Model.predict'):
+            targets_normalized = model.predict(features_normalized_timeframe, batch_size=1)
         targets = normalizer.denormalize_targets(targets_normalized)
         dy_dt = targets[0, 0] 
         if time is None:
@@ -231,6 +440,34 @@ def predict(y_0, stage, normalizer, model, time=None):
     return np.array(yhat)
 
 
+@tbpf.profiled
+def predict_batch(y_0, stage, normalizer, model, time=None, noise=0.0):
+    """
+    predict() for a batch of wells rolled out at once, y_0 (num_wells,) and
+    stage (num_wells, num_samples); model must be built for a batch of num_wells
+    (see rebatch). Each step is multiplied by normal noise of mean one and std noise.
+    Returns (num_wells, num_samples-1).
+    """
+    stage = np.asarray(stage, dtype=float)
+    num_wells, num_samples = stage.shape
+    model.reset_states()
+    yhat = np.empty((num_wells, num_samples-1))
+    yhat[:, 0] = y_0
+    features = np.empty((num_wells, 2))
+    for i in range(1, num_samples-1):
+        features[:, 0] = yhat[:, i-1]
+        features[:, 1] = stage[:, i] - stage[:, i-1]
+        features_normalized = normalizer.features.transform(features)
+        with tbpf.section('keras.Model.predict'):
+            targets_normalized = model.predict_on_batch(features_normalized.reshape(num_wells, 1, 2))
+        dy_dt = normalizer.targets.inverse_transform(targets_normalized)[:, 0]
+        time_delta = 1.0 if time is None else time[i]-time[i-1]
+        yhat[:, i] = yhat[:, i-1] + time_delta*dy_dt
+        if noise:
+            yhat[:, i] *= np.random.normal(1.0, noise, num_wells)
+    return yhat
+
+
 def load(fname):
     return kem.load_model(fname)
 
@@ -239,40 +476,209 @@ def save(model, fname):
     return model.save(fname)
 
 
+def rebatch(model, batch_size):
+    """
+    Returns a copy of the (stateful) model built for batch_size streams, sharing
+    nothing but the weights values.
+    """
+    config = model.get_config()
+    for layer in (config['layers'] if isinstance(config, dict) else config):
+        if 'batch_input_shape' in layer['config']:
+            layer['config']['batch_input_shape'] = (batch_size,) + tuple(layer['config']['batch_input_shape'][1:])
+    clone = kem.Sequential.from_config(config)
+    clone.set_weights(model.get_weights())
+    return clone
+
+
+Bundle = coll.namedtuple("Bundle", "kind model normalizer params")
+
+
+def save_bundle(bundle, fname):
+    """
+    Writes the model to fname.h5 and kind, normalizer and params to fname.bundle.
+    """
+    save(bundle.model, fname + '.h5')
+    with open(fname + '.bundle', 'wb') as f:
+        pickle.dump({'kind': bundle.kind, 'normalizer': bundle.normalizer, 'params': bundle.params}, f)
+
+
+def load_bundle(fname):
+    with open(fname + '.bundle', 'rb') as f:
+        meta = pickle.load(f)
+    return Bundle(meta['kind'], load(fname + '.h5'), meta['normalizer'], meta['params'])
+
+
+def fit_bundle(kind, time, production, stage, num_epochs=1000, num_units=3, num_timesteps=3,
+               offset_forecast=1, **kwargs):
+    """
+    Trains a model of the given kind ('lstm', 'lstmseqwin' or 'lstmseqwingrad')
+    and returns it as bundle, num_timesteps and offset_forecast are unused by 'lstm'.
+    Keyword arguments are passed to train(), the epoch training stopped at and
+    whether it stopped early are recorded in the bundle params.
+    """
+    params = {'num_epochs': num_epochs, 'num_units': num_units, 'num_timesteps': num_timesteps,
+      'offset_forecast': offset_forecast}
+    if kind == 'lstm':
+        features = Features(production, stage)
+        targets = Targets(production, time)
+        normalizer = Normalizer.fit(features, targets)
+        model = lstm(normalizer.normalize_features(features), normalizer.normalize_targets(targets), 1,
+          num_epochs, num_units, **kwargs)
+    elif kind == 'lstmseqwin':
+        model, normalizer = lstmseqwin(production, stage, num_epochs, num_timesteps, num_units, offset_forecast,
+          **kwargs)
+    elif kind == 'lstmseqwingrad':
+        model, normalizer = lstmseqwingrad(production, time, stage, num_epochs, num_timesteps, num_units,
+          offset_forecast, **kwargs)
+    else:
+        raise ValueError('Unknown model kind \'{}\'.'.format(kind))
+    params['epoch_stopped'] = model.report.epoch_stopped
+    params['stopped_early'] = model.report.stopped_early
+    return Bundle(kind, model, normalizer, params)
+
+
+def _affine(*scalers):
+    """
+    Returns slope and intercept of the normalization x_n = a*x + c of the columns of scalers.
+    """
+    a = np.concatenate([np.ravel(scaler.scale_) for scaler in scalers])
+    c = np.concatenate([scaler.feature_range[0] - np.ravel(scaler.data_min_)*np.ravel(scaler.scale_)
+      for scaler in scalers])
+    return a, c
+
+
+def activation_output(model):
+    config = model.layers[-1].get_config()
+    return config['layer']['config']['activation'] if 'layer' in config else config['activation']
+
+
+def rescale_weights(model, affine_input, affine_input_new, affine_output, affine_output_new):
+    """
+    Adjusts first layer kernel and bias so the model sees the same inputs under the new
+    input normalization, and the last layer if linear so it returns the same outputs
+    under the new output normalization. Affines are (a, c) of x_n = a*x + c.
+    """
+    r = affine_input[0] / affine_input_new[0]
+    shift = affine_input[1] - r*affine_input_new[1]
+    weights = model.layers[0].get_weights()
+    weights[-1] = weights[-1] + shift.dot(weights[0])
+    weights[0] = weights[0] * r[:, np.newaxis]
+    model.layers[0].set_weights(weights)
+    if activation_output(model) == 'linear':
+        q = affine_output_new[0] / affine_output[0]
+        weights = model.layers[-1].get_weights()
+        weights[0] = weights[0] * q
+        weights[1] = q*weights[1] + affine_output_new[1] - q*affine_output[1]
+        model.layers[-1].set_weights(weights)
+
+
+def _exceeds(scaler, X):
+    X = np.asarray(X, dtype=float)
+    return bool(np.any(np.nanmin(X, axis=0) < scaler.data_min_) or np.any(np.nanmax(X, axis=0) > scaler.data_max_))
+
+
+def update_bundle(bundle, time, production, stage, num_epochs=50, patience=5, **kwargs):
+    """
+    Returns the bundle fine tuned on the (extended) data of a well, starting from its
+    weights. Normalizers whose range the data exceeds are refitted and the first and
+    (linear) last layer weights rescaled to match, then training runs for at most
+    num_epochs with early stopping after patience epochs. The update is appended to
+    params['lineage']. With num_epochs=0 only normalizers and weights are updated, which
+    keeps the predictions of 'lstm' and 'lstmseqwin' but not of 'lstmseqwingrad': its tanh
+    output layer is not rescaled while dp_dt_trg may be refitted, so it needs the training.
+    Keyword arguments are passed to train().
+    """
+    params = dict(bundle.params)
+    num_timesteps, offset_forecast = params.get('num_timesteps', 3), params.get('offset_forecast', 1)
+    normalizer = bundle.normalizer
+    if bundle.kind == 'lstm':
+        features, targets = Features(production, stage).matrix(), Targets(production, time).matrix()
+        scalers_input, scalers_output = [normalizer.features], [normalizer.targets]
+        data = {'features': features, 'targets': targets}
+        normalizer_new = Normalizer()
+        normalizer_new.features, normalizer_new.targets = [_scaler_copy(s).partial_fit(data[name])
+          for name, s in (('features', normalizer.features), ('targets', normalizer.targets))]
+        refit = [name for name in ('features', 'targets') if _exceeds(getattr(normalizer, name), data[name])]
+        inputs_new, outputs_new = [normalizer_new.features], [normalizer_new.targets]
+        X = normalizer_new.features.transform(features).reshape(len(features), 1, 2)
+        y = normalizer_new.targets.transform(targets)[:, 0]
+    elif bundle.kind == 'lstmseqwin':
+        data = {'stage': stage.reshape(-1, 1), 'production': production.reshape(-1, 1)}
+        normalizer_new = NormalizerSeq(normalizer.time, _scaler_copy(normalizer.stage).partial_fit(data['stage']),
+          _scaler_copy(normalizer.production).partial_fit(data['production']))
+        refit = [name for name in data if _exceeds(getattr(normalizer, name), data[name])]
+        scalers_input, scalers_output = [normalizer.production, normalizer.stage], [normalizer.production]
+        inputs_new, outputs_new = [normalizer_new.production, normalizer_new.stage], [normalizer_new.production]
+        X, y = windows_seqwin(normalizer_new.production.transform(data['production']),
+          normalizer_new.stage.transform(data['stage']), num_timesteps, offset_forecast)
+    elif bundle.kind == 'lstmseqwingrad':
+        dp_dt = (np.diff(production) / np.diff(time)).reshape(-1, 1)
+        data = {'dp_dt_src': dp_dt, 'dp_dt_trg': dp_dt, 'stage_delta': np.diff(stage).reshape(-1, 1)}
+        normalizer_new = NormalizerGrad(*[_scaler_copy(getattr(normalizer, name)).partial_fit(data[name])
+          for name in NormalizerGrad._fields])
+        refit = [name for name in NormalizerGrad._fields if _exceeds(getattr(normalizer, name), data[name])]
+        scalers_input, scalers_output = [normalizer.dp_dt_src, normalizer.stage_delta], [normalizer.dp_dt_trg]
+        inputs_new, outputs_new = [normalizer_new.dp_dt_src, normalizer_new.stage_delta], [normalizer_new.dp_dt_trg]
+        X, y = windows_seqwingrad(normalizer_new.dp_dt_src.transform(dp_dt), normalizer_new.dp_dt_trg.transform(dp_dt),
+          normalizer_new.stage_delta.transform(data['stage_delta']), num_timesteps, offset_forecast)
+    else:
+        raise ValueError('Unknown model kind \'{}\'.'.format(bundle.kind))
+
+    model = rebatch(bundle.model, 1)
+    model.compile(loss='mean_squared_error', optimizer='adam')
+    if refit:
+        log.info('Data exceeds the range of {0}, rescaling weights.'.format(', '.join(refit)))
+        rescale_weights(model, _affine(*scalers_input), _affine(*inputs_new), _affine(*scalers_output),
+          _affine(*outputs_new))
+    report = train(model, X, y, num_epochs, 1, patience=patience, **kwargs) if num_epochs > 0 else \
+      TrainingReport(0.0, 0, False, {})
+    params['lineage'] = list(params.get('lineage', [])) + [{'date': tm.strftime('%Y-%m-%dT%H:%M:%S'),
+      'num_samples': len(production), 'refit': refit, 'epoch_stopped': report.epoch_stopped,
+      'time_wall': report.time_wall}]
+    return Bundle(bundle.kind, model, normalizer_new, params)
+
+
+@tbpf.profiled
+def windows_seqwin(production_normalized, stage_normalized, num_timesteps, offset_forecast):
+    """
+    Returns the feature (production, stage) and target (production) windows of
+    lstmseqwin, shaped (num_sequences, num_timesteps, 2) and (num_sequences, num_timesteps, 1).
+    """
+    num_features = 2
+    num_targets = 1
+    num_sequences = len(production_normalized) - num_timesteps - offset_forecast
+    X = np.zeros((num_sequences, num_timesteps, num_features))
+    y = np.zeros((num_sequences, num_timesteps, num_targets))
+    for isequence in range(num_sequences):
+        for itimestep in range(num_timesteps):
+            ifeature = 0
+            X[isequence, itimestep, ifeature] = production_normalized[isequence+itimestep, 0]
+            ifeature = 1
+            X[isequence, itimestep, ifeature] = stage_normalized[isequence+itimestep+offset_forecast, 0]
+            itarget = 0
+            y[isequence, itimestep, itarget] = production_normalized[isequence+itimestep+offset_forecast, 0]
+    return X, y
+
+
 @makes_deep_copy
 def lstmseqwin(production, stage, num_epochs=1000, num_timesteps=3, num_units=3,
-               offset_forecast=1):
+               offset_forecast=1, **kwargs):
     log.info('LSTM sequence model with window.')
     RNN_t = kel.LSTM
     #RNN_t = kel.SimpleRNN
-    num_time = len(production)
-    num_sequences = num_time - num_timesteps - offset_forecast
     num_features = 2 # production and stage delta
-    
     num_targets = 1
     log.info(num_timesteps)
     
-    normalizer_stage = skprep.MinMaxScaler(feature_range=(-1, 1))
-    normalizer_production = skprep.MinMaxScaler(feature_range=(0, 1))
+    normalizer_stage = tbasc.Scaler(feature_range=(-1, 1))
+    normalizer_production = tbasc.Scaler(feature_range=(0, 1))
 
     stage_normalized = normalizer_stage.fit_transform(stage.reshape(-1, 1))
     production_normalized = normalizer_production.fit_transform(production.reshape(-1, 1))
     
-    X = np.zeros((num_sequences, num_timesteps, num_features))
-    y = np.zeros((num_sequences, num_timesteps, num_targets))
-
-    for isequence in range(num_sequences):
-        for itimestep in range(num_timesteps):
-            ifeature = 0
-            X[isequence, itimestep, ifeature] = production_normalized[isequence+itimestep, 0]
-            ifeature = 1
-            X[isequence, itimestep, ifeature] = stage_normalized[isequence+itimestep+offset_forecast, 0]
-            itarget = 0
-            y[isequence, itimestep, itarget] = production_normalized[isequence+itimestep+offset_forecast, 0]
-        log.info('<sequence', isequence)            
-        log.info(X[isequence])
-        log.info(y[isequence])
-        log.info('sequence', isequence, '>')
+    X, y = windows_seqwin(production_normalized, stage_normalized, num_timesteps, offset_forecast)
+    log.info(X)
+    log.info(y)
     
     # expected input data shape: (batch_size, timesteps, data_dim) 
     batch_size = 1
@@ -283,16 +689,14 @@ def lstmseqwin(production, stage, num_epochs=1000, num_timesteps=3, num_units=3,
     #model.add(kel.Dropout(0.33))
     model.add(kel.TimeDistributed(kel.Dense(num_targets, activation='linear')))
     model.compile(loss='mean_squared_error', optimizer='adam')
-
-    reset_state = kec.LambdaCallback(on_epoch_end=lambda *_ : model.reset_states())
     
     model.summary()
-    model.fit(X, y, epochs=num_epochs, batch_size=batch_size, shuffle=False,
-      callbacks=[reset_state])
+    train(model, X, y, num_epochs, batch_size, **kwargs)
     
     return model, NormalizerSeq(None, normalizer_stage, normalizer_production)
 
 
+@tbpf.profiled
 def predictseqwin(y_init, stage, normalizer, model, offset_forecast):
     model.reset_states()
     yhat = list(y_init)
@@ -307,15 +711,69 @@ def predictseqwin(y_init, stage, normalizer, model, offset_forecast):
         production_window_normalized = normalizer.production.transform(production_window.reshape(-1, 1))
         X[0, :, 0] = production_window_normalized[:,0]
         X[0, :, 1] = stage_window_normalized[:,0]
-        y = model.predict(X, batch_size=1)
+        with tbpf.section('keras.Model.predict'):
+            y = model.predict(X, batch_size=1)
         production_predicted = normalizer.production.inverse_transform(y[0])
         yhat += [production_predicted[-offset_forecast, 0]] # always next value
     return np.array(yhat)
     
 
+@tbpf.profiled
+def predictseqwin_batch(y_init, stage, normalizer, model, offset_forecast, noise=0.0):
+    """
+    predictseqwin() for a batch of wells rolled out at once, y_init (num_wells, num_timesteps)
+    and stage (num_wells, num_samples); model must be built for a batch of num_wells
+    (see rebatch). Each step is multiplied by normal noise of mean one and std noise.
+    Returns (num_wells, num_samples-1).
+    """
+    model.reset_states()
+    stage = np.asarray(stage, dtype=float)
+    num_wells, num_timesteps = y_init.shape
+    num_y = stage.shape[1]
+    num_features = 2 # production and stage delta
+    yhat = np.empty((num_wells, num_y-1))
+    yhat[:, :num_timesteps] = y_init
+    stage_normalized = normalizer.stage.transform(stage.reshape(-1, 1)).reshape(stage.shape)
+    X = np.zeros((num_wells, num_timesteps, num_features))
+    for itime in range(num_timesteps, num_y-1):
+        production_window = yhat[:, itime-num_timesteps:itime]
+        X[:, :, 0] = normalizer.production.transform(production_window.reshape(-1, 1)).reshape(production_window.shape)
+        X[:, :, 1] = stage_normalized[:, itime-num_timesteps+1:itime+1]
+        with tbpf.section('keras.Model.predict'):
+            y = model.predict_on_batch(X)
+        production_predicted = normalizer.production.inverse_transform(y[:, -offset_forecast, :])
+        yhat[:, itime] = production_predicted[:, 0]
+        if noise:
+            yhat[:, itime] *= np.random.normal(1.0, noise, num_wells)
+    return yhat
+
+
+@tbpf.profiled
+def windows_seqwingrad(dp_dt_src_normalized, dp_dt_trg_normalized, stage_delta_normalized, num_timesteps,
+                      offset_forecast):
+    """
+    Returns the feature (dp_dt, stage delta) and target (dp_dt) windows of lstmseqwingrad,
+    shaped (num_sequences, num_timesteps, 2) and (num_sequences, num_timesteps, 1).
+    """
+    num_features = 2
+    num_targets = 1
+    num_sequences = len(dp_dt_src_normalized) - num_timesteps - offset_forecast + 1
+    X = np.zeros((num_sequences, num_timesteps, num_features))
+    y = np.zeros((num_sequences, num_timesteps, num_targets))
+    for isequence in range(num_sequences):
+        for itimestep in range(num_timesteps):
+            ifeature = 0
+            X[isequence, itimestep, ifeature] = dp_dt_src_normalized[isequence+itimestep, 0]
+            ifeature = 1
+            X[isequence, itimestep, ifeature] = stage_delta_normalized[isequence+itimestep+offset_forecast, 0]
+            itarget = 0
+            y[isequence, itimestep, itarget] = dp_dt_trg_normalized[isequence+itimestep+offset_forecast, 0]
+    return X, y
+
+
 @makes_deep_copy
 def lstmseqwingrad(production, time, stage, num_epochs=1000, num_timesteps=3, num_units=3,
-  offset_forecast=1):
+  offset_forecast=1, **kwargs):
     log.info('LSTM gradient sequence model with window.')
     RNN_t = kel.LSTM
     #RNN_t = kel.SimpleRNN
@@ -328,29 +786,16 @@ def lstmseqwingrad(production, time, stage, num_epochs=1000, num_timesteps=3, nu
     num_time = len(dp_dt)
     assert num_time == len(stage_delta)
 
-    normalizer_stage_delta = skprep.MinMaxScaler(feature_range=(-1, 1))
-    normalizer_dp_dt_src = skprep.MinMaxScaler(feature_range=(-1, 1))
-    normalizer_dp_dt_trg = skprep.MinMaxScaler(feature_range=(-1, 1))
+    normalizer_stage_delta = tbasc.Scaler(feature_range=(-1, 1))
+    normalizer_dp_dt_src = tbasc.Scaler(feature_range=(-1, 1))
+    normalizer_dp_dt_trg = tbasc.Scaler(feature_range=(-1, 1))
 
     stage_delta_normalized = normalizer_stage_delta.fit_transform(stage_delta.reshape(-1, 1))
     dp_dt_src_normalized = normalizer_dp_dt_src.fit_transform(dp_dt.reshape(-1, 1))    
     dp_dt_trg_normalized = normalizer_dp_dt_trg.fit_transform(dp_dt.reshape(-1, 1))    
 
-    num_sequences = num_time - num_timesteps - offset_forecast + 1
-    
-    X = np.zeros((num_sequences, num_timesteps, num_features))
-    y = np.zeros((num_sequences, num_timesteps, num_targets))
-
-    iflat = 0
-    for isequence in range(num_sequences):
-        for itimestep in range(num_timesteps):
-            ifeature = 0
-            X[isequence, itimestep, ifeature] = dp_dt_src_normalized[iflat+itimestep, 0]
-            ifeature = 1
-            X[isequence, itimestep, ifeature] = stage_delta_normalized[iflat+itimestep+offset_forecast, 0]
-            itarget = 0
-            y[isequence, itimestep, itarget] = dp_dt_trg_normalized[iflat+itimestep+offset_forecast, 0]
-        iflat += 1
+    X, y = windows_seqwingrad(dp_dt_src_normalized, dp_dt_trg_normalized, stage_delta_normalized,
+      num_timesteps, offset_forecast)
     idxprint = 5
     #print(dp_dt_src_normalized[:idxprint*2,0])
     print(X[:idxprint,:,:])
@@ -370,16 +815,14 @@ def lstmseqwingrad(production, time, stage, num_epochs=1000, num_timesteps=3, nu
     model.add(kel.TimeDistributed(kel.Dense(1, activation='tanh')))
     #model.add(kel.Dense(num_timesteps))
     model.compile(loss='mean_squared_error', optimizer='adam')
-
-    reset_state = kec.LambdaCallback(on_epoch_end=lambda *_ : model.reset_states())
     
     model.summary()
-    model.fit(X, y, epochs=num_epochs, batch_size=batch_size, shuffle=False,
-      callbacks=[reset_state])
+    train(model, X, y, num_epochs, batch_size, **kwargs)
     
     return model, NormalizerGrad(normalizer_dp_dt_src, normalizer_dp_dt_trg, normalizer_stage_delta)
 
 
+@tbpf.profiled
 def predictseqwingrad(y_init, time, stage, normalizer, model, offset_forecast):
     model.reset_states()
     yhat = list(y_init)
@@ -399,10 +842,118 @@ def predictseqwingrad(y_init, time, stage, normalizer, model, offset_forecast):
         X[0, :, 1] = stage_delta_normalized[:, 0]
         #print(X)
         #input('...')
-        y = model.predict(X)
+        with tbpf.section('keras.Model.predict'):
+            y = model.predict(X)
         dp_dt_predicted = normalizer.dp_dt_trg.inverse_transform(y[0])
         dp_dt_predicted = dp_dt_predicted[-offset_forecast, 0]
         time_delta = time[itime] - time[itime-1]
         pprev = yhat[-1]
         yhat += [pprev + time_delta*dp_dt_predicted] #  value at yhat[itime]
     return np.array(yhat)
+
+
+@tbpf.profiled
+def predictseqwingrad_batch(y_init, time, stage, normalizer, model, offset_forecast, noise=0.0):
+    """
+    predictseqwingrad() for a batch of wells rolled out at once, y_init (num_wells, num_timesteps+1),
+    time (num_samples,) shared and stage (num_wells, num_samples); model must be built for a batch
+    of num_wells (see rebatch). Each step is multiplied by normal noise of mean one and std noise.
+    """
+    model.reset_states()
+    stage = np.asarray(stage, dtype=float)
+    num_wells = y_init.shape[0]
+    num_features = 2
+    num_timesteps = y_init.shape[1] - 1
+    num_time = len(time) - num_timesteps - offset_forecast
+    yhat = np.empty((num_wells, max(num_time, y_init.shape[1])))
+    yhat[:, :y_init.shape[1]] = y_init
+    stage_delta = np.diff(stage, axis=1)
+    stage_delta_normalized = normalizer.stage_delta.transform(stage_delta.reshape(-1, 1)).reshape(stage_delta.shape)
+    time_delta = np.diff(time)
+    X = np.zeros((num_wells, num_timesteps, num_features))
+    for itime in range(num_timesteps + 1, num_time):
+        dp_dt_src = np.diff(yhat[:, itime-num_timesteps-1:itime], axis=1) / time_delta[itime-num_timesteps-1:itime-1]
+        X[:, :, 0] = normalizer.dp_dt_src.transform(dp_dt_src.reshape(-1, 1)).reshape(dp_dt_src.shape)
+        X[:, :, 1] = stage_delta_normalized[:, itime-num_timesteps:itime]
+        with tbpf.section('keras.Model.predict'):
+            y = model.predict_on_batch(X)
+        dp_dt_predicted = normalizer.dp_dt_trg.inverse_transform(y[:, -offset_forecast, :])[:, 0]
+        yhat[:, itime] = yhat[:, itime-1] + time_delta[itime-1]*dp_dt_predicted
+        if noise:
+            yhat[:, itime] *= np.random.normal(1.0, noise, num_wells)
+    return yhat[:, :max(num_time, y_init.shape[1])]
+
+
+def test_streams():
+    feature_matrices = [np.full((num, 2), iwell+1.0) for iwell, num in enumerate((3, 5, 2))]
+    target_matrices = [matrix[:, :1] for matrix in feature_matrices]
+    layout = streams(feature_matrices, target_matrices, 2)
+    # rounds (well 1, well 0) of 5 timesteps and (well 2, empty) of 2
+    assert layout.X.shape == (14, 1, 2) and layout.resets == [5]
+    assert np.array_equal(layout.y[:10], [2, 1, 2, 1, 2, 1, 2, 0, 2, 0])
+    assert np.array_equal(layout.sample_weight, [1, 1, 1, 1, 1, 1, 1, 0, 1, 0, 1, 0, 1, 0])
+    assert np.array_equal(layout.X[10:, 0, 0], [3, 0, 3, 0])
+
+
+def test_normalizer_flat():
+    import tempfile
+    with tempfile.TemporaryDirectory() as dirname:
+        fname = os.path.join(dirname, 'normalizer')
+        production, stage = np.linspace(10.0, 1.0, 20), np.r_[np.zeros(10), np.ones(10)]
+        features, targets = Features(production, stage), Targets(production)
+        normalizer = Normalizer.fit(features, targets)
+        merged = Normalizer().partial_fit(Features(production[:8], stage[:8]), Targets(production[:8])).merge(
+          Normalizer().partial_fit(Features(production[7:], stage[7:]), Targets(production[7:])))
+        merged.save(fname)
+        loaded = Normalizer.load(fname)
+        assert np.allclose(loaded.normalize_features(features), normalizer.normalize_features(features))
+        assert np.allclose(loaded.normalize_targets(targets), normalizer.normalize_targets(targets))
+        pickle.dump(normalizer, open(fname, 'wb'))
+        assert np.allclose(Normalizer.load(fname).normalize_features(features), normalizer.normalize_features(features))
+        normalizer_grad = NormalizerGrad(*[tbasc.Scaler((-1, 1)).fit(np.c_[production]) for _ in range(3)])
+        save_normalizer(normalizer_grad, fname)
+        assert isinstance(load_normalizer(fname), NormalizerGrad)
+        normalizer_seq = NormalizerSeq(None, tbasc.Scaler((-1, 1)).fit(np.c_[stage]), tbasc.Scaler().fit(np.c_[production]))
+        restored = normalizer_from_flat(normalizer_to_flat(normalizer_seq))
+        assert restored.time is None and np.allclose(restored.production.transform([[5.5]]), 0.5)
+
+
+def test_rescale_weights():
+    class Layer:
+        def __init__(self, weights, activation):
+            self.weights, self.activation = weights, activation
+
+        def get_weights(self):
+            return [np.copy(w) for w in self.weights]
+
+        def set_weights(self, weights):
+            self.weights = weights
+
+        def get_config(self):
+            return {'activation': self.activation}
+
+    np.random.seed(42)
+    num_units = 3
+    X_old, X = np.random.uniform(0.0, 1.0, (20, 2)), np.random.uniform(-1.0, 3.0, (20, 2))
+    y_old, y = np.random.uniform(0.0, 1.0, (20, 1)), np.random.uniform(0.0, 5.0, (20, 1))
+    inputs, outputs = tbasc.Scaler((-1, 1)).fit(X_old), tbasc.Scaler((-1, 1)).fit(y_old)
+    inputs_new, outputs_new = inputs.copy().partial_fit(X), outputs.copy().partial_fit(y)
+    assert not _exceeds(inputs, X_old) and _exceeds(inputs, X) and _exceeds(outputs, [[1.5]])
+    assert _exceeds(outputs, [[-0.1]]) and not _exceeds(outputs, [[0.5], [np.nan]])
+    lstm = Layer([np.random.normal(size=(2, 4*num_units)), np.random.normal(size=(num_units, 4*num_units)),
+      np.random.normal(size=4*num_units)], 'tanh')
+    dense = Layer([np.random.normal(size=(num_units, 1)), np.random.normal(size=1)], 'linear')
+    model = coll.namedtuple("Model", "layers")([lstm, dense])
+    z = inputs.transform(X).dot(lstm.weights[0]) + lstm.weights[-1]
+    h = np.random.uniform(-1.0, 1.0, (20, num_units))
+    yhat = outputs.inverse_transform(h.dot(dense.weights[0]) + dense.weights[1])
+    recurrent_kernel = np.copy(lstm.weights[1])
+    rescale_weights(model, _affine(inputs), _affine(inputs_new), _affine(outputs), _affine(outputs_new))
+    assert np.allclose(inputs_new.transform(X).dot(lstm.weights[0]) + lstm.weights[-1], z)
+    assert np.array_equal(lstm.weights[1], recurrent_kernel)
+    assert np.allclose(outputs_new.inverse_transform(h.dot(dense.weights[0]) + dense.weights[1]), yhat)
+    # a tanh output layer is left as it is
+    dense_tanh = Layer([np.copy(w) for w in dense.weights], 'tanh')
+    rescale_weights(coll.namedtuple("Model", "layers")([lstm, dense_tanh]), _affine(inputs_new), _affine(inputs),
+      _affine(outputs_new), _affine(outputs))
+    assert all(np.array_equal(w, w_old) for w, w_old in zip(dense_tanh.weights, dense.weights))
@@ -0,0 +1,231 @@
+"""
+Online forecasts of single wells, advanced one observed sample at a time.
+
+A Forecaster holds the recurrent state, the last window of observations and
+the normalizer of a bundle. Ingesting a sample runs the model once over that
+window, whatever the length of the history, and forecasts roll out from a copy
+of the current state. The network is evaluated in numpy from the keras
+weights, so no keras model (or session) is needed per well. The state of a
+forecaster is a short flat array, the model and normalizer are shared.
+"""
+import numpy as np
+import tinkerbell.app.model as tbamd
+import tinkerbell.app.forecast as tbafc
+
+
+ACTIVATIONS = {
+  'linear': lambda x: x,
+  'tanh': np.tanh,
+  'sigmoid': lambda x: 0.5*(1.0 + np.tanh(0.5*x)),
+  'hard_sigmoid': lambda x: np.clip(0.2*x + 0.5, 0.0, 1.0),
+  'relu': lambda x: np.maximum(x, 0.0)}
+
+
+class Network:
+    def __init__(self, kernel, recurrent_kernel, bias, kernel_output, bias_output, activation='tanh',
+                 recurrent_activation='sigmoid', activation_output='linear'):
+        """
+        LSTM layer followed by a dense output layer, weights as keras stores them
+        (gates i, f, c, o along the last axis of the kernels and bias).
+        """
+        self.kernel = np.asarray(kernel, dtype=float)
+        self.recurrent_kernel = np.asarray(recurrent_kernel, dtype=float)
+        self.bias = np.asarray(bias, dtype=float)
+        self.kernel_output = np.asarray(kernel_output, dtype=float)
+        self.bias_output = np.asarray(bias_output, dtype=float)
+        self.activations = (activation, recurrent_activation, activation_output)
+        for name in self.activations:
+            if name not in ACTIVATIONS:
+                raise ValueError('Unsupported activation \'{0}\'.'.format(name))
+
+    @staticmethod
+    def from_model(model):
+        layer = model.layers[0]
+        if type(layer).__name__ != 'LSTM' or len(model.layers) != 2:
+            raise ValueError('Expected an LSTM layer followed by a dense output layer.')
+        config = layer.get_config()
+        return Network(*(layer.get_weights() + model.layers[-1].get_weights()), activation=config['activation'],
+          recurrent_activation=config['recurrent_activation'], activation_output=tbamd.activation_output(model))
+
+    @property
+    def num_units(self):
+        return len(self.recurrent_kernel)
+
+    def run(self, X, h, c):
+        """
+        Returns the outputs (..., num_timesteps, num_targets) of the inputs X (..., num_timesteps,
+        num_features) starting from the states h and c (..., num_units), and the final states.
+        """
+        activation, recurrent_activation, activation_output = [ACTIVATIONS[name] for name in self.activations]
+        states = []
+        for itimestep in range(X.shape[-2]):
+            z = X[..., itimestep, :].dot(self.kernel) + h.dot(self.recurrent_kernel) + self.bias
+            i, f, g, o = np.split(z, 4, axis=-1)
+            c = recurrent_activation(f)*c + recurrent_activation(i)*activation(g)
+            h = recurrent_activation(o)*activation(c)
+            states += [h]
+        return activation_output(np.stack(states, axis=-2).dot(self.kernel_output) + self.bias_output), h, c
+
+
+class Forecaster:
+    def __init__(self, bundle, network=None):
+        """
+        Forecaster of a well from the bundle, network defaults to that of the bundle's model.
+        """
+        if bundle.kind not in tbafc.FORECASTERS:
+            raise ValueError('Unknown model kind \'{}\'.'.format(bundle.kind))
+        self.kind = bundle.kind
+        self.normalizer = bundle.normalizer
+        self.network = network if network is not None else Network.from_model(bundle.model)
+        self.offset_forecast = 1 if self.kind == 'lstm' else bundle.params.get('offset_forecast', 1)
+        self.num_window = tbafc.num_init(bundle)
+        self.reset()
+
+    def reset(self):
+        self.num_samples = 0
+        self.forecast_next = np.nan
+        self.h = np.zeros(self.network.num_units)
+        self.c = np.zeros(self.network.num_units)
+        self.time, self.production, self.stage = [np.full(self.num_window, np.nan) for _ in range(3)]
+
+    @property
+    def ready(self):
+        """
+        Whether enough samples were ingested to forecast.
+        """
+        return self.num_samples >= self.num_window
+
+    def _features(self, time, production, stage, time_next, stage_next):
+        stage_window = np.r_[stage[1:], stage_next]
+        if self.kind == 'lstm':
+            return self.normalizer.features.transform([[production[-1], stage_next - stage[-1]]])
+        if self.kind == 'lstmseqwin':
+            return np.c_[self.normalizer.production.transform(production.reshape(-1, 1)),
+              self.normalizer.stage.transform(stage_window.reshape(-1, 1))]
+        dp_dt = np.diff(production) / np.diff(time)
+        return np.c_[self.normalizer.dp_dt_src.transform(dp_dt.reshape(-1, 1)),
+          self.normalizer.stage_delta.transform(np.diff(stage_window).reshape(-1, 1))]
+
+    def _step(self, h, c, time, production, stage, time_next, stage_next):
+        """
+        Returns the production predicted at time_next from the window and the states after the step.
+        """
+        y, h, c = self.network.run(self._features(time, production, stage, time_next, stage_next), h, c)
+        y = y[-self.offset_forecast]
+        if self.kind == 'lstmseqwin':
+            return self.normalizer.production.inverse_transform([y])[0, 0], h, c
+        targets = self.normalizer.dp_dt_trg if self.kind == 'lstmseqwingrad' else self.normalizer.targets
+        return production[-1] + (time_next - time[-1])*targets.inverse_transform([y])[0, 0], h, c
+
+    def ingest(self, time, production, stage):
+        """
+        Advances the state by one observed sample, the prediction of the sample is kept as forecast_next.
+        """
+        if self.ready:
+            self.forecast_next, self.h, self.c = self._step(self.h, self.c, self.time, self.production, self.stage,
+              time, stage)
+        for window, value in ((self.time, time), (self.production, production), (self.stage, stage)):
+            window[:-1] = window[1:]
+            window[-1] = value
+        self.num_samples += 1
+
+    def forecast(self, time, stage=None):
+        """
+        Returns the production forecast at the future sample times time, stage defaults to holding the last one.
+        """
+        if not self.ready:
+            raise ValueError('Forecast needs {0:d} ingested samples, got {1:d}.'.format(self.num_window,
+              self.num_samples))
+        stage = np.full(len(time), self.stage[-1]) if stage is None else stage
+        h, c = self.h, self.c
+        window = [np.copy(a) for a in (self.time, self.production, self.stage)]
+        yhat = np.empty(len(time))
+        for i, (time_next, stage_next) in enumerate(zip(time, stage)):
+            yhat[i], h, c = self._step(h, c, *window, time_next, stage_next)
+            window = [np.r_[a[1:], value] for a, value in zip(window, (time_next, yhat[i], stage_next))]
+        return yhat
+
+    def to_flat(self):
+        """
+        Returns the state of the forecaster (not its bundle) as flat array.
+        """
+        return np.r_[[self.num_samples, self.forecast_next], self.h, self.c, self.time, self.production, self.stage]
+
+    def from_flat(self, flatdata):
+        """
+        Restores the state from its flat representation and returns self.
+        """
+        num_units, num_window = self.network.num_units, self.num_window
+        self.num_samples, self.forecast_next = int(flatdata[0]), flatdata[1]
+        self.h, self.c = np.array(flatdata[2:2+num_units]), np.array(flatdata[2+num_units:2+2*num_units])
+        self.time, self.production, self.stage = np.reshape(np.array(flatdata[2+2*num_units:]), (3, num_window))
+        return self
+
+    def flat_header(self):
+        return (('num_samples', 'forecast_next') + tuple('h_{0:d}'.format(i) for i in range(self.network.num_units))
+          + tuple('c_{0:d}'.format(i) for i in range(self.network.num_units))
+          + tuple('{0}_{1:d}'.format(name, i) for name in ('time', 'production', 'stage')
+          for i in range(self.num_window)))
+
+
+def rollout(forecaster, time, production, stage):
+    """
+    Returns the forecast of a well as forecast.FORECASTERS does, from the first num_init samples
+    observed on, computed by forecaster (which is reset).
+    """
+    num_window = forecaster.num_window
+    if forecaster.kind == 'lstmseqwingrad':
+        num_forecast = len(time) - (num_window - 1) - forecaster.offset_forecast
+    else:
+        num_forecast = len(stage) - 1
+    forecaster.reset()
+    for sample in zip(time[:num_window], production[:num_window], stage[:num_window]):
+        forecaster.ingest(*sample)
+    return np.r_[production[:num_window], forecaster.forecast(time[num_window:num_forecast],
+      stage[num_window:num_forecast])]
+
+
+def save_states(forecasters, fname):
+    """
+    Saves the states of forecasters of the same bundle as one (num_forecasters, state) matrix.
+    """
+    with open(fname, 'wb') as f:
+        np.save(f, np.array([forecaster.to_flat() for forecaster in forecasters]).reshape(len(forecasters), -1))
+
+
+def load_states(fname, bundle, network=None):
+    """
+    Returns the forecasters saved by save_states, they share the network of the bundle.
+    """
+    network = network if network is not None else Network.from_model(bundle.model)
+    return [Forecaster(bundle, network).from_flat(flatdata) for flatdata in np.load(fname)]
+
+
+def test_forecaster():
+    import os
+    import tempfile
+    import tinkerbell.app.scaler as tbasc
+    np.random.seed(42)
+    num_units, num_timesteps = 4, 3
+    network = Network(np.random.normal(0, 0.5, (2, 4*num_units)), np.random.normal(0, 0.5, (num_units, 4*num_units)),
+      np.zeros(4*num_units), np.random.normal(0, 0.5, (num_units, 1)), np.zeros(1))
+    time = np.cumsum(np.random.uniform(0.5, 1.5, 20))
+    production, stage = np.linspace(10.0, 1.0, 20), (time > time[10]).astype(float)
+    scalers = [tbasc.Scaler((-1, 1)).fit(X.reshape(-1, 1)) for X in (np.diff(production), np.diff(stage))]
+    normalizer = tbamd.NormalizerGrad(scalers[0], scalers[0], scalers[1])
+    bundle = tbamd.Bundle('lstmseqwingrad', None, normalizer, {'num_timesteps': num_timesteps})
+    forecaster = Forecaster(bundle, network)
+    for sample in zip(time[:4], production[:4], stage[:4]):
+        forecaster.ingest(*sample)
+    yhat = forecaster.forecast(time[4:], stage[4:])
+    # ingesting the forecast continues the same rollout
+    forecaster.ingest(time[4], yhat[0], stage[4])
+    assert np.isclose(forecaster.forecast_next, yhat[0])
+    assert np.allclose(forecaster.forecast(time[5:], stage[5:]), yhat[1:])
+    with tempfile.TemporaryDirectory() as dirname:
+        fname = os.path.join(dirname, 'states.npy')
+        save_states([forecaster, Forecaster(bundle, network)], fname)
+        restored = load_states(fname, bundle, network)
+        assert len(restored) == 2 and not restored[1].ready
+        assert len(forecaster.to_flat()) == len(forecaster.flat_header())
+        assert np.allclose(restored[0].forecast(time[5:], stage[5:]), yhat[1:])
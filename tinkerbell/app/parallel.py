@@ -0,0 +1,28 @@
+import os
+import multiprocessing as mp
+
+
+def limit_threads(num_intra_op=1, num_inter_op=1):
+    """
+    Caps the threads TensorFlow (and the BLAS below numpy) use in this process,
+    must run before the first model is built or loaded.
+    """
+    os.environ['OMP_NUM_THREADS'] = str(num_intra_op)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(num_intra_op)
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(num_inter_op)
+    import tensorflow as tf
+    if hasattr(tf, 'ConfigProto'):
+        import keras.backend as K
+        config = tf.ConfigProto(intra_op_parallelism_threads=num_intra_op,
+          inter_op_parallelism_threads=num_inter_op)
+        K.set_session(tf.Session(config=config))
+    else:
+        tf.config.threading.set_intra_op_parallelism_threads(num_intra_op)
+        tf.config.threading.set_inter_op_parallelism_threads(num_inter_op)
+
+
+def pool(num_workers=None, initializer=None, initargs=(), maxtasksperchild=None):
+    """
+    Returns a process pool whose workers are spawned, TensorFlow is not fork safe.
+    """
+    return mp.get_context('spawn').Pool(num_workers, initializer, initargs, maxtasksperchild)
@@ -0,0 +1,177 @@
+"""
+Cached generate -> fit -> train -> predict pipelines.
+
+Every step is keyed by its function, its parameters and the keys of the
+steps it consumes, so a step is recomputed only if something upstream of it
+changed; unchanged steps are read from the cache, and their own upstream
+steps are not even loaded.
+"""
+import os
+import hashlib
+import pickle
+import numpy as np
+import logging as log
+import tinkerbell.persistance.cache as tbpch
+import tinkerbell.app.rcparams as tbarc
+import tinkerbell.app.make as tbamk
+import tinkerbell.domain.make as tbdmk
+import tinkerbell.domain.point as tbdpt
+from tinkerbell.lazy import lazy_import
+
+tbamd = lazy_import('tinkerbell.app.model')
+
+
+def _save_pickle(value, dirname):
+    with open(os.path.join(dirname, 'object.pkl'), 'wb') as f:
+        pickle.dump(value, f)
+
+
+def _load_pickle(dirname):
+    with open(os.path.join(dirname, 'object.pkl'), 'rb') as f:
+        return pickle.load(f)
+
+
+def _save_model(value, dirname):
+    tbamd.save(value, os.path.join(dirname, 'model.h5'))
+
+
+def _load_model(dirname):
+    return tbamd.load(os.path.join(dirname, 'model.h5'))
+
+
+def _save_bundle(value, dirname):
+    tbamd.save_bundle(value, os.path.join(dirname, 'bundle'))
+
+
+def _load_bundle(dirname):
+    return tbamd.load_bundle(os.path.join(dirname, 'bundle'))
+
+
+SERIALIZERS = {'pickle': (_save_pickle, _load_pickle), 'model': (_save_model, _load_model),
+  'bundle': (_save_bundle, _load_bundle)}
+
+
+class Step:
+    def __init__(self, pipeline, name, key, compute, serializer):
+        self.pipeline = pipeline
+        self.name = name
+        self.key = key
+        self._compute = compute
+        self._serializer = serializer
+        self._value = None
+        self._has_value = False
+
+    @property
+    def value(self):
+        """
+        The result of the step, read from the cache or computed and stored.
+        """
+        if not self._has_value:
+            save, load = SERIALIZERS[self._serializer]
+            cache = self.pipeline.cache
+            dirname = cache.get(self.key)
+            if dirname is not None:
+                log.info('Step \'{0}\' {1} cached.'.format(self.name, self.key[:8]))
+                self._value = load(dirname)
+            else:
+                log.info('Step \'{0}\' {1} computing.'.format(self.name, self.key[:8]))
+                self._value = self._compute()
+                cache.put(self.key, lambda dirname: save(self._value, dirname))
+                self.pipeline.num_computed += 1
+            self._has_value = True
+        return self._value
+
+
+class Pipeline:
+    def __init__(self, dirname=None, max_bytes=None):
+        """
+        Defaults to the cache directory and size of the rcparams.
+        """
+        dirname = dirname or tbarc.rcparams['cache.dirname']
+        max_bytes = tbarc.rcparams['cache.max_bytes'] if max_bytes is None else max_bytes
+        self.cache = tbpch.Cache(dirname, max_bytes)
+        self.num_computed = 0
+
+    def step(self, fct, *upstream, serializer='pickle', name=None, **params):
+        """
+        Returns the step computing fct(*upstream values, **params), upstream being steps.
+        """
+        name = name or '{0}.{1}'.format(fct.__module__, fct.__qualname__)
+        key = tbpch.key(name, params, [u.key for u in upstream])
+        return Step(self, name, key, lambda: fct(*[u.value for u in upstream], **params), serializer)
+
+    def source(self, value, name='source'):
+        """
+        Returns a step holding value, keyed by its content.
+        """
+        step = Step(self, name, tbpch.key(name, value), None, 'pickle')
+        step._value, step._has_value = value, True
+        return step
+
+    def file(self, fname):
+        """
+        Returns a step holding the file name fname, keyed by the file content.
+        """
+        sha = hashlib.sha1()
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        step = Step(self, fname, tbpch.key('file', sha.hexdigest()), None, 'pickle')
+        step._value, step._has_value = fname, True
+        return step
+
+
+def generate_time_stage(y0, d, xmax, xdisc, num_points, seed=42):
+    """
+    Returns time, production and stage of a synthetic two stage well.
+    """
+    np.random.seed(seed)
+    pts, ixdisc = tbamk.points_exponential_discontinuous_declinelinear_noisy(y0, d, xmax, xdisc, num=num_points)
+    time, production = tbdpt.point_coordinates(pts)
+    stage = np.zeros_like(time)
+    stage[ixdisc:] = 1.0
+    return time, production, stage
+
+
+def fit_spline(data, k, t):
+    time, production, _ = data
+    return tbdmk.curve_lsq_fixed_knots(tbdpt.from_coordinates(time, production), t, k).to_flat()
+
+
+def fit_normalizer(data):
+    time, production, stage = data
+    return tbamd.Normalizer.fit(tbamd.Features(production, stage), tbamd.Targets(production, time))
+
+
+def train_lstm(data, normalizer, num_epochs, num_neurons, **kwargs):
+    time, production, stage = data
+    features = normalizer.normalize_features(tbamd.Features(production, stage))
+    targets = normalizer.normalize_targets(tbamd.Targets(production, time))
+    return tbamd.lstm(features, targets, 1, num_epochs, num_neurons, **kwargs)
+
+
+def predict_lstm(data, normalizer, model):
+    time, production, stage = data
+    return tbamd.predict(production[0], stage, normalizer, model, time)
+
+
+def test_pipeline():
+    import tempfile
+    calls = []
+
+    def double(x, factor):
+        calls.append('double')
+        return x*factor
+
+    def total(x, offset):
+        calls.append('total')
+        return np.sum(x) + offset
+
+    with tempfile.TemporaryDirectory() as dirname:
+        for offset in (0.0, 0.0, 1.0):
+            pipeline = Pipeline(dirname, 1 << 20)
+            source = pipeline.source(np.arange(4.0))
+            doubled = pipeline.step(double, source, factor=2.0)
+            totalled = pipeline.step(total, doubled, offset=offset)
+            assert totalled.value == 12.0 + offset
+    assert calls == ['double', 'total', 'total']
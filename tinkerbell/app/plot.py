@@ -1,8 +1,21 @@
 import numpy as np
-from matplotlib import pyplot as plt
 import logging as log
+import tinkerbell.app.parallel as tbapa
+
+_plt = None
+
+
+def pyplot():
+    """
+    Returns matplotlib.pyplot, imported and styled on first use.
+    """
+    global _plt
+    if _plt is None:
+        from matplotlib import pyplot as plt
+        plt.style.use('ggplot')
+        _plt = plt
+    return _plt
 
-plt.style.use('ggplot')
 
 STYLEFALLBACK = {'linestyle': 'solid', 'linewidth': 2, 'alpha': 0.7}
 TOMPLSTYLE = {'p': {'marker': 'x', 'linestyle': 'None'}, 'l': STYLEFALLBACK,
@@ -13,6 +26,87 @@ TOMPLSTYLE = {'p': {'marker': 'x', 'linestyle': 'None'}, 'l': STYLEFALLBACK,
   'iy': {'marker': '>', 'linestyle': 'None', 'color': 'k', 'markerfacecolor': 'None'},
   'ix': {'marker': '^', 'linestyle': 'None', 'color': 'k', 'markerfacecolor': 'None'}}
 
+# series longer than max_points are downsampled before plotting, None disables
+DOWNSAMPLEFALLBACK = {'method': 'lttb', 'max_points': 4000, 'jump_factor': 10.0}
+TODOWNSAMPLE = {'p': {'method': 'minmax', 'max_points': 4000, 'jump_factor': 10.0},
+  'lstage': {'method': 'minmax', 'max_points': 1000, 'jump_factor': 0.0}}
+
+
+def breaks(y, jump_factor, num_max=None, size_block=256):
+    """
+    Returns the indices i where y jumps from y[i-1] by more than jump_factor times the
+    median absolute step within blocks of size_block steps, for piecewise constant
+    series every change. At most the num_max largest jumps are returned.
+    """
+    step = np.abs(np.diff(y))
+    num_blocks = max(1, int(np.ceil(len(step) / size_block)))
+    steps_blocked = np.pad(step, (0, num_blocks*size_block - len(step)), mode='edge').reshape(num_blocks, -1)
+    scale = np.repeat(np.median(steps_blocked, axis=1), size_block)[:len(step)]
+    ibreaks = np.flatnonzero(step > jump_factor*scale)
+    if num_max is not None and len(ibreaks) > num_max:
+        ibreaks = np.sort(ibreaks[np.argsort(step[ibreaks])[-num_max:]])
+    return ibreaks + 1
+
+
+def _indices_minmax(y, num_points):
+    if num_points >= len(y):
+        return np.arange(len(y))
+    if num_points < 4:
+        return np.unique([0, len(y)-1])
+    num_buckets = (num_points - 2) // 2 # both endpoints are kept besides the extrema
+    size = int(np.ceil(len(y) / num_buckets))
+    ypadded = np.pad(y, (0, num_buckets*size - len(y)), mode='edge').reshape(num_buckets, size)
+    offsets = np.arange(num_buckets)*size
+    idx = np.r_[0, offsets + np.argmin(ypadded, axis=1), offsets + np.argmax(ypadded, axis=1), len(y)-1]
+    return np.unique(np.minimum(idx, len(y)-1))
+
+
+def _indices_lttb(x, y, num_points):
+    num = len(x)
+    if num_points >= num:
+        return np.arange(num)
+    if num_points < 3:
+        return np.unique([0, num-1])
+    edges = np.linspace(1, num-1, num_points-1).astype(int)
+    edges_next = np.r_[edges[1:], num]
+    # bucket averages, the last bucket is followed by the last point
+    counts = np.diff(np.r_[edges, num])
+    xmean = np.add.reduceat(x, edges) / counts
+    ymean = np.add.reduceat(y, edges) / counts
+    idx = np.empty(num_points, dtype=int)
+    idx[0], idx[-1] = 0, num-1
+    a = 0
+    for i in range(num_points-2):
+        lo, hi = edges[i], edges_next[i]
+        area = np.abs((x[a]-xmean[i+1])*(y[lo:hi]-y[a]) - (x[a]-x[lo:hi])*(ymean[i+1]-y[a]))
+        a = lo + np.argmax(area)
+        idx[i+1] = a
+    return idx
+
+
+def downsample(x, y, max_points, method='lttb', jump_factor=10.0):
+    """
+    Returns x and y reduced to about max_points samples, shape preserving by
+    Largest-Triangle-Three-Buckets ('lttb') or per bucket extrema ('minmax').
+    The samples on both sides of every jump (see breaks()) are kept exactly.
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    num = len(y)
+    if max_points is None or num <= max_points:
+        return x, y
+    ibreaks = breaks(y, jump_factor, max_points // 8)
+    bounds = np.r_[0, ibreaks, num]
+    num_points_free = max_points - 2*(len(bounds)-1)
+    idx = []
+    for ilo, ihi in zip(bounds[:-1], bounds[1:]):
+        num_points = 2 + int(num_points_free*(ihi-ilo)/num)
+        if method == 'minmax':
+            idx += [ilo + _indices_minmax(y[ilo:ihi], num_points)]
+        else:
+            idx += [ilo + _indices_lttb(x[ilo:ihi], y[ilo:ihi], num_points)]
+    idx = np.concatenate(idx)
+    return x[idx], y[idx]
+
 
 def render(ax, xyarraytuplesiterable, styles=[], labels=[], lim=((None, None), (None, None))):
     if not styles:
@@ -29,6 +123,7 @@ def render(ax, xyarraytuplesiterable, styles=[], labels=[], lim=((None, None), (
                 series = str(i)
             log.warn('Plot style \'{0}\' for series \'{1}\' not recognized, using fallback.'.format(style, label))
             plotargs = STYLEFALLBACK       
+        x, y = downsample(x, y, **TODOWNSAMPLE.get(style, DOWNSAMPLEFALLBACK))
         h = ax.plot(x, y, **plotargs, label=label)
         handlesret += h
         labelsret += [label]
@@ -37,10 +132,12 @@ def render(ax, xyarraytuplesiterable, styles=[], labels=[], lim=((None, None), (
     return handlesret, labelsret
 
 
-def plot(xyarraytuplesiterable, styles=[], labels=[], show=True, lim=((None, None), (None, None)), 
-         save_as='', secxyarraytuplesiterable=[], seclabels=[], secstyles=[], hide_labels=False,
+def draw(fig, xyarraytuplesiterable, styles=[], labels=[], lim=((None, None), (None, None)),
+         secxyarraytuplesiterable=[], seclabels=[], secstyles=[], hide_labels=False,
          xlabel='', ylabel='', secylabel='', secylim=(None, None)):
-    fig = plt.figure() 
+    """
+    Draws into the (empty) figure fig, see plot() for the arguments.
+    """
     ax = fig.add_subplot(111)
     handelsleg, labelsleg = [], []
     hret, lret = render(ax, xyarraytuplesiterable, styles, labels, lim=lim)
@@ -73,7 +170,79 @@ def plot(xyarraytuplesiterable, styles=[], labels=[], show=True, lim=((None, Non
             axsec.set_ylabel(secylabel)
     if labels:
         fig.legend(handelsleg, labelsleg)
+
+
+def plot(xyarraytuplesiterable, styles=[], labels=[], show=True, lim=((None, None), (None, None)), 
+         save_as='', secxyarraytuplesiterable=[], seclabels=[], secstyles=[], hide_labels=False,
+         xlabel='', ylabel='', secylabel='', secylim=(None, None)):
+    plt = pyplot()
+    fig = plt.figure() 
+    draw(fig, xyarraytuplesiterable, styles, labels, lim, secxyarraytuplesiterable, seclabels, secstyles,
+      hide_labels, xlabel, ylabel, secylabel, secylim)
     if save_as:
         plt.savefig(save_as, dpi=300)
     if show:
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+
+_figure = None
+_dpi = None
+
+
+def _init_renderer(figsize, dpi):
+    global _figure, _dpi
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.style
+    import matplotlib.figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    matplotlib.style.use('ggplot')
+    _figure = matplotlib.figure.Figure(figsize=figsize)
+    FigureCanvasAgg(_figure)
+    _dpi = dpi
+
+
+def _render_spec(spec):
+    spec = dict(spec)
+    save_as = spec.pop('save_as')
+    _figure.clear()
+    try:
+        draw(_figure, **spec)
+        _figure.savefig(save_as, dpi=_dpi)
+    except Exception as e:
+        log.error('Rendering \'{0}\' failed: {1}'.format(save_as, e))
+        return None
+    return save_as
+
+
+def render_batch(specs, num_workers=None, figsize=(6.4, 4.8), dpi=100, maxtasksperchild=200, chunksize=8):
+    """
+    Renders plot specifications headless to files in a pool of workers and returns
+    the file names written, None for failed ones. A specification is a dictionary
+    of the arguments of draw() plus 'save_as'. Every worker reuses a single Agg
+    figure and is replaced after maxtasksperchild specifications, so memory per
+    worker stays bounded.
+    """
+    with tbapa.pool(num_workers, _init_renderer, (figsize, dpi), maxtasksperchild) as workers:
+        return list(workers.imap(_render_spec, specs, chunksize))
+
+
+def test_downsample():
+    np.random.seed(42)
+    num = 100000
+    x = np.linspace(0.0, 100.0, num)
+    stage = np.zeros(num)
+    stage[37123:] = 1.0
+    noise = np.random.normal(size=num)
+    for num_points in (2, 3, 4, 5, 101, 1000):
+        assert len(_indices_minmax(noise, num_points)) <= num_points
+    xd, yd = downsample(x, stage, 1000, 'minmax', 0.0)
+    assert len(xd) <= 1000
+    assert xd[0] == x[0] and xd[-1] == x[-1]
+    assert x[37122] in xd and x[37123] in xd
+    production = 50.0*np.exp(-0.05*x)*np.random.normal(1.0, 0.01, num)
+    production[60000:] += 20.0
+    xd, yd = downsample(x, production, 2000, 'lttb', 10.0)
+    assert len(xd) <= 2000
+    assert np.all(np.diff(xd) > 0.0)
+    assert x[59999] in xd and x[60000] in xd
@@ -0,0 +1,119 @@
+"""
+Prefix training batches for whole sequence models, generated lazily.
+
+Every profile is stored once. A training item is a (profile, prefix length)
+pair whose view holds the production up to the prefix and the sentinel beyond,
+built only when its batch is requested. Memory is proportional to the raw
+profiles instead of num_timesteps - 1 replicated copies, while the batches
+(and the fitted scalers) are the same as those of the replicated tensors.
+"""
+import numpy as np
+import tinkerbell.app.scaler as tbasc
+
+
+class PrefixBatches:
+    def __init__(self, production, stage, sentinel, batch_size=5, items=None, weight_sentinel=False,
+                 normalizer_features=None, normalizer_targets=None):
+        """
+        production and stage (num_profiles, num_timesteps). Item i is the prefix of length
+        i % (num_timesteps-1) + 1 of profile i // (num_timesteps-1), items selects a subset.
+        With weight_sentinel the batches carry temporal sample weights that ignore the
+        sentinel target of the first timestep (needs sample_weight_mode='temporal').
+        """
+        self.production = np.asarray(production, dtype=float)
+        self.stage = np.asarray(stage, dtype=float)
+        self.sentinel = sentinel
+        self.batch_size = batch_size
+        self.weight_sentinel = weight_sentinel
+        num_profiles, num_timesteps = self.production.shape
+        self.num_prefixes = num_timesteps - 1
+        self.items = np.arange(num_profiles*self.num_prefixes) if items is None else np.asarray(items)
+        if normalizer_features is None:
+            # min/max of the replicated tensors: the sentinel, the production but its last
+            # sample as features and the production but its first sample as targets
+            normalizer_features = tbasc.Scaler(feature_range=(0, 1))
+            normalizer_features.partial_fit(np.c_[self.production[:, :-1].ravel(), self.stage[:, :-1].ravel()])
+            normalizer_features.partial_fit(np.c_[np.full(num_profiles, sentinel), self.stage[:, -1]])
+            normalizer_targets = tbasc.Scaler(feature_range=(0, 1))
+            normalizer_targets.partial_fit(self.production[:, 1:].reshape(-1, 1))
+            normalizer_targets.partial_fit([[sentinel]])
+        self.normalizer_features = normalizer_features
+        self.normalizer_targets = normalizer_targets
+
+    def __len__(self):
+        return -(-len(self.items) // self.batch_size)
+
+    def __getitem__(self, items):
+        """
+        Returns the normalized features (len(items), num_timesteps, 2), targets
+        (len(items), num_timesteps, 1) and, with weight_sentinel, the sample weights of items.
+        """
+        items = np.asarray(items)
+        profile, num_prefix = items // self.num_prefixes, items % self.num_prefixes + 1
+        num_timesteps = self.production.shape[1]
+        features = np.empty((len(items), num_timesteps, 2))
+        features[:, :, 0] = np.where(np.arange(num_timesteps) < num_prefix[:, np.newaxis],
+          self.production[profile], self.sentinel)
+        features[:, :, 1] = self.stage[profile]
+        targets = self.production[profile].copy()
+        targets[:, 0] = self.sentinel
+        features = self.normalizer_features.transform(features.reshape(-1, 2)).reshape(features.shape)
+        targets = self.normalizer_targets.transform(targets.reshape(-1, 1)).reshape(len(items), num_timesteps, 1)
+        if not self.weight_sentinel:
+            return features, targets
+        weights = np.ones((len(items), num_timesteps))
+        weights[:, 0] = 0.0
+        return features, targets, weights
+
+    def split(self, fraction_validation):
+        """
+        Returns the training and validation batches, the validation items are the
+        last fraction_validation as with keras' validation_split.
+        """
+        num_train = int(len(self.items)*(1.0 - fraction_validation))
+        return tuple(PrefixBatches(self.production, self.stage, self.sentinel, self.batch_size, items,
+          self.weight_sentinel, self.normalizer_features, self.normalizer_targets)
+          for items in (self.items[:num_train], self.items[num_train:]))
+
+    def generator(self, shuffle=True):
+        """
+        Yields the batches for ever, reshuffling the items every epoch of len(self) steps.
+        """
+        while True:
+            items = np.random.permutation(self.items) if shuffle else self.items
+            for start in range(0, len(items), self.batch_size):
+                yield self[items[start:start+self.batch_size]]
+
+    def tensors(self):
+        """
+        Returns all batches concatenated, i.e. the replicated tensors.
+        """
+        return self[self.items]
+
+
+def test_prefix_batches():
+    import sklearn.preprocessing as skprep
+    np.random.seed(42)
+    num_profiles, num_timesteps, sentinel = 3, 6, -50.0
+    production = np.random.uniform(1.0, 50.0, (num_profiles, num_timesteps))
+    stage = (np.arange(num_timesteps) > 2) * np.ones((num_profiles, 1))
+    # replicated tensors as in post.py
+    features = np.full((num_profiles*(num_timesteps-1), num_timesteps, 2), sentinel)
+    targets = np.full((num_profiles*(num_timesteps-1), num_timesteps, 1), sentinel)
+    isample = 0
+    for q, s in zip(production, stage):
+        for num_sample_points in range(1, num_timesteps):
+            features[isample, :, 1] = s
+            features[isample, :num_sample_points, 0] = q[:num_sample_points]
+            targets[isample, 1:, 0] = q[1:]
+            isample += 1
+    features = skprep.MinMaxScaler().fit_transform(features.reshape(-1, 2)).reshape(features.shape)
+    targets = skprep.MinMaxScaler().fit_transform(targets.reshape(-1, 1)).reshape(targets.shape)
+    batches = PrefixBatches(production, stage, sentinel, batch_size=4)
+    assert len(batches) == 4
+    X, y = batches.tensors()
+    assert np.allclose(X, features) and np.allclose(y, targets)
+    train, validation = batches.split(0.2)
+    assert len(train.items) == 12 and np.allclose(validation.tensors()[0], features[12:])
+    batch = next(batches.generator(shuffle=False))
+    assert np.allclose(batch[0], features[:4])
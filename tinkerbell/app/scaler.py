@@ -0,0 +1,139 @@
+"""
+Min/max scaling fitted incrementally, a drop in for sklearn's MinMaxScaler
+(fit, partial_fit, transform, inverse_transform, fit_transform) that also keeps
+running means and variances, merges statistics fitted in parallel and
+serializes to a flat array.
+"""
+import numpy as np
+
+
+class Scaler:
+    def __init__(self, feature_range=(0, 1)):
+        self.feature_range = tuple(float(bound) for bound in feature_range)
+        self.count = None
+
+    def _reset(self, num_features):
+        self.count = np.zeros(num_features)
+        self.data_min_ = np.full(num_features, np.nan)
+        self.data_max_ = np.full(num_features, np.nan)
+        self.mean_ = np.zeros(num_features)
+        self.m2 = np.zeros(num_features)
+
+    def partial_fit(self, X):
+        """
+        Updates the statistics with the rows of X (num_samples, num_features), nan is ignored.
+        """
+        X = np.asarray(X, dtype=float)
+        if self.count is None:
+            self._reset(X.shape[1])
+        chunk = Scaler(self.feature_range)
+        chunk._reset(X.shape[1])
+        valid = ~np.isnan(X)
+        chunk.count = valid.sum(axis=0).astype(float)
+        chunk.data_min_ = np.fmin.reduce(X, axis=0)
+        chunk.data_max_ = np.fmax.reduce(X, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chunk.mean_ = np.where(chunk.count > 0, np.nansum(X, axis=0) / chunk.count, 0.0)
+        chunk.m2 = np.nansum(np.where(valid, X - chunk.mean_, 0.0)**2, axis=0)
+        return self.merge(chunk)
+
+    def fit(self, X):
+        self.count = None
+        return self.partial_fit(X)
+
+    def merge(self, other):
+        """
+        Combines the statistics of other, fitted on different samples, into these.
+        """
+        if other.count is None:
+            return self
+        if self.count is None:
+            self._reset(len(other.count))
+        count = self.count + other.count
+        delta = other.mean_ - self.mean_
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(count > 0, other.count / count, 0.0)
+        self.mean_ = self.mean_ + delta*weight
+        self.m2 = self.m2 + other.m2 + delta**2 * self.count*weight
+        self.data_min_ = np.fmin(self.data_min_, other.data_min_)
+        self.data_max_ = np.fmax(self.data_max_, other.data_max_)
+        self.count = count
+        return self
+
+    @property
+    def n_samples_seen_(self):
+        return self.count
+
+    @property
+    def var_(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.m2 / self.count
+
+    @property
+    def scale_(self):
+        data_range = self.data_max_ - self.data_min_
+        data_range = np.where(data_range == 0.0, 1.0, data_range)
+        return (self.feature_range[1] - self.feature_range[0]) / data_range
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=float) - self.data_min_)*self.scale_ + self.feature_range[0]
+
+    def inverse_transform(self, X):
+        return (np.asarray(X, dtype=float) - self.feature_range[0])/self.scale_ + self.data_min_
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+    def copy(self):
+        return Scaler.from_flat(self.to_flat())[0]
+
+    @staticmethod
+    def from_minmax(scaler):
+        """
+        Returns a Scaler with the range of a fitted sklearn MinMaxScaler, its means and
+        variances are unknown (zero).
+        """
+        converted = Scaler(scaler.feature_range)
+        converted._reset(len(scaler.data_min_))
+        converted.count[:] = scaler.n_samples_seen_
+        converted.data_min_, converted.data_max_ = np.array(scaler.data_min_), np.array(scaler.data_max_)
+        return converted
+
+    def to_flat(self):
+        """
+        Returns the scaler state as a flat array, see from_flat.
+        """
+        return np.r_[[len(self.count)], self.feature_range, self.count, self.data_min_, self.data_max_,
+          self.mean_, self.m2]
+
+    @staticmethod
+    def from_flat(flatdata):
+        """
+        Returns the scaler at the start of flatdata and the number of values it used.
+        """
+        num_features = int(flatdata[0])
+        scaler = Scaler(flatdata[1:3])
+        scaler._reset(num_features)
+        columns = np.reshape(flatdata[3:3+5*num_features], (5, num_features))
+        scaler.count, scaler.data_min_, scaler.data_max_, scaler.mean_, scaler.m2 = [np.array(c) for c in columns]
+        return scaler, 3 + 5*num_features
+
+
+def test_scaler():
+    import sklearn.preprocessing as skprep
+    np.random.seed(42)
+    X = np.random.normal(3.0, 2.0, (1000, 3))
+    reference = skprep.MinMaxScaler(feature_range=(-1, 1)).fit(X)
+    chunks = [Scaler((-1, 1)).fit(chunk) for chunk in np.array_split(X, 7)]
+    scaler = Scaler((-1, 1))
+    for chunk in chunks:
+        scaler.merge(chunk)
+    assert np.allclose(scaler.transform(X), reference.transform(X))
+    assert np.allclose(scaler.inverse_transform(scaler.transform(X)), X)
+    assert np.allclose(scaler.mean_, X.mean(axis=0)) and np.allclose(scaler.var_, X.var(axis=0))
+    streamed = Scaler((-1, 1))
+    for chunk in np.array_split(X, 5):
+        streamed.partial_fit(chunk)
+    restored, num_values = Scaler.from_flat(np.r_[streamed.to_flat(), 42.0])
+    assert num_values == 3 + 5*3 and np.allclose(restored.transform(X), reference.transform(X))
+    assert np.allclose(restored.var_, X.var(axis=0))
@@ -0,0 +1,94 @@
+"""
+Bundle weights published once into shared memory for the forecast workers.
+
+The parent process copies the LSTM and output layer weights of a bundle (and,
+optionally, its normalizer as normalizer_to_flat array) into one
+multiprocessing.shared_memory block and hands the workers a small picklable
+SharedBundle. Workers map the block read only and forecast in numpy
+(online.Network) straight from it, so they load neither the .h5 nor
+TensorFlow and adding workers does not add copies of the weights.
+"""
+import contextlib
+import collections as coll
+import multiprocessing.shared_memory as mpsm
+import numpy as np
+import tinkerbell.app.model as tbamd
+import tinkerbell.app.online as tbaon
+
+
+WEIGHTS = ('kernel', 'recurrent_kernel', 'bias', 'kernel_output', 'bias_output')
+
+SharedBundle = coll.namedtuple("SharedBundle", "name kind params layout activations normalizer")
+
+
+def publish(bundle, share_normalizer=True, network=None):
+    """
+    Returns the shared memory block holding the weights of the bundle (or of network if given)
+    and the SharedBundle describing it. The caller owns the block, see published().
+    """
+    network = network if network is not None else tbaon.Network.from_model(bundle.model)
+    arrays = [(name, getattr(network, name)) for name in WEIGHTS]
+    if share_normalizer:
+        arrays += [('normalizer', tbamd.normalizer_to_flat(bundle.normalizer))]
+    layout, offset = [], 0
+    for name, array in arrays:
+        layout += [(name, offset, array.shape)]
+        offset += array.size
+    block = mpsm.SharedMemory(create=True, size=max(offset, 1)*np.dtype(float).itemsize)
+    flat = np.ndarray(offset, dtype=float, buffer=block.buf)
+    for (name, array), (_, start, _) in zip(arrays, layout):
+        flat[start:start+array.size] = array.ravel()
+    del flat
+    return block, SharedBundle(block.name, bundle.kind, bundle.params, tuple(layout), network.activations,
+      None if share_normalizer else bundle.normalizer)
+
+
+@contextlib.contextmanager
+def published(bundle, share_normalizer=True, network=None):
+    """
+    Yields the SharedBundle of the bundle, its block is freed on exit.
+    """
+    block, shared = publish(bundle, share_normalizer, network)
+    try:
+        yield shared
+    finally:
+        block.close()
+        block.unlink()
+
+
+def attach(shared):
+    """
+    Returns the forecaster of a SharedBundle whose network weights are read only views of the
+    shared block, and the block, which must be kept open as long as the forecaster is used.
+    """
+    block = mpsm.SharedMemory(name=shared.name)
+    arrays = {}
+    for name, offset, shape in shared.layout:
+        array = np.ndarray(shape, dtype=float, buffer=block.buf, offset=offset*np.dtype(float).itemsize)
+        array.flags.writeable = False
+        arrays[name] = array
+    network = tbaon.Network(*[arrays[name] for name in WEIGHTS], *shared.activations)
+    normalizer = tbamd.normalizer_from_flat(arrays['normalizer']) if 'normalizer' in arrays else shared.normalizer
+    bundle = tbamd.Bundle(shared.kind, None, normalizer, shared.params)
+    return tbaon.Forecaster(bundle, network), block
+
+
+def test_shared():
+    import tinkerbell.app.scaler as tbasc
+    np.random.seed(42)
+    num_units = 3
+    network = tbaon.Network(np.random.normal(size=(2, 4*num_units)), np.random.normal(size=(num_units, 4*num_units)),
+      np.zeros(4*num_units), np.random.normal(size=(num_units, 1)), np.zeros(1))
+    normalizer = tbamd.NormalizerSeq(None, tbasc.Scaler((-1, 1)).fit([[0.0], [1.0]]),
+      tbasc.Scaler((0, 1)).fit([[1.0], [10.0]]))
+    bundle = tbamd.Bundle('lstmseqwin', None, normalizer, {'num_timesteps': 3, 'offset_forecast': 1})
+    with published(bundle, network=network) as shared:
+        forecaster, block = attach(shared)
+        assert not forecaster.network.kernel.flags.writeable
+        assert np.shares_memory(forecaster.network.kernel, np.ndarray(block.size, np.uint8, block.buf))
+        time, production = np.arange(8.0), np.linspace(10.0, 3.0, 8)
+        stage = (time > 4).astype(float)
+        expected = tbaon.rollout(tbaon.Forecaster(bundle, network), time, production, stage)
+        assert np.allclose(tbaon.rollout(forecaster, time, production, stage), expected)
+        del forecaster
+        block.close()
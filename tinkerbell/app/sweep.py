@@ -0,0 +1,161 @@
+"""
+Hyperparameter sweeps over the model trainers, trials run in parallel
+processes and are cached on disk by a hash of their parameters and data.
+"""
+import os
+import json
+import time as tm
+import hashlib
+import inspect
+import itertools as it
+import numpy as np
+import logging as log
+import tinkerbell.app.model as tbamd
+import tinkerbell.app.forecast as tbafc
+import tinkerbell.app.parallel as tbapa
+
+
+FNAME_METRICS = 'metrics.json'
+FNAME_BUNDLE = 'bundle'
+
+
+def grid(param_grid):
+    """
+    Returns the list of parameter dictionaries of the cartesian product
+    of param_grid, e.g. {'num_units': [3, 6], 'num_timesteps': [2, 3]}.
+    """
+    names = sorted(param_grid)
+    return [dict(zip(names, values)) for values in it.product(*[param_grid[name] for name in names])]
+
+
+def hash_data(*arrays):
+    sha = hashlib.sha1()
+    for array in arrays:
+        sha.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+    return sha.hexdigest()
+
+
+def _defaults(*fcts):
+    """
+    Returns the default values of the keyword parameters of fcts.
+    """
+    return {name: parameter.default for fct in fcts for name, parameter in inspect.signature(fct).parameters.items()
+      if parameter.default is not inspect.Parameter.empty}
+
+
+def trial_key(kind, params, data_key):
+    """
+    Returns the hash of a trial, params merged into the defaults of fit_bundle() and train(),
+    so a changed default does not reuse trials trained with the old one.
+    """
+    params = dict(_defaults(tbamd.fit_bundle, tbamd.train), **params)
+    key = json.dumps({'kind': kind, 'params': params, 'data': data_key}, sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def load_metrics(dirname_trial):
+    """
+    Returns the metrics of a completed trial, None if it has not completed.
+    """
+    try:
+        with open(os.path.join(dirname_trial, FNAME_METRICS)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def rmse(bundle, time, production, stage):
+    """
+    Returns the rmse of the rollout of the bundle beyond the observed samples it starts from.
+    """
+    yhat = tbafc.FORECASTERS[bundle.kind](bundle, time, production, stage)
+    num_init = tbafc.num_init(bundle)
+    return float(np.sqrt(np.mean((yhat[num_init:] - production[num_init:len(yhat)])**2)))
+
+
+def run_trial(kind, params, time, production, stage, dirname_trial):
+    """
+    Trains and scores a single trial, metrics are written last so a trial
+    interrupted half way is rerun.
+    """
+    os.makedirs(dirname_trial, exist_ok=True)
+    time_start = tm.time()
+    bundle = tbamd.fit_bundle(kind, time, production, stage, **params)
+    time_train = tm.time() - time_start
+    tbamd.save_bundle(bundle, os.path.join(dirname_trial, FNAME_BUNDLE))
+    metrics = {'kind': kind, 'params': params, 'rmse': rmse(bundle, time, production, stage),
+      'time_train': time_train}
+    with open(os.path.join(dirname_trial, FNAME_METRICS), 'w') as f:
+        json.dump(metrics, f, indent=4, sort_keys=True)
+    return metrics
+
+
+def _init_worker(num_threads):
+    tbapa.limit_threads(num_threads, num_threads)
+
+
+def _run_trial_worker(args):
+    try:
+        return run_trial(*args)
+    except Exception as e:
+        log.error('Trial {0} failed: {1}'.format(args[1], e))
+        return None
+
+
+def run_trials(kind, trials, time, production, stage, dirname_cache, num_workers=None, num_threads=1):
+    """
+    Returns the metrics of all trials in order, completed trials are read from the
+    cache and the rest run in a pool of workers, failed trials yield None.
+    """
+    data_key = hash_data(time, production, stage)
+    dirnames = [os.path.join(dirname_cache, trial_key(kind, params, data_key)) for params in trials]
+    metrics = [load_metrics(dirname) for dirname in dirnames]
+    todo = [i for i, m in enumerate(metrics) if m is None]
+    log.info('Sweep {0}: {1:d} of {2:d} trials cached.'.format(kind, len(trials)-len(todo), len(trials)))
+    if todo:
+        jobs = [(kind, trials[i], time, production, stage, dirnames[i]) for i in todo]
+        with tbapa.pool(num_workers, _init_worker, (num_threads,)) as workers:
+            for i, m in zip(todo, workers.imap(_run_trial_worker, jobs)):
+                metrics[i] = m
+    return metrics
+
+
+def sweep(kind, param_grid, time, production, stage, dirname_cache, num_workers=None, num_threads=1,
+          num_epochs_prune=None, fraction_keep=0.5):
+    """
+    Runs the grid of trials of a model kind and returns their metrics, best (lowest
+    rmse) first. If num_epochs_prune is given, all trials first run this many epochs
+    and only the best fraction_keep of them run the full num_epochs, the others are
+    returned with their pruning metrics and 'pruned' set.
+    """
+    trials = grid(param_grid)
+    if num_epochs_prune is not None:
+        trials_prune = [dict(params, num_epochs=num_epochs_prune) for params in trials]
+        metrics_prune = run_trials(kind, trials_prune, time, production, stage, dirname_cache,
+          num_workers, num_threads)
+        ranks = np.argsort([_score(m) for m in metrics_prune])
+        num_keep = max(1, int(np.ceil(fraction_keep*len(trials))))
+        ikeep = sorted(ranks[:num_keep])
+        pruned = [dict(metrics_prune[i], pruned=True) for i in ranks[num_keep:] if metrics_prune[i]]
+        trials = [trials[i] for i in ikeep]
+    else:
+        pruned = []
+    metrics = run_trials(kind, trials, time, production, stage, dirname_cache, num_workers, num_threads)
+    metrics = [dict(m, pruned=False) for m in metrics if m]
+    return sorted(metrics, key=_score) + sorted(pruned, key=_score)
+
+
+def _score(metrics):
+    if not metrics or not np.isfinite(metrics['rmse']):
+        return np.inf
+    return metrics['rmse']
+
+
+def test_grid():
+    trials = grid({'num_units': [3, 6], 'num_timesteps': [2, 3, 4]})
+    assert len(trials) == 6
+    assert trials[0] == {'num_timesteps': 2, 'num_units': 3}
+    keys = {trial_key('lstmseqwin', params, 'data') for params in trials}
+    assert len(keys) == 6
+    assert trial_key('lstmseqwin', trials[0], 'data') == trial_key('lstmseqwin', dict(trials[0]), 'data')
+    assert trial_key('lstmseqwin', {}, 'data') == trial_key('lstmseqwin', {'num_epochs': 1000, 'patience': None}, 'data')
@@ -0,0 +1,148 @@
+"""
+Training telemetry, per epoch records written to json lines or csv and
+a throttled console progress bar.
+"""
+import os
+import csv
+import json
+import time as tm
+import collections as coll
+import keras.callbacks as kec
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+History = coll.namedtuple("History", "history")
+COLUMNS = ('epoch', 'time', 'time_epoch', 'samples_per_second', 'loss', 'val_loss', 'rss')
+
+
+def rss():
+    """
+    Returns the resident set size of this process in bytes, None if unknown.
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class ProgressBar:
+    def __init__(self, num_iterations, interval=0.0):
+        """
+        Renders at most once per interval seconds, and always the last iteration.
+        """
+        self.fill = '█'
+        self.length = 50
+        self.decimals = 1
+        self.num_iterations = num_iterations
+        self.interval = interval
+        self.time_rendered = None
+
+    def __enter__(self):
+        self.update()
+        return self
+
+    def __exit__(self, *args):
+        print()
+
+    def update(self, iteration=0, history=None, samples_per_second=None):
+        iteration = iteration + 1
+        time_now = tm.time()
+        if self.time_rendered is not None and time_now - self.time_rendered < self.interval \
+          and iteration < self.num_iterations:
+            return
+        self.time_rendered = time_now
+        fraction = ("{0:." + str(self.decimals) + "f}").format(100.0*iteration/self.num_iterations)
+        num_filled = int(self.length * iteration // self.num_iterations)
+        bar = self.fill * num_filled + '-' * (self.length - num_filled)
+        loss = 0.0
+        if history:
+            try:
+                loss = history.history['loss'][-1]
+            except:
+                loss = history.history['loss']
+        throughput = ''
+        if samples_per_second:
+            throughput = ', %.0f samples/s' % samples_per_second
+        print('\rTraining |%s| %s%% complete, loss = %f%s.' % (bar, fraction, loss, throughput), end='\r')
+
+
+class Telemetry(kec.Callback):
+    def __init__(self, fname=None, num_samples=None, render=True, interval=0.5, initial_epoch=0):
+        """
+        Records wall time, throughput, losses and memory per epoch (see COLUMNS),
+        to fname as csv if it ends with .csv and as json lines otherwise.
+        Without num_samples throughput is only known where keras reports it.
+        A run resumed at initial_epoch > 0 appends to an existing fname, epochs
+        run again after the last checkpoint are recorded again.
+        """
+        super().__init__()
+        self.fname = fname
+        self.num_samples = num_samples
+        self.initial_epoch = initial_epoch
+        self.render = render
+        self.interval = interval
+        self.records = []
+
+    def on_train_begin(self, logs=None):
+        self.records = []
+        self.time_begin = tm.time()
+        self.file = None
+        if self.fname:
+            resumed = self.initial_epoch > 0 and os.path.exists(self.fname)
+            self.file = open(self.fname, 'a' if resumed else 'w', newline='')
+            if self.fname.endswith('.csv'):
+                self.writer = csv.DictWriter(self.file, COLUMNS)
+                if not resumed:
+                    self.writer.writeheader()
+        self.progress_bar = None
+        if self.render:
+            self.progress_bar = ProgressBar(self.params.get('epochs', 1), self.interval)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.time_epoch_begin = tm.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        time_now = tm.time()
+        time_epoch = time_now - self.time_epoch_begin
+        num_samples = self.num_samples or self.params.get('samples')
+        record = {'epoch': epoch, 'time': time_now - self.time_begin, 'time_epoch': time_epoch,
+          'samples_per_second': num_samples/time_epoch if num_samples and time_epoch > 0.0 else None,
+          'loss': _float(logs.get('loss')), 'val_loss': _float(logs.get('val_loss')), 'rss': rss()}
+        self.records += [record]
+        if self.file:
+            if self.fname.endswith('.csv'):
+                self.writer.writerow(record)
+            else:
+                self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+        if self.progress_bar:
+            self.progress_bar.update(epoch, History(logs) if 'loss' in logs else None,
+              record['samples_per_second'])
+
+    def on_train_end(self, logs=None):
+        if self.file:
+            self.file.close()
+        if self.progress_bar:
+            print()
+
+
+def _float(value):
+    return None if value is None else float(value)
+
+
+def read(fname):
+    """
+    Returns the records of a telemetry file as a list of dictionaries.
+    """
+    with open(fname) as f:
+        if fname.endswith('.csv'):
+            return [{k: (float(v) if v else None) for k, v in row.items()} for row in csv.DictReader(f)]
+        return [json.loads(line) for line in f]
@@ -1,3 +1,5 @@
 from . import point
 from . import curve
-from . import make
\ No newline at end of file
+from . import make
+from . import well
+from . import resample
\ No newline at end of file
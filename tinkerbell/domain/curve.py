@@ -1,6 +1,7 @@
 import numpy as np
 import scipy.interpolate as spint
 import unittest
+import tinkerbell.profiling as tbpf
 
 
 class Curve:
@@ -46,6 +47,7 @@ class Curve:
         """
         return flat_header(len(self.t), len(self.c))
 
+    @tbpf.profiled
     def xycoordinates(self, num_xvalues=200):
         minmax = np.min(self.t), np.max(self.t)
         xcoords = np.linspace(*minmax, num_xvalues)
@@ -2,8 +2,10 @@ from . import point as pt
 from . import curve as cv
 import numpy as np
 import scipy.interpolate as spint
+import tinkerbell.profiling as tbpf
 
 
+@tbpf.profiled
 def curve_lsq_fixed_knots(points, t, k):
     """
     Points, internal knots and order.
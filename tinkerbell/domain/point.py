@@ -1,5 +1,6 @@
 import json
 import numpy as np
+import tinkerbell.profiling as tbpf
 
 class Point:
     def __init__(self, x, y):
@@ -17,6 +18,7 @@ class Point:
         return self.coordinates[1]
 
 
+@tbpf.profiled
 def point_coordinates(pts, idx=None):
     """
     Returns concatenated list of all x (idx=0) or y (idx=1), or (x, y) (idx=None) coordinates
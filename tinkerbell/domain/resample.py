@@ -0,0 +1,217 @@
+"""
+Resampling of ragged batches of wells onto uniform time grids.
+
+All wells are concatenated into one flat array and every method is a sparse
+linear map from the flat samples to the flat grid, built once per set of
+timestamps and cached, so resampling production, stage or any other series
+with the same timestamps is a single matrix product.
+"""
+import hashlib
+import numpy as np
+import scipy.sparse as spsp
+import collections as coll
+import tinkerbell.profiling as tbpf
+import tinkerbell.domain.well as tbdwl
+
+
+METHODS = ('linear', 'cumulative', 'spline')
+NUM_CACHED = 32
+
+
+def _flat(times):
+    """
+    Returns the concatenated times and the offsets of the wells into them.
+    """
+    num_samples = np.array([len(time) for time in times])
+    if np.any(num_samples < 2):
+        raise ValueError('Resampling needs at least two samples per well.')
+    offsets = np.r_[0, np.cumsum(num_samples)]
+    return np.concatenate([np.asarray(time, dtype=float) for time in times]), offsets
+
+
+def _concatenate(values, dtype=None):
+    if isinstance(values, np.ndarray) and values.ndim == 1:
+        return values.astype(dtype) if dtype is not None else values
+    return np.concatenate([np.asarray(v, dtype=dtype) for v in values])
+
+
+def _interval(time, index_well, offsets, time_grid, index_well_grid):
+    """
+    Returns the flat index of the sample starting the interval of every grid point
+    and the interval fraction, a single searchsorted over all wells.
+    """
+    time_min = min(time.min(), time_grid.min())
+    span = max(time.max(), time_grid.max()) - time_min + 1.0
+    key = time - time_min + index_well*span
+    key_grid = time_grid - time_min + index_well_grid*span
+    index = np.searchsorted(key, key_grid, side='right') - 1
+    index = np.clip(index, offsets[:-1][index_well_grid], offsets[1:][index_well_grid] - 2)
+    time_delta = time[index+1] - time[index]
+    fraction = np.clip((time_grid - time[index]) / time_delta, 0.0, 1.0)
+    return index, fraction, time_delta
+
+
+class Resampler:
+    """
+    Maps the samples of wells with timestamps times (sequence of arrays) onto uniform
+    grids of step time_step starting at each first timestamp. time_step defaults to the
+    median step of all wells. Methods are
+      'linear'      linear interpolation of the samples,
+      'cumulative'  mean rate of the linear interpolant over every grid cell, conserves
+                    the produced volume of rate series,
+      'spline'      cubic Hermite interpolation with finite difference slopes.
+    """
+    def __init__(self, times, time_step=None, method='linear'):
+        if method not in METHODS:
+            raise ValueError('Unknown resampling method \'{0}\', expected one of {1}.'.format(method, METHODS))
+        self.method = method
+        time, self.offsets = _flat(times)
+        num_wells = len(self.offsets) - 1
+        index_well = np.repeat(np.arange(num_wells), np.diff(self.offsets))
+        if time_step is None:
+            time_delta = np.diff(time)
+            time_step = np.median(time_delta[index_well[1:] == index_well[:-1]])
+        self.time_step = float(time_step)
+        time_first, time_last = time[self.offsets[:-1]], time[self.offsets[1:]-1]
+        self.num_samples = np.floor((time_last - time_first) / self.time_step + 1e-9).astype(int) + 1
+        self.offsets_grid = np.r_[0, np.cumsum(self.num_samples)]
+        index_well_grid = np.repeat(np.arange(num_wells), self.num_samples)
+        self.time_grid = time_first[index_well_grid] + self.time_step*(np.arange(self.offsets_grid[-1]) -
+          self.offsets_grid[:-1][index_well_grid])
+        self._time = time
+        self._index_well = index_well
+        shape = (self.offsets_grid[-1], len(time))
+        rows = np.arange(shape[0])
+        if method == 'linear':
+            index, fraction, _ = _interval(time, index_well, self.offsets, self.time_grid, index_well_grid)
+            self.weights = spsp.csr_matrix((np.r_[1.0 - fraction, fraction], (np.r_[rows, rows],
+              np.r_[index, index+1])), shape=shape)
+        elif method == 'spline':
+            index, fraction, time_delta = _interval(time, index_well, self.offsets, self.time_grid, index_well_grid)
+            f2, f3 = fraction**2, fraction**3
+            h00, h10, h01, h11 = 2*f3 - 3*f2 + 1, f3 - 2*f2 + fraction, -2*f3 + 3*f2, f3 - f2
+            columns, values = [index, index+1], [h00, h01]
+            for node, h in ((index, h10), (index+1, h11)):
+                upper = np.minimum(node+1, self.offsets[1:][index_well_grid]-1)
+                lower = np.maximum(node-1, self.offsets[:-1][index_well_grid])
+                slope = time_delta*h / (time[upper] - time[lower])
+                columns += [upper, lower]
+                values += [slope, -slope]
+            self.weights = spsp.csr_matrix((np.concatenate(values), (np.tile(rows, 6), np.concatenate(columns))),
+              shape=shape)
+        else:
+            # cell edges half a step around the grid points, clipped to the observed span
+            edges = []
+            for sign in (-1.0, 1.0):
+                edge = np.clip(self.time_grid + sign*0.5*self.time_step, time_first[index_well_grid],
+                  time_last[index_well_grid])
+                index, fraction, time_delta = _interval(time, index_well, self.offsets, edge, index_well_grid)
+                # integral of the linear interpolant from time[index] to edge
+                partial = spsp.csr_matrix((np.r_[time_delta*(fraction - 0.5*fraction**2), time_delta*0.5*fraction**2],
+                  (np.r_[rows, rows], np.r_[index, index+1])), shape=shape)
+                edges += [(edge, index, partial)]
+            (edge_lower, self._index_lower, partial_lower), (edge_upper, self._index_upper, partial_upper) = edges
+            self._width = edge_upper - edge_lower
+            self.weights = (partial_upper - partial_lower).tocsr()
+
+    def _cumulative(self, values):
+        area = 0.5*(values[:-1] + values[1:])*np.diff(self._time)
+        area[self._index_well[1:] != self._index_well[:-1]] = 0.0
+        cumulative = np.r_[0.0, np.cumsum(area)]
+        return cumulative - np.repeat(cumulative[self.offsets[:-1]], np.diff(self.offsets))
+
+    @tbpf.profiled
+    def flat(self, values):
+        """
+        Returns the resampled values (sequence of arrays like times, or flat) concatenated.
+        """
+        values = _concatenate(values, float)
+        resampled = self.weights.dot(values)
+        if self.method == 'cumulative':
+            cumulative = self._cumulative(values)
+            resampled = (cumulative[self._index_upper] - cumulative[self._index_lower] + resampled) / self._width
+        return resampled
+
+    @tbpf.profiled
+    def previous(self, values):
+        """
+        Returns the flat resampled values holding the last sample at or before every
+        grid point, as for piecewise constant series like stage.
+        """
+        values = _concatenate(values)
+        num_wells = len(self.offsets) - 1
+        index_well_grid = np.repeat(np.arange(num_wells), self.num_samples)
+        index, fraction, _ = _interval(self._time, self._index_well, self.offsets, self.time_grid, index_well_grid)
+        return values[index + (fraction >= 1.0)]
+
+    def split(self, flat):
+        """
+        Returns the per well arrays of a flat resampled array.
+        """
+        return np.split(flat, self.offsets_grid[1:-1])
+
+    def padded(self, flat, fill=np.nan):
+        """
+        Returns (num_wells, max(num_samples)) padded with fill, rows as the wells.
+        """
+        matrix = np.full((len(self.num_samples), self.num_samples.max()), fill, dtype=np.asarray(flat).dtype)
+        mask = np.arange(matrix.shape[1]) < self.num_samples[:, np.newaxis]
+        matrix[mask] = flat
+        return matrix
+
+    def __call__(self, values):
+        return self.split(self.flat(values))
+
+
+_resamplers = coll.OrderedDict()
+
+
+def resampler(times, time_step=None, method='linear'):
+    """
+    Returns the Resampler of times, cached on the timestamps (the NUM_CACHED most recent).
+    """
+    sha = hashlib.sha1('{0}:{1}'.format(method, time_step).encode())
+    for time in times:
+        sha.update(np.ascontiguousarray(time, dtype=np.float64).tobytes())
+        sha.update(b'|')
+    key = sha.hexdigest()
+    if key in _resamplers:
+        _resamplers.move_to_end(key)
+    else:
+        _resamplers[key] = Resampler(times, time_step, method)
+        if len(_resamplers) > NUM_CACHED:
+            _resamplers.popitem(last=False)
+    return _resamplers[key]
+
+
+def resample_wells(wells, time_step=None, method='linear'):
+    """
+    Returns the wells (tbdwl.Well) on uniform grids, ready for the windowed trainers.
+    """
+    wells = list(wells)
+    sampler = resampler([well.time for well in wells], time_step, method)
+    times = sampler.split(sampler.time_grid)
+    productions = sampler([well.production for well in wells])
+    return [tbdwl.Well(well.name, time, production) for well, time, production in zip(wells, times, productions)]
+
+
+def test_resample():
+    np.random.seed(42)
+    times = [np.sort(np.r_[0.0, np.random.uniform(0.0, 20.0, num), 20.0]) for num in (30, 5, 50)]
+    values = [3.0 + 2.0*time for time in times]
+    for method in METHODS:
+        sampler = Resampler(times, 0.5, method)
+        assert np.array_equal(sampler.num_samples, [41, 41, 41])
+        for time, resampled in zip(sampler.split(sampler.time_grid), sampler(values)):
+            assert np.allclose(time, np.linspace(0.0, 20.0, 41))
+            if method == 'cumulative':
+                # interior cell means of a linear rate are the grid values, volume is conserved
+                assert np.allclose(resampled[1:-1], 3.0 + 2.0*time[1:-1])
+                assert np.isclose(np.sum(resampled[1:-1])*0.5 + (resampled[0] + resampled[-1])*0.25, 3.0*20.0 + 20.0**2)
+            else:
+                assert np.allclose(resampled, 3.0 + 2.0*time)
+    stages = [(time > 10.0).astype(int) for time in times]
+    sampler = Resampler(times, 0.5)
+    for time, stage, resampled in zip(times, stages, sampler.split(sampler.previous(stages))):
+        assert np.array_equal(resampled, stage[np.searchsorted(time, np.linspace(0.0, 20.0, 41), side='right') - 1])
+    assert resampler(times, 0.5) is resampler([time.copy() for time in times], 0.5)
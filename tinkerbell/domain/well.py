@@ -0,0 +1,72 @@
+import re
+import json
+import collections as coll
+import numpy as np
+
+
+Well = coll.namedtuple("Well", "name time production")
+
+
+def read_wells(fname):
+    """
+    Yields the wells of a multi-well source, either a json dictionary of
+    name -> {'time': [...], 'production': [...]} (as shale_fracflow00.json)
+    or a raw csv of 'Series i: name' blocks of x,y rows (as fracflowraw00.csv).
+    """
+    if fname.endswith('.json'):
+        with open(fname) as f:
+            yield from _wells_json(json.load(f))
+    else:
+        with open(fname) as f:
+            yield from _wells_series_csv(f)
+
+
+def safe_name(name):
+    """
+    Returns the well name lower case with runs of characters unsafe in file names replaced by '_'.
+    """
+    return re.sub(r'[^\w.-]+', '_', name.lower())
+
+
+def parse_wells(text, fname):
+    """
+    Returns the wells of the content text of a multi-well source fname, see read_wells.
+    """
+    if fname.endswith('.json'):
+        return list(_wells_json(json.loads(text)))
+    return list(_wells_series_csv(text.splitlines()))
+
+
+def _wells_json(data):
+    for name, data_well in data.items():
+        yield Well(name, np.array(data_well['time']), np.array(data_well['production']))
+
+
+def _wells_series_csv(lines):
+    name, time, production = None, [], []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('Series'):
+            if name is not None:
+                yield Well(name, np.array(time), np.array(production))
+            name, time, production = line.split(':', 1)[1].strip(), [], []
+        else:
+            x, y = line.split(',')
+            time += [float(x)]
+            production += [float(y)]
+    if name is not None:
+        yield Well(name, np.array(time), np.array(production))
+
+
+def test_read_wells():
+    wells_json = {well.name: well for well in read_wells('data_demo/shale_fracflow00.json')}
+    wells_csv = list(read_wells('data_demo/fracflowraw00.csv'))
+    assert len(wells_csv) == 6
+    assert wells_csv[0].name.startswith('Evenson')
+    assert np.allclose(wells_csv[0].time, wells_json['Evenson'].time)
+    assert len(wells_csv[0].time) == len(wells_csv[0].production)
+    with open('data_demo/fracflowraw00.csv') as f:
+        wells_parsed = parse_wells(f.read(), 'fracflowraw00.csv')
+    assert [w.name for w in wells_parsed] == [w.name for w in wells_csv]
@@ -0,0 +1,65 @@
+"""
+Deferred imports of heavy dependencies (keras/TensorFlow, sklearn, matplotlib),
+so that tinkerbell.domain and the numpy-only parts of tinkerbell.app start fast.
+"""
+import sys
+import time as tm
+import importlib
+import subprocess
+
+
+IMPORT_BUDGET = 2.0 # seconds for importing tinkerbell.domain and tinkerbell.app.make
+HEAVY_MODULES = ('tensorflow', 'keras', 'matplotlib', 'sklearn')
+
+
+class LazyModule:
+    """
+    Stands in for the module name, which is imported on first attribute access.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return '<lazy module \'{0}\'>'.format(self._name)
+
+
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+def submodules(package_name, names):
+    """
+    Returns a module __getattr__ importing the submodules names of package_name on
+    first access, e.g. __getattr__ = submodules(__name__, ('make', 'model')).
+    """
+    def __getattr__(name):
+        if name in names:
+            return importlib.import_module('.' + name, package_name)
+        raise AttributeError('module \'{0}\' has no attribute \'{1}\''.format(package_name, name))
+    return __getattr__
+
+
+def import_cost(*names):
+    """
+    Returns the time to import names in a fresh interpreter and the heavy modules it pulled in.
+    """
+    code = ('import sys, time; t = time.perf_counter(); import {0}; t = time.perf_counter() - t; '
+      'print(t); print(\' \'.join(m for m in {1} if m in sys.modules))').format(', '.join(names), HEAVY_MODULES)
+    out = subprocess.check_output([sys.executable, '-c', code]).decode().split('\n')
+    return float(out[0]), out[1].split()
+
+
+def test_import_budget():
+    time_import, heavy = import_cost('tinkerbell.domain', 'tinkerbell.app.make')
+    assert not heavy, heavy
+    assert time_import < IMPORT_BUDGET, time_import
+    _, heavy = import_cost('tinkerbell', 'tinkerbell.app.model', 'tinkerbell.app.plot', 'tinkerbell.app.forecast')
+    assert not heavy, heavy
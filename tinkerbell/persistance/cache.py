@@ -0,0 +1,153 @@
+"""
+Content addressed artifact store: every artifact is a directory named by
+the hash of what produced it, least recently used artifacts are evicted
+once the store exceeds its size limit.
+"""
+import os
+import json
+import shutil
+import pickle
+import hashlib
+import tempfile
+import numpy as np
+import logging as log
+
+
+FNAME_COMPLETE = '.complete'
+
+
+def _jsonable(obj):
+    if isinstance(obj, np.ndarray):
+        return {'ndarray': hashlib.sha1(np.ascontiguousarray(obj).tobytes()).hexdigest(),
+          'dtype': str(obj.dtype), 'shape': obj.shape}
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError('Cannot key an object of type \'{0}\'.'.format(type(obj).__name__))
+
+
+def key(*parts):
+    """
+    Returns the hash of parts, which are json serializable up to numpy arrays and scalars,
+    raises TypeError for other objects (whose repr would differ from run to run).
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=_jsonable).encode()).hexdigest()
+
+
+def size(dirname):
+    return sum(os.path.getsize(os.path.join(root, fname)) for root, _, fnames in os.walk(dirname)
+      for fname in fnames)
+
+
+class Cache:
+    def __init__(self, dirname, max_bytes=None):
+        self.dirname = dirname
+        self.max_bytes = max_bytes
+        os.makedirs(dirname, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.dirname, key[:2], key)
+
+    def has(self, key):
+        return os.path.exists(os.path.join(self.path(key), FNAME_COMPLETE))
+
+    def get(self, key):
+        """
+        Returns the directory of the artifact key, None if it is not stored.
+        """
+        if not self.has(key):
+            return None
+        os.utime(os.path.join(self.path(key), FNAME_COMPLETE))
+        return self.path(key)
+
+    def put(self, key, write):
+        """
+        Stores an artifact by calling write(dirname), the artifact only becomes
+        visible once write returned. Returns the artifact directory.
+        """
+        dirname = self.path(key)
+        os.makedirs(os.path.dirname(dirname), exist_ok=True)
+        dirname_tmp = tempfile.mkdtemp(dir=os.path.dirname(dirname), prefix='.tmp')
+        try:
+            write(dirname_tmp)
+            open(os.path.join(dirname_tmp, FNAME_COMPLETE), 'w').close()
+            if os.path.exists(dirname):
+                shutil.rmtree(dirname)
+            os.rename(dirname_tmp, dirname)
+        finally:
+            if os.path.exists(dirname_tmp):
+                shutil.rmtree(dirname_tmp)
+        self.evict(keep=key)
+        return dirname
+
+    def put_object(self, key, obj):
+        def write(dirname):
+            with open(os.path.join(dirname, 'object.pkl'), 'wb') as f:
+                pickle.dump(obj, f)
+        return self.put(key, write)
+
+    def get_object(self, key):
+        """
+        Returns the object stored by put_object, raises KeyError if it is not stored.
+        """
+        dirname = self.get(key)
+        if dirname is None:
+            raise KeyError(key)
+        with open(os.path.join(dirname, 'object.pkl'), 'rb') as f:
+            return pickle.load(f)
+
+    def entries(self):
+        """
+        Returns (last use, size in bytes, key) of all stored artifacts.
+        """
+        entries = []
+        for prefix in os.listdir(self.dirname):
+            dirname_prefix = os.path.join(self.dirname, prefix)
+            if not os.path.isdir(dirname_prefix):
+                continue
+            for key in os.listdir(dirname_prefix):
+                if self.has(key):
+                    time_used = os.path.getmtime(os.path.join(self.path(key), FNAME_COMPLETE))
+                    entries += [(time_used, size(self.path(key)), key)]
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used artifacts until the store fits max_bytes.
+        """
+        if self.max_bytes is None:
+            return
+        entries = sorted(self.entries())
+        num_bytes = sum(e[1] for e in entries)
+        for _, num_bytes_entry, key in entries:
+            if num_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            log.info('Evicting artifact {0}.'.format(key))
+            shutil.rmtree(self.path(key))
+            num_bytes -= num_bytes_entry
+
+
+def test_cache():
+    with tempfile.TemporaryDirectory() as dirname:
+        cache = Cache(dirname, max_bytes=3000)
+        keys = [key('stage', {'i': i, 'x': np.arange(3)}) for i in range(3)]
+        assert keys[0] != keys[1] and keys[0] == key('stage', {'x': np.arange(3), 'i': 0})
+        assert cache.get(keys[0]) is None
+        try:
+            cache.get_object(keys[0])
+            assert False
+        except KeyError:
+            pass
+        try:
+            key('stage', object())
+            assert False
+        except TypeError:
+            pass
+        cache.put_object(keys[0], np.zeros(100))
+        assert cache.has(keys[0])
+        assert np.array_equal(cache.get_object(keys[0]), np.zeros(100))
+        os.utime(os.path.join(cache.path(keys[0]), FNAME_COMPLETE), (0, 0))
+        cache.put_object(keys[1], np.zeros(200))
+        cache.put_object(keys[2], np.zeros(100))
+        assert not cache.has(keys[0]) and cache.has(keys[1]) and cache.has(keys[2])
@@ -0,0 +1,202 @@
+"""
+Memory mapped datasets of windowed feature/target tensors and a shuffling
+loader that prefetches batches on a background thread.
+
+A dataset is a directory of raw C ordered features.bin and targets.bin, the
+samples along the first axis, and meta.json holding dtype and shapes. Samples
+are appended in chunks, so datasets never need to fit in memory, and are read
+back through np.memmap. Loader.generator() with steps_per_epoch=len(loader)
+is what keras' fit expects from a generator.
+"""
+import os
+import json
+import queue
+import threading
+import numpy as np
+
+
+FNAME_META = 'meta.json'
+FNAME_FEATURES = 'features.bin'
+FNAME_TARGETS = 'targets.bin'
+
+
+class Writer:
+    def __init__(self, dirname, dtype='float32'):
+        """
+        Starts a new dataset in dirname, shapes are taken from the first chunk appended.
+        """
+        os.makedirs(dirname, exist_ok=True)
+        self.dirname = dirname
+        self.dtype = np.dtype(dtype)
+        self.num_samples = 0
+        self.shapes = None
+        self._files = [open(os.path.join(dirname, fname), 'wb') for fname in (FNAME_FEATURES, FNAME_TARGETS)]
+
+    def append(self, features, targets):
+        assert len(features) == len(targets), "Features and targets must have same number of samples."
+        shapes = [np.shape(features)[1:], np.shape(targets)[1:]]
+        if self.shapes is None:
+            self.shapes = shapes
+        elif shapes != self.shapes:
+            raise ValueError('Sample shapes {0} differ from the dataset\'s {1}.'.format(shapes, self.shapes))
+        for f, array in zip(self._files, (features, targets)):
+            f.write(np.ascontiguousarray(array, dtype=self.dtype).tobytes())
+        self.num_samples += len(features)
+
+    def close(self):
+        for f in self._files:
+            f.close()
+        with open(os.path.join(self.dirname, FNAME_META), 'w') as f:
+            json.dump({'dtype': self.dtype.str, 'num_samples': self.num_samples,
+              'shape_features': list(self.shapes[0]) if self.shapes else [],
+              'shape_targets': list(self.shapes[1]) if self.shapes else []}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def save(dirname, features, targets, dtype='float32'):
+    with Writer(dirname, dtype) as writer:
+        writer.append(features, targets)
+
+
+class Dataset:
+    def __init__(self, dirname):
+        """
+        Opens the dataset in dirname read only, features and targets are memmaps
+        (empty arrays if the dataset has no samples, empty files cannot be mapped).
+        """
+        with open(os.path.join(dirname, FNAME_META)) as f:
+            meta = json.load(f)
+        self.dirname = dirname
+        shapes = [(meta['num_samples'],) + tuple(meta[name]) for name in ('shape_features', 'shape_targets')]
+        if meta['num_samples'] == 0:
+            self.features, self.targets = [np.empty(shape, dtype=meta['dtype']) for shape in shapes]
+            return
+        self.features, self.targets = [np.memmap(os.path.join(dirname, fname), dtype=meta['dtype'], mode='r',
+          shape=shape) for fname, shape in zip((FNAME_FEATURES, FNAME_TARGETS), shapes)]
+
+    def __len__(self):
+        return len(self.features)
+
+    def batch(self, index):
+        """
+        Returns the features and targets of the samples index, gathered in file order.
+        """
+        index = np.sort(index)
+        return np.asarray(self.features[index]), np.asarray(self.targets[index])
+
+
+class Loader:
+    def __init__(self, dataset, batch_size, shuffle=True, num_prefetch=4, seed=None):
+        """
+        Batches of dataset in a new random order every epoch (shuffle), the next
+        num_prefetch batches are gathered on a background thread.
+        """
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.num_prefetch = num_prefetch
+        self._random = np.random.RandomState(seed)
+
+    def __len__(self):
+        return -(-len(self.dataset) // self.batch_size)
+
+    def batches(self, num_epochs=None):
+        """
+        Yields the (features, targets) batches of num_epochs epochs, for ever if None,
+        in this thread. An empty dataset yields nothing.
+        """
+        if not len(self.dataset):
+            return
+        epoch = 0
+        while num_epochs is None or epoch < num_epochs:
+            order = self._random.permutation(len(self.dataset)) if self.shuffle else np.arange(len(self.dataset))
+            for start in range(0, len(order), self.batch_size):
+                yield self.dataset.batch(order[start:start+self.batch_size])
+            epoch += 1
+
+    def generator(self, num_epochs=None):
+        """
+        As batches(), gathered ahead by a background thread.
+        """
+        batches = queue.Queue(maxsize=self.num_prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            """
+            Queues item unless the consumer stopped first, returns whether it was queued.
+            """
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for batch in self.batches(num_epochs):
+                    if not put(batch):
+                        return
+                put(done)
+            except Exception as e:
+                put(e)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is done:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+
+
+def test_dataset():
+    import tempfile
+    import time as tm
+    with tempfile.TemporaryDirectory() as dirname:
+        features = np.arange(2*3*10, dtype=float).reshape(10, 3, 2)
+        targets = np.arange(10, dtype=float).reshape(10, 1)
+        with Writer(dirname) as writer:
+            writer.append(features[:4], targets[:4])
+            writer.append(features[4:], targets[4:])
+        dataset = Dataset(dirname)
+        assert len(dataset) == 10 and dataset.features.shape == (10, 3, 2)
+        assert np.array_equal(dataset.features, features) and np.array_equal(dataset.targets, targets)
+        loader = Loader(dataset, 4, seed=42)
+        assert len(loader) == 3
+        batches = list(loader.generator(num_epochs=2))
+        assert len(batches) == 6 and [len(b[1]) for b in batches[:3]] == [4, 4, 2]
+        for X, y in batches:
+            assert np.array_equal(X[:, 0, 0] / 6, y[:, 0])
+        assert sorted(np.concatenate([y[:, 0] for _, y in batches[3:]])) == list(range(10))
+        # the producer stops when the consumer does
+        generator = loader.generator()
+        next(generator)
+        generator.close()
+        # also when it is left with the end of a finite run to queue
+        threads = set(threading.enumerate())
+        generator = Loader(dataset, 4, shuffle=False, num_prefetch=2).generator(num_epochs=1)
+        next(generator)
+        tm.sleep(0.2)
+        generator.close()
+        for _ in range(50):
+            if not set(threading.enumerate()) - threads:
+                break
+            tm.sleep(0.1)
+        assert not set(threading.enumerate()) - threads
+        with Writer(os.path.join(dirname, 'empty')):
+            pass
+        empty = Dataset(os.path.join(dirname, 'empty'))
+        assert len(empty) == 0 and list(Loader(empty, 4).generator()) == []
@@ -0,0 +1,188 @@
+"""
+Opt-in profiling of the library hot paths.
+
+Set the environment variable TINKERBELL_PROFILE to 1 to print a report
+to stderr at exit, or to a file name to write it there. Alternatively
+wrap code in the profiling() context manager. Disabled, a profiled
+function costs one flag test per call.
+"""
+import os
+import sys
+import atexit
+import functools
+import threading
+import contextlib
+import time as tm
+
+
+ENVIRONMENT_VARIABLE = 'TINKERBELL_PROFILE'
+
+_enabled = False
+_stats = {}
+_local = threading.local()
+
+
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def _enter(name):
+    _stack().append([name, tm.perf_counter(), 0.0])
+
+
+def _exit():
+    stack = _stack()
+    name, time_start, time_children = stack.pop()
+    time_elapsed = tm.perf_counter() - time_start
+    stats = _stats.setdefault(name, [0, 0.0, 0.0])
+    stats[0] += 1
+    stats[1] += time_elapsed
+    stats[2] += time_elapsed - time_children
+    if stack:
+        stack[-1][2] += time_elapsed
+
+
+def profiled(fct):
+    """
+    Decorator timing every call of fct while profiling is enabled.
+    """
+    name = '{0}.{1}'.format(fct.__module__, fct.__qualname__)
+
+    @functools.wraps(fct)
+    def ret_fct(*args, **kwargs):
+        if not _enabled:
+            return fct(*args, **kwargs)
+        _enter(name)
+        try:
+            return fct(*args, **kwargs)
+        finally:
+            _exit()
+    return ret_fct
+
+
+@contextlib.contextmanager
+def section(name):
+    """
+    Times the enclosed block under name while profiling is enabled.
+    """
+    if not _enabled:
+        yield
+        return
+    _enter(name)
+    try:
+        yield
+    finally:
+        _exit()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    _stats.clear()
+
+
+def stats():
+    """
+    Returns {name: (number of calls, cumulative time, self time)}.
+    """
+    return {name: tuple(s) for name, s in _stats.items()}
+
+
+def report(f=None, sort_by='self'):
+    """
+    Writes the table of profiled names sorted by 'self', 'cumulative' or 'calls' time.
+    """
+    f = f or sys.stderr
+    icolumn = {'calls': 0, 'cumulative': 1, 'self': 2}[sort_by]
+    rows = sorted(_stats.items(), key=lambda item: item[1][icolumn], reverse=True)
+    f.write('{0:>10s} {1:>12s} {2:>12s} {3:>12s}  {4}\n'.format('calls', 'cumulative', 'self', 'per call', 'name'))
+    for name, (num_calls, time_cumulative, time_self) in rows:
+        f.write('{0:10d} {1:12.6f} {2:12.6f} {3:12.6f}  {4}\n'.format(num_calls, time_cumulative, time_self,
+          time_cumulative/num_calls, name))
+
+
+def dump(fname=None, sort_by='self'):
+    if fname:
+        with open(fname, 'w') as f:
+            report(f, sort_by)
+    else:
+        report(sys.stderr, sort_by)
+
+
+@contextlib.contextmanager
+def profiling(fname=None, sort_by='self'):
+    """
+    Profiles the enclosed block and dumps the report to fname, or stderr, on exit.
+    If profiling is already enabled (e.g. by TINKERBELL_PROFILE), the statistics
+    collected so far are kept and included in the report.
+    """
+    enabled = _enabled
+    if not enabled:
+        reset()
+    enable()
+    try:
+        yield
+    finally:
+        if not enabled:
+            disable()
+        dump(fname, sort_by)
+
+
+def _enable_from_environment():
+    value = os.environ.get(ENVIRONMENT_VARIABLE, '')
+    if value and value != '0':
+        enable()
+        atexit.register(dump, None if value == '1' else value)
+
+
+_enable_from_environment()
+
+
+def test_profiling():
+    global _stats
+    @profiled
+    def inner():
+        tm.sleep(0.01)
+
+    @profiled
+    def outer():
+        inner()
+        inner()
+
+    enabled, stats_saved = _enabled, _stats
+    _stats = {}
+    disable()
+    try:
+        outer()
+        assert not stats()
+        with profiling(os.devnull):
+            outer()
+        s = stats()
+        name_outer = outer.__module__ + '.' + outer.__qualname__
+        name_inner = inner.__module__ + '.' + inner.__qualname__
+        assert s[name_outer][0] == 1 and s[name_inner][0] == 2
+        assert s[name_outer][1] >= s[name_inner][1] > 0.02
+        assert s[name_outer][2] < s[name_inner][1]
+        # enabled already, the block adds to the statistics collected so far
+        enable()
+        with profiling(os.devnull):
+            outer()
+        assert _enabled and stats()[name_outer][0] == 2
+    finally:
+        _stats = stats_saved
+        if enabled:
+            enable()
+        else:
+            disable()